@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -41,13 +42,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'movies.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before sessions and messages: cached anonymous pages skip them
+    'movies.page_cache.PageCacheMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'movies.routers.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'filmroom.urls'
@@ -74,13 +79,108 @@ WSGI_APPLICATION = 'filmroom.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
+#
+# FILMROOM_DATABASE selects the profile: 'sqlite' (default, SQLITE_TUNED=1 for WAL) or 'postgresql'.
+# PostgreSQL is configured from POSTGRES_* variables; POSTGRES_REPLICAS is a
+# comma-separated list of replica hosts that serve catalogue reads (movies.routers).
+
+DATABASE_PROFILE = os.environ.get('FILMROOM_DATABASE', 'sqlite')
+
+# SQLITE_TUNED=1 opts a single-node SQLite deployment into WAL (readers no longer
+# wait for writers), relaxed fsync, a memory-mapped file and a larger page cache.
+# Writers take the lock up front (BEGIN IMMEDIATE) and wait for it instead of
+# failing with "database is locked". See manage.py sqlite_optimize.
+SQLITE_TUNED_OPTIONS = {
+    'transaction_mode': 'IMMEDIATE',
+    'init_command': (
+        'PRAGMA journal_mode=WAL;'
+        'PRAGMA synchronous=NORMAL;'
+        'PRAGMA mmap_size=268435456;'
+        'PRAGMA cache_size=-65536;'
+        'PRAGMA busy_timeout=5000;'
+        'PRAGMA temp_store=MEMORY'
+    ),
+}
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+
+def postgres_database(host):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'filmroom'),
+        'USER': os.environ.get('POSTGRES_USER', 'filmroom'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': host,
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Persistent connections, checked before reuse after a restart or failover
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
+        # Behind PgBouncer in transaction mode server-side cursors (used by
+        # QuerySet.iterator(), e.g. the catalogue export) must be disabled
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER') == '1',
+        'OPTIONS': {},
+    }
+    if os.environ.get('POSTGRES_POOL') == '1':
+        # psycopg connection pool (requires psycopg[pool]); replaces persistent connections
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', '2')),
+            'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', '10')),
+            'timeout': int(os.environ.get('POSTGRES_POOL_TIMEOUT', '10')),
+        }
+    return database
+
+
+if DATABASE_PROFILE == 'postgresql':
+    DATABASES = {'default': postgres_database(os.environ.get('POSTGRES_HOST', 'localhost'))}
+    replica_hosts = [host.strip() for host in os.environ.get('POSTGRES_REPLICAS', '').split(',') if host.strip()]
+    for number, host in enumerate(replica_hosts, start=1):
+        DATABASES[f'replica{number}'] = {**postgres_database(host), 'TEST': {'MIRROR': 'default'}}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
     }
+    if os.environ.get('SQLITE_TUNED') == '1':
+        DATABASES['default']['OPTIONS'] = SQLITE_TUNED_OPTIONS
+    # SQLITE_REPLICAS=N adds N aliases of the same file to exercise the replica router locally
+    for number in range(1, int(os.environ.get('SQLITE_REPLICAS', '0')) + 1):
+        DATABASES[f'replica{number}'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['movies.routers.ReadReplicaRouter']
+# Seconds a client keeps reading from the primary after a write (read-your-writes)
+REPLICA_PIN_SECONDS = 5
+
+
+# Caches
+# 'default' holds catalogue versions, leaderboards, the similarity index version and
+# card fragments; 'pages' holds anonymous full pages (movies.page_cache). REDIS_URL
+# moves both to Redis so web workers, run_worker and management commands share the
+# data and its invalidation; otherwise each process keeps its own copy in memory.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'pages': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'filmroom-pages',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
 }
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'filmroom-data',
+    }
+    CACHES['pages'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'filmroom',
+    }
 
 
 # Password validation
@@ -123,3 +223,19 @@ MEDIA_ROOT = BASE_DIR / 'media'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = '/login/'
+
+# Query count / latency instrumentation (Server-Timing header and /metrics/)
+MOVIES_INSTRUMENTATION = True
+# 'log' or 'raise' (FILMROOM_QUERY_BUDGET_ACTION) for a view that exceeds its query budget
+MOVIES_QUERY_BUDGET_ACTION = os.environ.get('FILMROOM_QUERY_BUDGET_ACTION', 'log')
+# Bearer token for Prometheus scrapes of /metrics/ (staff users can always read it)
+MOVIES_METRICS_TOKEN = None
+# Part of every ETag (movies.conditional): change it with releases that change templates
+MOVIES_ETAG_VERSION = os.environ.get('FILMROOM_ETAG_VERSION', '1')
+# Catalogue routes served by async views under ASGI (movies.async_views):
+# any of 'list', 'detail', 'ajax_filter', e.g. FILMROOM_ASYNC_VIEWS=list,detail,ajax_filter
+MOVIES_ASYNC_VIEWS = [name for name in os.environ.get('FILMROOM_ASYNC_VIEWS', '').split(',') if name]
+# Anonymous full-page cache for movies:list and movies:detail (FILMROOM_PAGE_CACHE=0
+# disables it). Pages live in CACHES[MOVIES_PAGE_CACHE_ALIAS]
+MOVIES_PAGE_CACHE = os.environ.get('FILMROOM_PAGE_CACHE', '1') == '1'
+MOVIES_PAGE_CACHE_ALIAS = 'pages'
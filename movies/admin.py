@@ -1,35 +1,32 @@
 from django.contrib import admin
-from .models import Category, Genre, Movie, UserProfile
+from django.utils import timezone
+from .models import Category, Genre, Movie, Rating, Task, UserProfile
+from .ratings import edited_fields, refresh_rating
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-	list_display = ('name', 'get_movie_count')
+	list_display = ('name', 'movie_count')
 	search_fields = ('name',)
 	ordering = ('name',)
-	
-	def get_movie_count(self, obj):
-		return obj.get_movie_count()
-	get_movie_count.short_description = 'Movies'
+	readonly_fields = ('movie_count',)
 
 
 @admin.register(Genre)
 class GenreAdmin(admin.ModelAdmin):
-	list_display = ('name', 'get_movie_count')
+	list_display = ('name', 'movie_count')
 	search_fields = ('name',)
 	ordering = ('name',)
-	
-	def get_movie_count(self, obj):
-		return obj.get_movie_count()
-	get_movie_count.short_description = 'Movies'
+	readonly_fields = ('movie_count',)
 
 
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
-	list_display = ('title', 'author', 'category', 'rating', 'release_date', 'created_at', 'get_genres')
+	list_display = ('title', 'author', 'category', 'rating', 'rating_count', 'release_date', 'created_at', 'get_genres')
 	list_filter = ('category', 'genres', 'created_at', 'author', 'rating')
 	search_fields = ('title', 'description', 'author__username')
-	readonly_fields = ('created_at', 'updated_at')
+	# Рейтинг считается по голосам (movies.ratings), редактируется только оценка автора
+	readonly_fields = ('rating', 'rating_count', 'created_at', 'updated_at')
 	list_per_page = 25
 	
 	fieldsets = (
@@ -37,7 +34,7 @@ class MovieAdmin(admin.ModelAdmin):
 			'fields': ('title', 'description', 'category', 'genres')
 		}),
 		('Метаданные', {
-			'fields': ('author', 'release_date', 'poster', 'rating')
+			'fields': ('author', 'release_date', 'poster', 'author_rating', 'rating', 'rating_count')
 		}),
 		('Даты', {
 			'fields': ('created_at', 'updated_at'),
@@ -48,6 +45,56 @@ class MovieAdmin(admin.ModelAdmin):
 	def get_genres(self, obj):
 		return ', '.join([g.name for g in obj.genres.all()])
 	get_genres.short_description = 'Genres'
+	
+	def save_model(self, request, obj, form, change):
+		if not change:
+			super().save_model(request, obj, form, change)
+			return
+		obj.save(update_fields=edited_fields(form))
+		if 'author_rating' in form.changed_data:
+			refresh_rating(obj)
+
+
+@admin.register(Rating)
+class RatingAdmin(admin.ModelAdmin):
+	list_display = ('movie', 'user', 'score', 'updated_at')
+	list_filter = ('score',)
+	search_fields = ('movie__title', 'user__username')
+	# Голоса меняются только через movies.ratings: правка здесь разошлась бы с агрегатами фильма
+	readonly_fields = ('user', 'movie', 'score', 'created_at', 'updated_at')
+	list_select_related = ('movie', 'user')
+	list_per_page = 25
+	
+	def has_add_permission(self, request):
+		return False
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+	list_display = ('name', 'status', 'attempts', 'run_after', 'worker', 'updated_at')
+	list_filter = ('status', 'name')
+	search_fields = ('key',)
+	readonly_fields = [field.name for field in Task._meta.fields]
+	actions = ('retry_tasks',)
+	list_per_page = 25
+	
+	def has_add_permission(self, request):
+		return False
+	
+	@admin.action(description='Retry selected failed tasks')
+	def retry_tasks(self, request, queryset):
+		# Ещё одна попытка сверх max_attempts; ожидающий дубль по ключу не создаётся
+		queued = set(Task.objects.filter(status=Task.QUEUED, key__isnull=False).values_list('key', flat=True))
+		retried = 0
+		for task in queryset.filter(status=Task.FAILED):
+			if task.key is not None:
+				if task.key in queued:
+					continue
+				queued.add(task.key)
+			task.status, task.run_after, task.max_attempts = Task.QUEUED, timezone.now(), task.attempts + 1
+			task.save(update_fields=['status', 'run_after', 'max_attempts', 'updated_at'])
+			retried += 1
+		self.message_user(request, f'{retried} tasks queued for retry.')
 
 
 @admin.register(UserProfile)
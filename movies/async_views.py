@@ -0,0 +1,153 @@
+"""
+Асинхронные версии страниц каталога для ASGI.
+
+Данные выбираются через async ORM (acount, aget, aiterator) и полностью
+загружаются до рендеринга, поэтому шаблон рендерится прямо в цикле событий
+и сам в БД не обращается. Какие маршруты обслуживаются этими
+представлениями, задаёт настройка MOVIES_ASYNC_VIEWS (см. movies.urls).
+"""
+import json
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.paginator import InvalidPage
+from django.http import Http404, HttpResponseBadRequest
+from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.views import View
+
+from .cache import aget_catalogue_version, aget_categories, aget_genres
+from .conditional import amovie_detail_versions, make_etag, movie_detail_validators, taxonomy_version, viewer_version
+from .config import CACHE_TIMEOUT, MOVIES_COUNT_MODE, MOVIES_PAGINATION_MODE, MOVIES_PER_PAGE
+from .leaderboards import atop_movies
+from .mixins import (
+    AsyncConditionalGetMixin, AsyncReplicaReadMixin, CardsFragmentMixin, LeaderboardMixin, MovieFilterMixin,
+)
+from .models import Movie
+from .pagination import InvalidCursor, KeysetPaginator, apaginate
+from .ratings import auser_score
+from .similarity import aget_similarity_version, asimilar_movies
+from .utils import get_movie_context
+
+
+async def aload_user(request):
+    """
+    Загрузить пользователя (и сессию, из которой читаются сообщения) заранее,
+    вместе с профилем для навигации: иначе шаблон обратился бы к БД синхронно
+    """
+    if getattr(request, '_user_preloaded', False):
+        return request.user
+    user = await request.auser()
+    if user.is_authenticated:
+        user = await User.objects.select_related('profile').aget(pk=user.pk)
+    request.user = user
+    request._user_preloaded = True
+    return user
+
+
+class AsyncMovieListView(AsyncReplicaReadMixin, AsyncConditionalGetMixin, LeaderboardMixin, MovieFilterMixin, View):
+    template_name = 'movies/movie_list.html'
+    paginate_by = MOVIES_PER_PAGE
+    pagination_mode = MOVIES_PAGINATION_MODE
+    count_mode = MOVIES_COUNT_MODE
+    
+    async def aget_validators(self):
+        viewer_key = viewer_version(await aload_user(self.request), self.request)[0]
+        version = await aget_catalogue_version()
+        return make_etag('list', self.get_cache_key('page', version=version), viewer_key), None
+    
+    def is_cursor_mode(self):
+        return self.pagination_mode == 'cursor' or 'after' in self.request.GET
+    
+    async def paginate(self, queryset):
+        scope = self.get_leaderboard_scope()
+        top = await atop_movies(scope, self.paginate_by, queryset) if scope else None
+        if top is not None:
+            return self.leaderboard_page(queryset, self.paginate_by, *top)
+        if self.is_cursor_mode():
+            paginator = KeysetPaginator(queryset, self.paginate_by, count_mode=self.count_mode)
+            page = await paginator.apage(self.request.GET.get('after'))
+            await paginator.acount()
+            return paginator, page
+        number = self.request.GET.get('page') or 1
+        try:
+            return await apaginate(queryset, self.paginate_by, number)
+        except InvalidPage as exc:
+            raise Http404(f'Invalid page ({number}): {exc}')
+    
+    async def get(self, request):
+        await aload_user(request)
+        version = await aget_catalogue_version()
+        try:
+            paginator, page = await self.paginate(self.get_filtered_queryset())
+        except InvalidCursor:
+            return HttpResponseBadRequest('Invalid cursor')
+        context = {
+            'movies': page.object_list,
+            'object_list': page.object_list,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'cursor_mode': self.is_cursor_mode(),
+            'cards_cache_key': self.get_cache_key('movie_cards', version=version),
+            # Заменяет ленивый список из context processor
+            'categories': await aget_categories(version),
+            **await self.aget_facet_context(version),
+            **self.get_filter_context(),
+        }
+        return render(request, self.template_name, context)
+
+
+class AsyncAjaxFilterView(AsyncReplicaReadMixin, AsyncConditionalGetMixin, CardsFragmentMixin, MovieFilterMixin, View):
+    """Асинхронный AjaxFilterView: тот же фрагмент и те же заголовки"""
+    paginate_by = MOVIES_PER_PAGE
+    
+    async def aget_validators(self):
+        version = await aget_catalogue_version()
+        return make_etag('ajax', self.get_cache_key('ajax_filter', version=version)), None
+    
+    async def get(self, request):
+        version = await aget_catalogue_version()
+        key = self.get_cache_key('ajax_filter', version=version)
+        cached = await cache.aget(key)
+        if cached is None:
+            paginator = KeysetPaginator(self.get_filtered_queryset(), self.paginate_by)
+            try:
+                page = await paginator.apage(request.GET.get('after'))
+            except InvalidCursor:
+                return HttpResponseBadRequest('Invalid cursor')
+            
+            content = render_to_string('movies/_movie_cards.html', {'movies': page.object_list}, request)
+            cached = (content, *self.get_next_page(page), json.dumps(await self.aget_facets(version)))
+            await cache.aset(key, cached, CACHE_TIMEOUT)
+        return self.fragment_response(*cached)
+
+
+class AsyncMovieDetailView(AsyncReplicaReadMixin, AsyncConditionalGetMixin, View):
+    template_name = 'movies/movie_detail.html'
+    queryset = Movie.objects.select_related('category', 'author').prefetch_related('genres')
+    
+    async def aget_validators(self):
+        pk = self.kwargs['pk']
+        row = await amovie_detail_versions(pk)
+        if row is None:
+            return None, None
+        user = await aload_user(self.request)
+        taxonomy = taxonomy_version(await aget_categories(), await aget_genres())
+        return movie_detail_validators(
+            pk, row, taxonomy, viewer_version(user, self.request), await aget_similarity_version(),
+        )
+    
+    async def get(self, request, pk):
+        user = await aload_user(request)
+        try:
+            movie = await self.queryset.aget(pk=pk)
+        except Movie.DoesNotExist:
+            raise Http404('No movie found matching the query')
+        context = {
+            **get_movie_context(movie, user, await auser_score(user, movie.pk)),
+            'similar_movies': await asimilar_movies(movie.pk),
+            'object': movie,
+            'categories': await aget_categories(),
+        }
+        return render(request, self.template_name, context)
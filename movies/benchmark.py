@@ -0,0 +1,406 @@
+"""
+Нагрузочный стенд каталога.
+
+seed_catalogue() быстро (bulk_create, без сигналов) создаёт детерминированный
+синтетический каталог заданного размера, run_benchmark() прогоняет через
+тестовый клиент Django сценарии запросов (поиск, фильтр по жанрам, глубокая
+пагинация, профили) и считает перцентили задержки и число SQL-запросов.
+Результаты сохраняются в JSON и сравниваются с базовым прогоном (compare_results).
+
+run_concurrent() нагружает SQLite одновременно читателями и писателями и
+сравнивает режим по умолчанию (журнал отката) с SQLITE_TUNED_OPTIONS (WAL).
+"""
+import math
+import platform
+import random
+import threading
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import urlencode
+
+from .cache import bump_catalogue_version
+from .config import MOVIES_PER_PAGE
+from .counters import reconcile_counters
+from .leaderboards import reset_leaderboards
+from .models import Category, Genre, Movie, UserProfile
+from .search import get_search_backend
+
+
+CATEGORY_NAMES = ['Drama', 'Action', 'Comedy', 'Horror', 'Sci-Fi', 'Documentary', 'Animation', 'Western']
+GENRE_NAMES = [
+    'Adventure', 'Thriller', 'Romance', 'Mystery', 'Crime', 'Fantasy', 'Family', 'War',
+    'History', 'Music', 'Sport', 'Biography', 'Noir', 'Satire', 'Musical', 'Superhero',
+]
+WORDS = [
+    'shadow', 'river', 'empire', 'last', 'night', 'silent', 'city', 'storm', 'heart', 'iron',
+    'ghost', 'summer', 'winter', 'secret', 'garden', 'machine', 'island', 'broken', 'golden', 'star',
+    'road', 'wolf', 'mirror', 'fire', 'ocean', 'dream', 'hunter', 'crown', 'glass', 'north',
+]
+
+SEED_BATCH_SIZE = 5000
+
+
+def seed_catalogue(size, seed=42, using=DEFAULT_DB_ALIAS, progress=None):
+    """
+    Создать size фильмов с категориями, жанрами и авторами. Одинаковые
+    size и seed дают одинаковый каталог
+    """
+    rng = random.Random(seed)
+    Category.objects.using(using).bulk_create([Category(name=name) for name in CATEGORY_NAMES])
+    Genre.objects.using(using).bulk_create([Genre(name=name) for name in GENRE_NAMES])
+    category_ids = list(Category.objects.using(using).order_by('pk').values_list('pk', flat=True))
+    genre_ids = list(Genre.objects.using(using).order_by('pk').values_list('pk', flat=True))
+
+    # Авторы распределены по Парето: у первых пользователей тысячи фильмов
+    users = [User(username=f'bench{i:05d}', password='!') for i in range(max(10, size // 100))]
+    User.objects.using(using).bulk_create(users)
+    user_ids = list(User.objects.using(using).filter(username__startswith='bench').order_by('pk').values_list('pk', flat=True))
+    UserProfile.objects.using(using).bulk_create([UserProfile(user_id=pk) for pk in user_ids])
+
+    through = Movie.genres.through
+    first_release = date(1950, 1, 1)
+    for start in range(0, size, SEED_BATCH_SIZE):
+        count = min(SEED_BATCH_SIZE, size - start)
+        movies = []
+        for i in range(start, start + count):
+            rating = Decimal(rng.randint(1, 100)) / 10
+            movies.append(Movie(
+                title=f'{" ".join(rng.sample(WORDS, rng.randint(1, 3))).title()} {i}',
+                description=' '.join(rng.choices(WORDS, k=rng.randint(10, 40))),
+                release_date=first_release + timedelta(days=rng.randint(0, 27000)),
+                category_id=rng.choice(category_ids) if rng.random() > 0.05 else None,
+                author_id=user_ids[int(rng.paretovariate(1.16)) % len(user_ids)],
+                # Без голосов рейтинг совпадает с оценкой автора (movies.ratings)
+                rating=rating,
+                author_rating=rating,
+            ))
+        Movie.objects.using(using).bulk_create(movies)
+        through.objects.using(using).bulk_create([
+            through(movie_id=movie.pk, genre_id=genre_id)
+            for movie in movies
+            for genre_id in rng.sample(genre_ids, rng.randint(0, 5))
+        ])
+        if progress:
+            progress(start + count)
+
+    get_search_backend(using).rebuild(using=using)
+    reconcile_counters(using=using)
+    bump_catalogue_version(using=using)
+    reset_leaderboards()
+
+
+class Scenario:
+    """Именованный сценарий: url(rng, state) возвращает адрес следующего запроса"""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+
+
+def _genre_ids(state, rng, k):
+    return [('genre', pk) for pk in rng.sample(state['genre_ids'], k)]
+
+
+def _query(path, params):
+    return f'{path}?{urlencode(params)}' if params else path
+
+
+def _cursor_walk(rng, state):
+    # Следующая страница по курсору из предыдущего ответа, по кругу
+    url = state.get('next_url') or _query(reverse('movies:ajax_filter'), [('sort', '-rating')])
+    state['follow_next'] = True
+    return url
+
+
+SCENARIOS = [
+    Scenario('home', lambda rng, state: reverse('movies:list')),
+    Scenario('search', lambda rng, state: _query(reverse('movies:list'), [('q', rng.choice(WORDS))])),
+    Scenario('genre_filter', lambda rng, state: _query(reverse('movies:list'), _genre_ids(state, rng, 2))),
+    Scenario('combined_filter', lambda rng, state: _query(reverse('movies:list'), [
+        ('q', rng.choice(WORDS)), ('category', rng.choice(state['category_ids'])),
+        *_genre_ids(state, rng, 1), ('rating', 7), ('sort', '-rating'),
+    ])),
+    Scenario('deep_offset', lambda rng, state: _query(reverse('movies:list'), [
+        ('page', rng.randint(max(1, state['pages'] * 9 // 10), state['pages'])),
+    ])),
+    Scenario('ajax_filter', lambda rng, state: _query(reverse('movies:ajax_filter'), _genre_ids(state, rng, 1))),
+    Scenario('cursor_walk', _cursor_walk),
+    Scenario('detail', lambda rng, state: reverse('movies:detail', args=[rng.choice(state['movie_ids'])])),
+    Scenario('profile_heavy', lambda rng, state: reverse('movies:user_profile', args=[state['top_author']])),
+    Scenario('profile', lambda rng, state: reverse('movies:user_profile', args=[rng.choice(state['authors'])])),
+]
+SCENARIO_NAMES = [scenario.name for scenario in SCENARIOS]
+
+
+def percentile(values, p):
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def catalogue_state(using=DEFAULT_DB_ALIAS):
+    movies = Movie.objects.using(using)
+    total = movies.count()
+    authors = list(
+        User.objects.using(using).filter(movies__isnull=False).distinct().order_by('pk').values_list('username', flat=True)[:200]
+    )
+    top_author = (
+        movies.exclude(author=None).values('author__username')
+        .annotate(n=Count('pk')).order_by('-n').values_list('author__username', flat=True).first()
+    )
+    movie_ids = list(movies.order_by('pk').values_list('pk', flat=True)[:: max(1, total // 1000)])
+    return {
+        'pages': max(1, math.ceil(total / MOVIES_PER_PAGE)),
+        'genre_ids': list(Genre.objects.using(using).values_list('pk', flat=True)),
+        'category_ids': list(Category.objects.using(using).values_list('pk', flat=True)),
+        'movie_ids': movie_ids or [0],
+        'authors': authors or [top_author],
+        'top_author': top_author,
+    }
+
+
+def run_benchmark(scenarios=None, iterations=50, seed=42, warm=False, using=DEFAULT_DB_ALIAS, progress=None):
+    """Прогнать сценарии и вернуть статистику по каждому"""
+    rng = random.Random(seed)
+    state = catalogue_state(using=using)
+    client = Client()
+    connection = connections[using]
+    results = {}
+
+    for scenario in SCENARIOS:
+        if scenarios and scenario.name not in scenarios:
+            continue
+        timings, queries, statuses = [], [], {}
+        state.pop('next_url', None)
+        for _ in range(iterations):
+            url = scenario.url(rng, state)
+            if not warm:
+                # Включая страничный кэш: иначе холодный прогон отдаёт страницы из него
+                for alias in settings.CACHES:
+                    caches[alias].clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = client.get(url)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            if state.pop('follow_next', False):
+                state['next_url'] = response.get('X-Next-Page-Url')
+
+        results[scenario.name] = {
+            'requests': iterations,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'max_ms': round(max(timings), 3),
+            'queries_min': min(queries),
+            'queries_max': max(queries),
+            'queries_mean': round(sum(queries) / len(queries), 2),
+            'statuses': statuses,
+        }
+        if progress:
+            progress(scenario.name, results[scenario.name])
+    return results
+
+
+def benchmark_meta(size, seed, iterations, warm, using=DEFAULT_DB_ALIAS):
+    return {
+        'size': size,
+        'seed': seed,
+        'iterations': iterations,
+        'warm_cache': warm,
+        'database': connections[using].vendor,
+        'django': django.get_version(),
+        'python': platform.python_version(),
+        'timestamp': timezone.now().isoformat(),
+    }
+
+
+def compare_results(current, baseline, threshold=20, min_delta_ms=2.0):
+    """
+    Сравнить прогон с базовым. Регрессия - рост p95 больше чем на threshold
+    процентов (и не меньше min_delta_ms, чтобы не ловить шум на быстрых
+    страницах) или рост максимального числа запросов
+    """
+    rows = []
+    for name, result in current['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100 if base['p95_ms'] else 0.0
+        slower = change > threshold and result['p95_ms'] - base['p95_ms'] >= min_delta_ms
+        regressed = slower or result['queries_max'] > base['queries_max']
+        rows.append({
+            'scenario': name,
+            'p95_ms': result['p95_ms'],
+            'baseline_p95_ms': base['p95_ms'],
+            'p95_change_pct': round(change, 1),
+            'queries_max': result['queries_max'],
+            'baseline_queries_max': base['queries_max'],
+            'regressed': regressed,
+        })
+    return rows
+
+
+CONCURRENT_READ_SCENARIOS = ['home', 'search', 'genre_filter', 'detail', 'profile']
+PROFILE_UPDATE_EVERY = 5
+DUMMY_CACHE = {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+
+
+def sqlite_modes():
+    """Сравниваемые настройки соединения: режим по умолчанию и SQLITE_TUNED_OPTIONS"""
+    return {
+        # journal_mode сохраняется в файле, поэтому явно возвращаем журнал отката
+        'default': {'init_command': 'PRAGMA journal_mode=DELETE'},
+        'tuned': dict(settings.SQLITE_TUNED_OPTIONS),
+    }
+
+
+def _is_locked(exc):
+    return 'locked' in str(exc) or 'busy' in str(exc)
+
+
+def _reader(state, seed, deadline, stats):
+    rng = random.Random(seed)
+    scenarios = [scenario for scenario in SCENARIOS if scenario.name in CONCURRENT_READ_SCENARIOS]
+    client = Client()
+    while time.perf_counter() < deadline:
+        url = rng.choice(scenarios).url(rng, state)
+        start = time.perf_counter()
+        try:
+            client.get(url)
+        except OperationalError as exc:
+            if not _is_locked(exc):
+                raise
+            stats['locked'] += 1
+            continue
+        stats['timings'].append((time.perf_counter() - start) * 1000)
+
+
+def _writer(state, seed, deadline, stats, using):
+    rng = random.Random(seed)
+    written = 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            rating = Decimal(rng.randint(1, 100)) / 10
+            with transaction.atomic(using=using):
+                movie = Movie.objects.using(using).create(
+                    title=f'{rng.choice(WORDS).title()} concurrent {seed}-{written}',
+                    description=' '.join(rng.choices(WORDS, k=20)),
+                    category_id=rng.choice(state['category_ids']),
+                    author_id=rng.choice(state['author_ids']),
+                    rating=rating,
+                    author_rating=rating,
+                )
+                movie.genres.set(rng.sample(state['genre_ids'], 2))
+            if written % PROFILE_UPDATE_EVERY == 0:
+                profile = UserProfile.objects.using(using).get(user_id=rng.choice(state['author_ids']))
+                profile.bio = ' '.join(rng.choices(WORDS, k=8))
+                profile.save()
+        except OperationalError as exc:
+            if not _is_locked(exc):
+                raise
+            stats['locked'] += 1
+            continue
+        written += 1
+        stats['timings'].append((time.perf_counter() - start) * 1000)
+
+
+def _worker(target, *args, errors):
+    try:
+        target(*args)
+    except Exception as exc:
+        # Иначе упавший поток только напечатает трассировку, а режим получит 0 операций
+        errors.append(exc)
+    finally:
+        # У каждого потока своё соединение
+        connections.close_all()
+
+
+def _summary(timings, locked, duration):
+    if not timings:
+        return {'operations': 0, 'per_second': 0.0, 'locked_errors': locked}
+    return {
+        'operations': len(timings),
+        'per_second': round(len(timings) / duration, 1),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'max_ms': round(max(timings), 3),
+        'locked_errors': locked,
+    }
+
+
+def run_concurrent(readers=4, writers=2, duration=10.0, seed=42, modes=None, using=DEFAULT_DB_ALIAS, progress=None):
+    """
+    Для каждого режима SQLite в течение duration секунд гонять readers
+    читающих и writers пишущих потоков. База должна быть файлом: потоки
+    открывают к ней отдельные соединения
+    """
+    settings_dict = connections[using].settings_dict
+    original_options = settings_dict.get('OPTIONS', {})
+    state = catalogue_state(using=using)
+    state['author_ids'] = list(
+        UserProfile.objects.using(using).order_by('pk').values_list('user_id', flat=True)[:200]
+    )
+    results = {}
+    try:
+        # Без кэшей (и страничного тоже): измеряем конкуренцию за базу, а не попадания в кэш
+        with override_settings(CACHES={alias: DUMMY_CACHE for alias in settings.CACHES}):
+            for name, options in sqlite_modes().items():
+                if modes and name not in modes:
+                    continue
+                connections.close_all()
+                settings_dict['OPTIONS'] = options
+                read_stats = [{'timings': [], 'locked': 0} for _ in range(readers)]
+                write_stats = [{'timings': [], 'locked': 0} for _ in range(writers)]
+                errors = []
+                deadline = time.perf_counter() + duration
+                threads = [
+                    threading.Thread(
+                        target=_worker, args=(_reader, state, seed + i, deadline, stats), kwargs={'errors': errors},
+                    )
+                    for i, stats in enumerate(read_stats)
+                ] + [
+                    threading.Thread(
+                        target=_worker, args=(_writer, state, seed + i, deadline, stats, using),
+                        kwargs={'errors': errors},
+                    )
+                    for i, stats in enumerate(write_stats)
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                if errors:
+                    raise errors[0]
+                results[name] = {
+                    'reads': _summary(
+                        [t for stats in read_stats for t in stats['timings']],
+                        sum(stats['locked'] for stats in read_stats), duration,
+                    ),
+                    'writes': _summary(
+                        [t for stats in write_stats for t in stats['timings']],
+                        sum(stats['locked'] for stats in write_stats), duration,
+                    ),
+                }
+                if progress:
+                    progress(name, results[name])
+    finally:
+        connections.close_all()
+        settings_dict['OPTIONS'] = original_options
+    return results
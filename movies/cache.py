@@ -0,0 +1,109 @@
+"""
+Версионированный кэш данных каталога.
+
+Ключи содержат номер поколения каталога; любое изменение Movie, Category
+или Genre (см. movies.signals) увеличивает поколение, и старые записи
+просто перестают читаться. Функции с префиксом a - то же для асинхронных
+представлений (movies.async_views).
+"""
+import time
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .config import CACHE_TIMEOUT
+from .models import Category, Genre
+
+
+CATALOGUE_VERSION_KEY = 'movies:catalogue:version'
+
+
+def get_catalogue_version():
+    """Текущее поколение каталога"""
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        # Начальное значение от времени, чтобы после вытеснения ключа
+        # не вернуться к уже использованному номеру
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def _bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def bump_catalogue_version(using=None):
+    """
+    Сбросить кэш каталога. Поколение увеличивается сразу и ещё раз после
+    коммита, чтобы данные, прочитанные до коммита, не остались в кэше
+    """
+    _bump_catalogue_version()
+    transaction.on_commit(_bump_catalogue_version, using=using)
+
+
+async def aget_catalogue_version():
+    version = await cache.aget(CATALOGUE_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = await cache.aget(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def is_shared_cache(alias=DEFAULT_CACHE_ALIAS):
+    """Видят ли этот кэш другие процессы: сброс из run_worker и команд доходит до веб-процессов"""
+    return not isinstance(caches[alias], (LocMemCache, DummyCache))
+
+
+def catalogue_key(name, version=None):
+    """Ключ кэша поколения version (по умолчанию - текущего)"""
+    if version is None:
+        version = get_catalogue_version()
+    return f'movies:catalogue:{version}:{name}'
+
+
+def get_or_build(name, builder, timeout=CACHE_TIMEOUT):
+    """Прочитать значение из кэша текущего поколения или построить его"""
+    key = catalogue_key(name)
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, timeout)
+    return value
+
+
+async def aget_or_build(name, builder, version=None, timeout=CACHE_TIMEOUT):
+    """get_or_build для асинхронного кода: builder - корутинная функция"""
+    if version is None:
+        version = await aget_catalogue_version()
+    key = catalogue_key(name, version)
+    value = await cache.aget(key)
+    if value is None:
+        value = await builder()
+        await cache.aset(key, value, timeout)
+    return value
+
+
+async def _alist(queryset):
+    return [obj async for obj in queryset.aiterator()]
+
+
+def get_categories():
+    return get_or_build('categories', lambda: list(Category.objects.all()))
+
+
+def get_genres():
+    return get_or_build('genres', lambda: list(Genre.objects.all()))
+
+
+async def aget_categories(version=None):
+    return await aget_or_build('categories', lambda: _alist(Category.objects.all()), version)
+
+
+async def aget_genres(version=None):
+    return await aget_or_build('genres', lambda: _alist(Genre.objects.all()), version)
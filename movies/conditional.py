@@ -0,0 +1,113 @@
+"""
+Условные GET: валидаторы ETag и Last-Modified.
+
+Валидаторы считаются до рендеринга - одним коротким запросом или вовсе из
+кэша, - и если клиент (или CDN) прислал If-None-Match / If-Modified-Since
+с актуальной версией, сразу отдаётся 304 без выборки данных и шаблонов.
+MOVIES_ETAG_VERSION входит в каждый ETag: его смена после выкладки
+с изменёнными шаблонами сбрасывает все сохранённые у клиентов версии.
+"""
+import hashlib
+from calendar import timegm
+
+from django.conf import settings
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+
+from .models import Movie
+
+
+def make_etag(*parts):
+    payload = ':'.join(str(part) for part in (getattr(settings, 'MOVIES_ETAG_VERSION', ''), *parts))
+    return quote_etag(hashlib.md5(payload.encode()).hexdigest())
+
+
+def _timestamp(value):
+    return timegm(value.utctimetuple()) if value else None
+
+
+def conditional_response(request, etag, last_modified):
+    """304 (или 412), если у клиента актуальная версия, иначе None"""
+    return get_conditional_response(request, etag=etag, last_modified=_timestamp(last_modified))
+
+
+def set_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        if last_modified:
+            response.headers.setdefault('Last-Modified', http_date(_timestamp(last_modified)))
+    return response
+
+
+def has_pending_messages(request):
+    """
+    Ждут ли показа сообщения (django.contrib.messages): такую страницу нельзя
+    отдавать как 304 - сообщение осталось бы непоказанным
+    """
+    if request.COOKIES.get(CookieStorage.cookie_name):
+        return True
+    session = getattr(request, 'session', None)
+    return session is not None and bool(session.get(SessionStorage.session_key))
+
+
+async def ahas_pending_messages(request):
+    if request.COOKIES.get(CookieStorage.cookie_name):
+        return True
+    session = getattr(request, 'session', None)
+    return session is not None and bool(await session.aget(SessionStorage.session_key))
+
+
+def viewer_version(user, request):
+    """
+    Что на странице зависит от посетителя: навигация (имя, аватар из профиля)
+    и кнопки автора / сотрудника. Профиль загружается один раз и нужен шаблону.
+    У вошедшего в версию входят cookie сессии и CSRF: после входа они меняются,
+    и страница с формами не остаётся у клиента со старым CSRF-токеном
+    """
+    if not user.is_authenticated:
+        return 'anonymous', None
+    profile = getattr(user, 'profile', None)
+    updated_at = profile.updated_at if profile else None
+    # get_token() заводит секрет CSRF, если его ещё нет: ETag - по тому, что уйдёт в ответе
+    get_token(request)
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    csrf = request.META.get('CSRF_COOKIE', '')
+    return f'{user.pk}:{user.username}:{user.is_staff}:{updated_at}:{session}:{csrf}', updated_at
+
+
+def taxonomy_version(categories, genres):
+    """Названия категорий и жанров (списки из кэша каталога, без запросов)"""
+    return hashlib.md5(repr([(c.pk, c.name) for c in categories] + [(g.pk, g.name) for g in genres]).encode()).hexdigest()
+
+
+# Всё, что выводит страница фильма помимо собственных полей: автор и категория
+DETAIL_VERSION_FIELDS = (
+    'updated_at', 'author__profile__updated_at',
+    'author__username', 'author__first_name', 'author__last_name', 'category__name',
+)
+
+
+def movie_detail_versions(pk):
+    """Строка DETAIL_VERSION_FIELDS фильма или None"""
+    return Movie.objects.filter(pk=pk).values_list(*DETAIL_VERSION_FIELDS).first()
+
+
+async def amovie_detail_versions(pk):
+    return await Movie.objects.filter(pk=pk).values_list(*DETAIL_VERSION_FIELDS).afirst()
+
+
+def movie_detail_validators(pk, row, taxonomy, viewer, similar_version=0):
+    """
+    ETag и Last-Modified страницы фильма. Жанры фильма меняют updated_at
+    (movies.signals), их названия входят в taxonomy. Счётчики категорий
+    в навигации на ETag не влияют и обновятся со следующим изменением фильма.
+    similar_version - версия индекса похожих фильмов (movies.similarity)
+    """
+    viewer_key, viewer_updated = viewer
+    updated_at, author_updated = row[0], row[1]
+    last_modified = max(value for value in (updated_at, author_updated, viewer_updated) if value)
+    return make_etag('detail', pk, *row, taxonomy, similar_version, viewer_key), last_modified
@@ -3,10 +3,17 @@
 # Pagination
 MOVIES_PER_PAGE = 12
 USERS_PER_PAGE = 20
+PROFILE_MOVIES_PER_PAGE = 20  # movies per page on a user profile
+MOVIES_PAGINATION_MODE = 'offset'  # 'offset' or 'cursor' (keyset, no OFFSET scans)
+MOVIES_COUNT_MODE = 'exact'  # cursor mode only: 'exact', 'estimate' or 'none'
+COUNT_ESTIMATE_CAP = 1000
 
 # File uploads
 MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
 
+# Import (movies.importer): rejected rows kept for the report; every one is also logged
+IMPORT_MAX_ERRORS = 20
+
 # Search
 MIN_SEARCH_LENGTH = 2
 MAX_SEARCH_LENGTH = 100
@@ -15,8 +22,40 @@ MAX_SEARCH_LENGTH = 100
 MIN_RATING = 0
 MAX_RATING = 10
 
+# User votes (movies.ratings): whole scores in [MIN_VOTE, MAX_VOTE]. Movie.rating is
+# their Bayesian average with the author's rating (RATING_PRIOR_MEAN without one)
+# counted as RATING_PRIOR_VOTES votes, so a handful of votes cannot swing the order
+MIN_VOTE = 1
+MAX_VOTE = MAX_RATING
+RATING_PRIOR_MEAN = 6
+RATING_PRIOR_VOTES = 5
+# Drifted movies rewritten per UPDATE by reconcile_ratings
+RECONCILE_CHUNK_SIZE = 500
+
+# Rating facet buckets: (min inclusive, max exclusive or None), highest first
+RATING_FACETS = [(9, None), (8, 9), (7, 8), (5, 7), (0, 5)]
+
 # Cache
 CACHE_TIMEOUT = 300  # 5 minutes
+PAGE_CACHE_TIMEOUT = 600  # anonymous full pages (movies.page_cache), invalidated by signals
+
+# Leaderboards (movies.leaderboards): places served from the cache, spare places
+# that absorb rating drops without a rebuild, and how long a board lives
+LEADERBOARD_SIZE = MOVIES_PER_PAGE
+LEADERBOARD_SLACK = MOVIES_PER_PAGE
+LEADERBOARD_TIMEOUT = 60 * 60
+# Board lock expiry (movies.leaderboards); a board locked by another update is dropped, not waited for
+LEADERBOARD_LOCK_TIMEOUT = 5
+
+# Similar movies (movies.similarity): neighbours stored per movie, feature weights
+# of the cosine similarity, words per movie, posting lists cut to the best-rated
+# movies, candidates scored exactly, and rows per batch of build_similarity
+SIMILAR_MOVIES = 6
+SIMILAR_WEIGHTS = {'genre': 1.0, 'category': 0.6, 'text': 0.4}
+SIMILAR_TEXT_TERMS = 24
+SIMILAR_MAX_POSTING = 2000
+SIMILAR_MAX_CANDIDATES = 300
+SIMILAR_CHUNK_SIZE = 2000
 
 # Sorting options
 MOVIE_SORT_OPTIONS = [
@@ -31,3 +70,46 @@ MOVIE_SORT_OPTIONS = [
 # Avatar sizes
 AVATAR_SIZE = (200, 200)
 POSTER_SIZE = (300, 450)
+
+# Image renditions generated next to the original upload (name -> size)
+POSTER_RENDITIONS = {
+    'card': POSTER_SIZE,
+    'detail': (400, 600),
+    'retina': (800, 1200),
+}
+AVATAR_RENDITIONS = {
+    'avatar': AVATAR_SIZE,
+    'avatar_2x': (AVATAR_SIZE[0] * 2, AVATAR_SIZE[1] * 2),
+}
+RENDITION_FORMATS = [('webp', 'WEBP'), ('jpg', 'JPEG')]
+RENDITION_QUALITY = 80
+
+# Background tasks (movies.tasks, run_worker): attempts before a task is marked failed,
+# first retry delay in seconds (doubled on every retry), lease after which a task of a
+# vanished worker is retried (must exceed the longest task), idle poll interval and
+# how long finished tasks are kept
+TASK_MAX_ATTEMPTS = 5
+TASK_RETRY_DELAY = 10
+TASK_LEASE = 600
+TASK_POLL_INTERVAL = 1.0
+TASK_RETENTION = 24 * 60 * 60
+
+# Catalogue export: rows fetched (and genres prefetched) per database round trip
+EXPORT_CHUNK_SIZE = 2000
+
+# SQL query budgets per URL name (InstrumentationMiddleware); MOVIES_QUERY_BUDGETS in settings overrides
+QUERY_BUDGETS = {
+    'movies:list': 10,
+    'movies:ajax_filter': 4,
+    'movies:export': 4,
+    'movies:detail': 10,
+    'movies:create': 8,
+    'movies:edit': 14,  # a new author rating also recomputes the movie rating
+    'movies:rate': 12,
+    'movies:delete': 10,
+    'movies:profile': 10,
+    'movies:user_profile': 12,
+    'movies:profile_edit': 6,
+    'movies:profile_movies': 4,
+    'movies:metrics': 4,
+}
@@ -1,12 +1,19 @@
-from .models import Category, Genre, Movie
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_categories, get_genres
+from .config import CACHE_TIMEOUT
+from .leaderboards import get_popular_movies
 
 
 def categories(request):
-    """Добавить все категории в контекст каждого шаблона"""
+    """
+    Добавить все категории в контекст каждого шаблона.
+    Списки берутся из кэша и только если шаблон их действительно читает
+    """
     return {
-        'categories': Category.objects.all(),
-        'genres': Genre.objects.all(),
-        'popular_movies': Movie.objects.order_by('-rating')[:5],
+        'categories': SimpleLazyObject(get_categories),
+        'genres': SimpleLazyObject(get_genres),
+        'popular_movies': SimpleLazyObject(get_popular_movies),
     }
 
 
@@ -16,4 +23,5 @@ def site_config(request):
         'site_title': 'FilmRoom',
         'site_description': 'Discover and share your favorite movies',
         'version': '2.0',
+        'cache_timeout': CACHE_TIMEOUT,
     }
@@ -0,0 +1,57 @@
+"""
+Денормализованные счётчики фильмов в Category.movie_count и Genre.movie_count.
+
+Инкрементально обновляются из movies.signals, reconcile_counters
+пересчитывает их целиком одним UPDATE на таблицу. Уменьшение не опускает
+разошедшийся счётчик ниже нуля (поле PositiveIntegerField).
+"""
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Category, Genre, Movie
+
+
+def _adjusted(delta):
+    if delta > 0:
+        return F('movie_count') + delta
+    return Greatest(F('movie_count') + delta, Value(0))
+
+
+def adjust_category_count(category_id, delta, using=DEFAULT_DB_ALIAS):
+    if category_id is None or not delta:
+        return
+    Category.objects.using(using).filter(pk=category_id).update(movie_count=_adjusted(delta))
+
+
+def adjust_genre_counts(genre_ids, delta, using=DEFAULT_DB_ALIAS):
+    """Изменить счётчики жанров; genre_ids может содержать повторы"""
+    by_delta = {}
+    for genre_id, times in Counter(genre_ids).items():
+        by_delta.setdefault(times * delta, []).append(genre_id)
+    for amount, ids in by_delta.items():
+        if amount:
+            Genre.objects.using(using).filter(pk__in=ids).update(movie_count=_adjusted(amount))
+
+
+def _count_subquery(model, field):
+    counts = (
+        Movie.genres.through.objects if model is Genre else Movie.objects
+    ).filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(c=Count('*')).values('c')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def reconcile_counters(using=DEFAULT_DB_ALIAS):
+    """
+    Пересчитать счётчики с нуля. Возвращает число исправленных
+    категорий и жанров
+    """
+    fixed = []
+    for model, field in ((Category, 'category'), (Genre, 'genre')):
+        actual = _count_subquery(model, field)
+        drifted = model.objects.using(using).annotate(actual=actual).filter(~Q(movie_count=F('actual')))
+        fixed.append(drifted.count())
+        model.objects.using(using).update(movie_count=actual)
+    return tuple(fixed)
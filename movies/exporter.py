@@ -0,0 +1,160 @@
+"""
+Потоковая выгрузка каталога в CSV, JSON Lines или Parquet.
+
+Фильмы читаются через .iterator(chunk_size=...) с подгрузкой жанров на каждую
+пачку, а вывод отдаётся кусками, поэтому память не зависит от размера каталога.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+
+from .config import EXPORT_CHUNK_SIZE
+from .importer import batched
+from .models import Genre, Movie
+from .utils import filter_movies
+
+
+EXPORT_FIELDS = [
+    'id', 'title', 'description', 'release_date', 'category', 'genres',
+    'rating', 'author', 'created_at', 'updated_at',
+]
+
+EXPORT_FORMATS = {
+    'csv': {'content_type': 'text/csv; charset=utf-8', 'extension': 'csv', 'binary': False},
+    'jsonl': {'content_type': 'application/x-ndjson', 'extension': 'jsonl', 'binary': False},
+    'parquet': {'content_type': 'application/vnd.apache.parquet', 'extension': 'parquet', 'binary': True},
+}
+
+# Тот же разделитель жанров, что ожидает import_movies
+GENRE_SEPARATOR = '|'
+
+
+class ExportError(Exception):
+    pass
+
+
+def export_queryset(search_query=None, category_id=None, genre_ids=None, genre_mode='any', using=None):
+    """Фильмы для выгрузки с теми же критериями, что и filter_movies"""
+    return filter_movies(
+        Movie.objects.using(using), search_query=search_query, category_id=category_id, genre_ids=genre_ids,
+        genre_mode=genre_mode,
+    )
+
+
+def export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """Словари с полями EXPORT_FIELDS для каждого фильма"""
+    queryset = (
+        queryset.order_by('pk')
+        .select_related('category', 'author')
+        .only(
+            'id', 'title', 'description', 'release_date', 'rating', 'created_at', 'updated_at',
+            'category__name', 'author__username',
+        )
+        .prefetch_related(Prefetch('genres', queryset=Genre.objects.only('id', 'name')))
+    )
+    for movie in queryset.iterator(chunk_size=chunk_size):
+        yield {
+            'id': movie.pk,
+            'title': movie.title,
+            'description': movie.description,
+            'release_date': movie.release_date,
+            'category': movie.category.name if movie.category else '',
+            'genres': sorted(genre.name for genre in movie.genres.all()),
+            'rating': movie.rating,
+            'author': movie.author.username if movie.author else '',
+            'created_at': movie.created_at,
+            'updated_at': movie.updated_at,
+        }
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+class _ByteSink:
+    """Файлоподобный приёмник для ParquetWriter, который можно опустошать по кускам"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def stream_csv(rows, chunk_size):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for chunk in batched(rows, chunk_size):
+        yield ''.join(
+            writer.writerow([
+                GENRE_SEPARATOR.join(row[f]) if f == 'genres' else row[f] for f in EXPORT_FIELDS
+            ])
+            for row in chunk
+        )
+
+
+def stream_jsonl(rows, chunk_size):
+    for chunk in batched(rows, chunk_size):
+        yield ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in chunk)
+
+
+def stream_parquet(rows, chunk_size):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError('Parquet export requires pyarrow')
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('title', pa.string()),
+        ('description', pa.string()),
+        ('release_date', pa.date32()),
+        ('category', pa.string()),
+        ('genres', pa.list_(pa.string())),
+        ('rating', pa.decimal128(3, 1)),
+        ('author', pa.string()),
+        ('created_at', pa.timestamp('us', tz='UTC')),
+        ('updated_at', pa.timestamp('us', tz='UTC')),
+    ])
+    sink = _ByteSink()
+    writer = pq.ParquetWriter(sink, schema)
+    # Каждая пачка - отдельная row group, отдаём её сразу после записи
+    for chunk in batched(rows, chunk_size):
+        writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+STREAMERS = {'csv': stream_csv, 'jsonl': stream_jsonl, 'parquet': stream_parquet}
+
+
+def stream_export(queryset, fmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """Генератор кусков выгрузки (str для текстовых форматов, bytes для Parquet)"""
+    if fmt not in STREAMERS:
+        raise ExportError(f'Unknown export format: {fmt}')
+    if fmt == 'parquet':
+        # Проверяем зависимость до начала ответа, а не посреди потока
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ExportError('Parquet export requires pyarrow')
+    return STREAMERS[fmt](export_rows(queryset, chunk_size), chunk_size)
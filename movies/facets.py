@@ -0,0 +1,98 @@
+"""
+Фасетные счётчики для боковой панели фильтра.
+
+Счётчики по жанрам, категориям и диапазонам рейтинга считаются одним
+запросом UNION ALL из сгруппированных агрегатов.
+"""
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from .cache import aget_categories, aget_genres, get_categories, get_genres
+from .config import RATING_FACETS
+from .models import Movie
+
+
+FACET_KINDS = {'genre': 'genres', 'category': 'categories', 'rating': 'ratings'}
+
+
+def rating_facet_label(low, high):
+    return f'{low}+' if high is None else f'{low}–{high}'
+
+
+def rating_bucket():
+    """Нижняя граница диапазона RATING_FACETS, в который попадает рейтинг"""
+    return Case(
+        *[When(rating__gte=low, then=Value(low)) for low, high in RATING_FACETS],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+def _grouped(queryset, kind, key):
+    return (
+        queryset.order_by()
+        .annotate(kind=Value(kind), key=key)
+        .values('kind', 'key')
+        .annotate(n=Count('*'))
+    )
+
+
+def empty_facets():
+    return {
+        'genres': {},
+        'categories': {},
+        'ratings': {low: 0 for low, high in RATING_FACETS},
+    }
+
+
+def _facet_rows(queryset, genre_queryset, category_queryset, unfiltered):
+    """Запрос UNION ALL со строками (kind, key, n)"""
+    movies = Movie.objects.filter(pk__in=queryset.order_by().values('pk'))
+    parts = [_grouped(Movie.objects.all() if unfiltered else movies, 'rating', rating_bucket())]
+    
+    if not unfiltered:
+        genre_source = queryset if genre_queryset is None else genre_queryset
+        category_source = queryset if category_queryset is None else category_queryset
+        parts.append(_grouped(
+            Movie.genres.through.objects.filter(movie_id__in=genre_source.order_by().values('pk')),
+            'genre', F('genre_id'),
+        ))
+        parts.append(_grouped(
+            Movie.objects.filter(pk__in=category_source.order_by().values('pk')),
+            'category', F('category_id'),
+        ))
+    
+    return parts[0].union(*parts[1:], all=True) if len(parts) > 1 else parts[0]
+
+
+def _add_row(facets, row):
+    if row['key'] is not None:
+        facets[FACET_KINDS[row['kind']]][row['key']] = row['n']
+
+
+def facet_counts(queryset, genre_queryset=None, category_queryset=None, unfiltered=False):
+    """
+    Счётчики фасетов для выборки queryset.
+
+    genre_queryset / category_queryset - та же выборка без фильтра
+    по собственному фасету (дизъюнктивные фасеты), по умолчанию queryset.
+    При unfiltered=True счётчики жанров и категорий берутся из
+    денормализованных полей movie_count, агрегируется только рейтинг.
+    """
+    facets = empty_facets()
+    if unfiltered:
+        facets['genres'] = {g.pk: g.movie_count for g in get_genres()}
+        facets['categories'] = {c.pk: c.movie_count for c in get_categories()}
+    for row in _facet_rows(queryset, genre_queryset, category_queryset, unfiltered):
+        _add_row(facets, row)
+    return facets
+
+
+async def afacet_counts(queryset, genre_queryset=None, category_queryset=None, unfiltered=False, version=None):
+    """facet_counts() для асинхронных представлений"""
+    facets = empty_facets()
+    if unfiltered:
+        facets['genres'] = {g.pk: g.movie_count for g in await aget_genres(version)}
+        facets['categories'] = {c.pk: c.movie_count for c in await aget_categories(version)}
+    async for row in _facet_rows(queryset, genre_queryset, category_queryset, unfiltered):
+        _add_row(facets, row)
+    return facets
@@ -0,0 +1,136 @@
+"""
+Фильтр каталога: разобранные и нормализованные параметры запроса.
+
+MovieFilter строится один раз на запрос (MovieFilter.from_query) и дальше
+используется всеми: список, AJAX-фильтр, фасеты, выгрузка, кэш страниц.
+Неверные значения отбрасываются так же, как раньше (нет фильтра), жанры
+проверяются через EXISTS по таблице связей, без JOIN и DISTINCT.
+digest() - стабильный хэш для ключей кэша и ETag: одинаковые выборки с
+разным порядком параметров, регистром или пробелами дают один хэш.
+"""
+import hashlib
+import json
+
+from django.db.models import Exists, OuterRef
+
+from .config import MOVIE_SORT_OPTIONS, RATING_FACETS
+from .models import Movie
+from .search import search_movies, tokenize
+
+
+DEFAULT_SORT = '-created_at'
+VALID_SORTS = [value for value, label in MOVIE_SORT_OPTIONS]
+# any - хотя бы один из выбранных жанров, all - все выбранные жанры
+GENRE_MODES = ('any', 'all')
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _genre_ids(values):
+    """Отсортированные id жанров; если хоть одно значение неверное - фильтра нет"""
+    ids = [_int_or_none(value) for value in values or ()]
+    return () if None in ids else tuple(sorted(set(ids)))
+
+
+class MovieFilter:
+    """
+    Нормализованный фильтр: q - токены поиска через пробел, category - id или
+    None, genre - кортеж id, genre_mode - 'any' или 'all', rating - нижняя
+    граница диапазона RATING_FACETS или None, sort - сортировка из
+    MOVIE_SORT_OPTIONS или None, если параметра sort не было
+    """
+    DEFAULTS = {'q': '', 'category': None, 'genre': (), 'genre_mode': 'any', 'rating': None, 'sort': None}
+    FIELDS = tuple(DEFAULTS)
+    __slots__ = FIELDS
+
+    def __init__(self, q='', category=None, genre=(), genre_mode='any', rating=None, sort=None):
+        self.q = ' '.join(tokenize(q))
+        self.category = _int_or_none(category or None)
+        self.genre = _genre_ids(genre)
+        self.genre_mode = genre_mode if genre_mode in GENRE_MODES else 'any'
+        rating = _int_or_none(rating or None)
+        self.rating = rating if rating in dict(RATING_FACETS) else None
+        self.sort = None if sort is None else sort if sort in VALID_SORTS else DEFAULT_SORT
+
+    @classmethod
+    def from_query(cls, query):
+        """Фильтр из GET-параметров (QueryDict)"""
+        return cls(
+            q=query.get('q', ''),
+            category=query.get('category'),
+            genre=query.getlist('genre'),
+            genre_mode=query.get('genre_mode'),
+            rating=query.get('rating'),
+            sort=query.get('sort'),
+        )
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __eq__(self, other):
+        return isinstance(other, MovieFilter) and self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        return hash(tuple(self.as_dict().values()))
+
+    def __repr__(self):
+        return f'MovieFilter({self.as_dict()})'
+
+    def without(self, *names):
+        """Тот же фильтр без перечисленных полей (для дизъюнктивных фасетов)"""
+        if 'genre' in names:
+            names = (*names, 'genre_mode')
+        params = self.as_dict()
+        params.update({name: self.DEFAULTS[name] for name in names if name in params})
+        return MovieFilter(**params)
+
+    def has_filters(self):
+        """Сужает ли фильтр выборку (сортировка не считается)"""
+        return bool(self.q or self.category is not None or self.genre or self.rating is not None)
+
+    def digest(self, *extra):
+        """Стабильный хэш фильтра и дополнительных частей ключа (страница, курсор)"""
+        payload = json.dumps([self.as_dict(), *extra], sort_keys=True)
+        return hashlib.md5(payload.encode()).hexdigest()
+
+    @property
+    def ranked(self):
+        """Без явной сортировки результаты поиска упорядочены по релевантности"""
+        return bool(self.q) and self.sort is None
+
+    def genre_condition(self):
+        links = Movie.genres.through.objects.filter(movie_id=OuterRef('pk'))
+        if self.genre_mode == 'all':
+            return [Exists(links.filter(genre_id=genre)) for genre in self.genre]
+        return [Exists(links.filter(genre_id__in=self.genre))]
+
+    def apply(self, queryset, rank=False):
+        """Отфильтровать queryset; rank=True добавляет search_rank для поиска"""
+        if self.q:
+            queryset = search_movies(queryset, self.q, rank=rank)
+        if self.category is not None:
+            queryset = queryset.filter(category_id=self.category)
+        if self.genre:
+            queryset = queryset.filter(*self.genre_condition())
+        if self.rating is not None:
+            queryset = queryset.filter(rating__gte=self.rating)
+            high = dict(RATING_FACETS)[self.rating]
+            if high is not None:
+                queryset = queryset.filter(rating__lt=high)
+        return queryset
+
+    def order(self, queryset):
+        if self.ranked:
+            return queryset.order_by('-search_rank', '-created_at', '-pk')
+        # pk как второй ключ делает порядок стабильным между страницами
+        sort = self.sort or DEFAULT_SORT
+        return queryset.order_by(sort, '-pk' if sort.startswith('-') else 'pk')
+
+    def queryset(self, queryset):
+        """Отфильтрованная и упорядоченная выборка"""
+        return self.order(self.apply(queryset, rank=self.ranked))
@@ -4,6 +4,8 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
 from datetime import date
 
+from .config import MIN_VOTE, MAX_VOTE
+
 
 class MovieForm(forms.ModelForm):
     class Meta:
@@ -45,7 +47,7 @@ class MovieForm(forms.ModelForm):
 class MovieEditForm(forms.ModelForm):
     class Meta:
         model = Movie
-        fields = ['title', 'description', 'release_date', 'poster', 'category', 'genres', 'rating']
+        fields = ['title', 'description', 'release_date', 'poster', 'category', 'genres', 'author_rating']
         widgets = {
             'title': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Movie title'}),
             'description': forms.Textarea(attrs={'class': 'form-control', 'rows': 4, 'placeholder': 'Description'}),
@@ -53,7 +55,7 @@ class MovieEditForm(forms.ModelForm):
             'poster': forms.FileInput(attrs={'class': 'form-control', 'accept': 'image/*'}),
             'category': forms.Select(attrs={'class': 'form-control'}),
             'genres': forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
-            'rating': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'max': '10', 'step': '0.1'}),
+            'author_rating': forms.NumberInput(attrs={'class': 'form-control', 'min': '0', 'max': '10', 'step': '0.1'}),
         }
 
     def clean_title(self):
@@ -62,14 +64,18 @@ class MovieEditForm(forms.ModelForm):
             raise forms.ValidationError('Title must be at least 2 characters long')
         return title
 
-    def clean_rating(self):
-        rating = self.cleaned_data.get('rating')
+    def clean_author_rating(self):
+        rating = self.cleaned_data.get('author_rating')
         if rating is not None:
             if rating < 0 or rating > 10:
                 raise forms.ValidationError('Rating must be between 0 and 10')
         return rating
 
 
+class RatingForm(forms.Form):
+    score = forms.IntegerField(min_value=MIN_VOTE, max_value=MAX_VOTE)
+
+
 class UserProfileForm(forms.ModelForm):
     class Meta:
         model = UserProfile
@@ -0,0 +1,117 @@
+"""
+Уменьшенные копии постеров и аватаров.
+
+Для каждого размера из POSTER_RENDITIONS / AVATAR_RENDITIONS рядом с оригиналом
+сохраняются WebP и JPEG: posters/alien.jpg -> posters/alien.card.webp, ...
+Генерация и удаление файлов идут задачами очереди movies.tasks (run_worker),
+а не в запросе. Обработчик должен видеть то же хранилище файлов, а для
+сброса кэша каталога - тот же кэш, что и веб-процессы.
+"""
+import os
+from io import BytesIO
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.utils import timezone
+from PIL import Image, ImageOps, features
+
+from .cache import bump_catalogue_version
+from .config import AVATAR_RENDITIONS, POSTER_RENDITIONS, RENDITION_FORMATS, RENDITION_QUALITY
+from .models import Movie, UserProfile
+from .page_cache import invalidate_movie_pages
+from .tasks import enqueue, task
+
+
+# модель -> (поле с файлом, флаг готовности, размеры)
+IMAGE_FIELDS = {
+    Movie: ('poster', 'poster_renditions', POSTER_RENDITIONS),
+    UserProfile: ('avatar', 'avatar_renditions', AVATAR_RENDITIONS),
+}
+
+
+def rendition_name(name, rendition, ext):
+    root, _ = os.path.splitext(name)
+    return f'{root}.{rendition}.{ext}'
+
+
+def available_formats():
+    return [(ext, fmt) for ext, fmt in RENDITION_FORMATS if fmt != 'WEBP' or features.check('webp')]
+
+
+def render_renditions(fieldfile, sizes):
+    """Сгенерировать и сохранить копии файла для всех размеров и форматов"""
+    storage = fieldfile.storage
+    with fieldfile.open('rb') as f:
+        image = Image.open(f)
+        image.load()
+    image = ImageOps.exif_transpose(image).convert('RGB')
+
+    for rendition, size in sizes.items():
+        thumb = ImageOps.fit(image, size, Image.Resampling.LANCZOS)
+        for ext, fmt in available_formats():
+            buffer = BytesIO()
+            thumb.save(buffer, fmt, quality=RENDITION_QUALITY, optimize=True)
+            path = rendition_name(fieldfile.name, rendition, ext)
+            if storage.exists(path):
+                storage.delete(path)
+            storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def delete_image_files(storage, name, sizes):
+    """Удалить оригинал и все его копии"""
+    paths = [name] + [
+        rendition_name(name, rendition, ext) for rendition in sizes for ext, fmt in RENDITION_FORMATS
+    ]
+    for path in paths:
+        if storage.exists(path):
+            storage.delete(path)
+
+
+def generate_renditions(model, pk):
+    """
+    Сгенерировать копии для объекта и отметить их готовность.
+    Возвращает True, если копии созданы
+    """
+    field, flag, sizes = IMAGE_FIELDS[model]
+    instance = model.objects.filter(pk=pk).only('pk', field).first()
+    fieldfile = getattr(instance, field, None)
+    if not fieldfile:
+        return False
+    render_renditions(fieldfile, sizes)
+    # Файл мог смениться, пока шла генерация - тогда флаг не ставим. updated_at
+    # меняется вместе с флагом: от него ETag страницы, на которой появится srcset
+    updated = model.objects.filter(pk=pk, **{field: fieldfile.name}).update(
+        **{flag: True}, updated_at=timezone.now(),
+    )
+    if updated and model is Movie:
+        bump_catalogue_version()
+        invalidate_movie_pages(pk)
+    return bool(updated)
+
+
+@task('movies.generate_renditions')
+def generate_renditions_task(model, pk):
+    generate_renditions(apps.get_model(model), pk)
+
+
+@task('movies.delete_image')
+def delete_image_task(model, path):
+    model = apps.get_model(model)
+    field, flag, sizes = IMAGE_FIELDS[model]
+    delete_image_files(model._meta.get_field(field).storage, path, sizes)
+
+
+def schedule_renditions(instance, using=None):
+    """Поставить генерацию копий в очередь задач (в текущей транзакции)"""
+    label = instance._meta.label_lower
+    enqueue(
+        'movies.generate_renditions', key=f'renditions:{label}:{instance.pk}', using=using,
+        model=label, pk=instance.pk,
+    )
+
+
+def schedule_image_deletion(instance, using=None):
+    """Поставить удаление файла объекта и его копий в очередь задач"""
+    label = instance._meta.label_lower
+    path = getattr(instance, IMAGE_FIELDS[type(instance)][0]).name
+    enqueue('movies.delete_image', key=f'delete:{label}:{path}', using=using, model=label, path=path)
@@ -0,0 +1,245 @@
+"""
+Потоковый импорт фильмов из CSV или JSON Lines.
+
+Строки читаются с диска по одной и пишутся пачками: bulk_create / bulk_update
+для фильмов и прямые вставки в промежуточную таблицу жанров. Каждая пачка -
+отдельная транзакция. Сигналы при этом не срабатывают, поэтому поисковый
+индекс обновляется по пачкам, а счётчики и кэш каталога - в конце импорта.
+"""
+import csv
+import json
+import logging
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .cache import bump_catalogue_version
+from .config import IMPORT_MAX_ERRORS, MIN_RATING, MAX_RATING
+from .counters import reconcile_counters
+from .leaderboards import reset_leaderboards
+from .models import Category, Genre, Movie
+from .page_cache import CATALOGUE_TAG, invalidate_pages
+from .ratings import bayesian_rating
+from .search import get_search_backend
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def read_rows(path, fmt):
+    """Построчно читать CSV или JSON Lines; '-' - стандартный ввод"""
+    stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if fmt == 'csv':
+            yield from csv.DictReader(stream)
+        else:
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as exc:
+                    # Ошибка одной строки не должна прерывать импорт
+                    yield {'__error__': f'invalid JSON: {exc}'}
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class MovieImporter:
+    def __init__(self, using=DEFAULT_DB_ALIAS, batch_size=1000, genre_separator='|', index=True,
+                 max_errors=IMPORT_MAX_ERRORS):
+        self.using = using
+        self.batch_size = batch_size
+        self.genre_separator = genre_separator
+        self.index = index
+        self.categories = dict(Category.objects.using(using).values_list('name', 'id'))
+        self.genres = dict(Genre.objects.using(using).values_list('name', 'id'))
+        self.users = {}
+        self.created = self.updated = self.skipped = self.processed = 0
+        # Первые max_errors отклонённых строк для отчёта; остальные только в логе
+        self.errors = []
+        self.max_errors = max_errors
+        self.errors_omitted = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.processed / elapsed if elapsed else 0.0
+
+    def skip(self, line, error):
+        self.skipped += 1
+        logger.warning('Import row %s skipped: %s', line, error)
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line, error))
+        else:
+            self.errors_omitted += 1
+
+    def parse(self, row):
+        if '__error__' in row:
+            raise ImportRowError(row['__error__'])
+        title = str(row.get('title') or '').strip()
+        if not title or len(title) > 200:
+            raise ImportRowError('title is missing or longer than 200 characters')
+
+        release_date = row.get('release_date') or None
+        if release_date is not None:
+            release_date = parse_date(str(release_date))
+            if release_date is None:
+                raise ImportRowError(f'invalid release_date {row.get("release_date")!r}')
+
+        # Отсутствующие в строке поля при обновлении сохраняют текущие значения
+        record = {'title': title, 'release_date': release_date}
+        if 'description' in row:
+            record['description'] = str(row['description'] or '')
+        if 'category' in row:
+            record['category'] = str(row['category'] or '').strip()
+        if 'author' in row:
+            record['author'] = str(row['author'] or '').strip()
+        if 'rating' in row:
+            try:
+                rating = Decimal(str(row['rating'] or 0)).quantize(Decimal('0.1'))
+            except InvalidOperation:
+                raise ImportRowError(f'invalid rating {row["rating"]!r}')
+            if not MIN_RATING <= rating <= MAX_RATING:
+                raise ImportRowError(f'rating {rating} is out of range')
+            record['rating'] = rating
+        if 'genres' in row:
+            genres = row['genres'] or []
+            if isinstance(genres, str):
+                genres = genres.split(self.genre_separator)
+            record['genres'] = sorted({str(g).strip() for g in genres if str(g).strip()})
+        return record
+
+    def resolve_names(self, model, mapping, names):
+        """Дополнить карту имя -> id, создав недостающие записи одним запросом"""
+        missing = {name for name in names if name and name not in mapping}
+        if missing:
+            manager = model.objects.using(self.using)
+            manager.bulk_create([model(name=name) for name in missing], ignore_conflicts=True)
+            mapping.update(manager.filter(name__in=missing).values_list('name', 'id'))
+
+    def resolve_users(self, usernames):
+        missing = {name for name in usernames if name and name not in self.users}
+        if missing:
+            self.users.update(User.objects.using(self.using).filter(username__in=missing).values_list('username', 'id'))
+
+    def import_chunk(self, chunk):
+        records = {}
+        for line, row in chunk:
+            try:
+                record = self.parse(row)
+            except (ImportRowError, TypeError, AttributeError) as exc:
+                self.skip(line, str(exc))
+                continue
+            # Повтор ключа внутри пачки: побеждает последняя строка
+            records[(record['title'], record['release_date'])] = record
+
+        self.resolve_names(Category, self.categories, {r.get('category') for r in records.values()})
+        self.resolve_names(Genre, self.genres, {g for r in records.values() for g in r.get('genres', ())})
+        self.resolve_users({r.get('author') for r in records.values()})
+
+        existing = {
+            (row['title'], row['release_date']): row
+            for row in Movie.objects.using(self.using)
+            .filter(title__in={key[0] for key in records})
+            .values(
+                'pk', 'title', 'release_date', 'description', 'category_id', 'rating', 'author_rating',
+                'rating_sum', 'rating_count', 'author_id',
+            )
+        }
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        for key, record in records.items():
+            current = existing.get(key, {
+                'pk': None, 'description': '', 'category_id': None, 'rating': 0, 'author_rating': None,
+                'rating_sum': 0, 'rating_count': 0, 'author_id': None,
+            })
+            # Рейтинг из файла - оценка автора; с голосами пользователей он усредняется (movies.ratings)
+            author_rating, rating = current['author_rating'], current['rating']
+            if 'rating' in record:
+                # 0 - не оценён, как в миграции 0008
+                author_rating = record['rating'] or None
+                rating = bayesian_rating(author_rating, current['rating_sum'], current['rating_count'])
+            movie = Movie(
+                pk=current['pk'],
+                title=record['title'],
+                release_date=record['release_date'],
+                description=record.get('description', current['description']),
+                category_id=(
+                    self.categories.get(record['category']) if 'category' in record else current['category_id']
+                ),
+                rating=rating,
+                author_rating=author_rating,
+                author_id=self.users.get(record.get('author'), current['author_id']),
+                updated_at=now,
+            )
+            movie._import_genres = record.get('genres')
+            (to_update if movie.pk else to_create).append(movie)
+
+        Movie.objects.using(self.using).bulk_create(to_create)
+        Movie.objects.using(self.using).bulk_update(
+            to_update, ['description', 'category', 'rating', 'author_rating', 'author', 'updated_at']
+        )
+
+        # Жанры заменяются только у строк, где они указаны
+        through = Movie.genres.through
+        with_genres = [movie for movie in to_create + to_update if movie._import_genres is not None]
+        replaced = [movie.pk for movie in to_update if movie._import_genres is not None]
+        if replaced:
+            through.objects.using(self.using).filter(movie_id__in=replaced).delete()
+        through.objects.using(self.using).bulk_create([
+            through(movie_id=movie.pk, genre_id=self.genres[name])
+            for movie in with_genres
+            for name in movie._import_genres
+        ], ignore_conflicts=True)
+
+        if self.index:
+            get_search_backend(self.using).index_movies(to_create + to_update, using=self.using)
+
+        self.created += len(to_create)
+        self.updated += len(to_update)
+
+    def run(self, rows, progress=None):
+        """
+        Импортировать строки пачками. progress(importer) вызывается
+        после каждой пачки
+        """
+        numbered = enumerate(rows, start=1)
+        for chunk in batched(numbered, self.batch_size):
+            with transaction.atomic(using=self.using):
+                self.import_chunk(chunk)
+            self.processed += len(chunk)
+            if progress:
+                progress(self)
+
+        if not self.index:
+            get_search_backend(self.using).rebuild(using=self.using)
+        reconcile_counters(using=self.using)
+        bump_catalogue_version(using=self.using)
+        invalidate_pages([CATALOGUE_TAG], using=self.using)
+        reset_leaderboards()
+        return self
@@ -0,0 +1,230 @@
+"""
+Замеры запросов к БД и времени ответа по именам URL.
+
+InstrumentationMiddleware считает для каждого запроса число SQL-запросов,
+время в БД, время рендеринга шаблонов и общее время, отдаёт их в заголовке
+Server-Timing и накапливает в METRICS (формат Prometheus - MetricsView).
+Для представлений из QUERY_BUDGETS превышение бюджета запросов пишется
+в лог или, при MOVIES_QUERY_BUDGET_ACTION = 'raise', приводит к исключению.
+При MOVIES_INSTRUMENTATION = False middleware убирает себя из цепочки.
+Middleware работает и в синхронной, и в асинхронной (ASGI) цепочке.
+"""
+import contextvars
+import logging
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+from .config import QUERY_BUDGETS
+
+
+logger = logging.getLogger(__name__)
+
+UNRESOLVED = '<unresolved>'
+
+_current = contextvars.ContextVar('movies_request_stats', default=None)
+_original_template_render = None
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'template_time', 'template_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Обёртка execute_wrapper: запрос засчитывается запросу из _current.
+    Под ASGI поток sync_to_async и его соединение общие для одновременных
+    запросов, а контекст у каждого свой
+    """
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_time += time.perf_counter() - start
+
+
+def _timed_template_render(self, context):
+    stats = _current.get()
+    # Вложенные шаблоны (include, extends) уже входят во время внешнего
+    if stats is None or stats.template_depth:
+        return _original_template_render(self, context)
+    stats.template_depth += 1
+    start = time.perf_counter()
+    try:
+        return _original_template_render(self, context)
+    finally:
+        stats.template_time += time.perf_counter() - start
+        stats.template_depth -= 1
+
+
+def install_template_timer():
+    global _original_template_render
+    if _original_template_render is None:
+        _original_template_render = Template.render
+        Template.render = _timed_template_render
+
+
+class MetricsRegistry:
+    """Накопленные метрики по представлениям (в памяти процесса)"""
+
+    FIELDS = ('requests', 'queries', 'queries_max', 'db_seconds', 'template_seconds', 'seconds', 'budget_exceeded')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, view, stats, total, over_budget=False):
+        with self.lock:
+            row = self.views.setdefault(view, dict.fromkeys(self.FIELDS, 0))
+            row['requests'] += 1
+            row['queries'] += stats.queries
+            row['queries_max'] = max(row['queries_max'], stats.queries)
+            row['db_seconds'] += stats.db_time
+            row['template_seconds'] += stats.template_time
+            row['seconds'] += total
+            row['budget_exceeded'] += int(over_budget)
+
+    def snapshot(self):
+        with self.lock:
+            return {view: dict(row) for view, row in self.views.items()}
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render_prometheus(self):
+        views = sorted(self.snapshot().items())
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, field in samples:
+                for view, row in views:
+                    lines.append(f'{name}{suffix}{{view="{_escape(view)}"}} {_number(row[field])}')
+
+        metric('movies_view_duration_seconds', 'summary', 'Total request time per view.',
+               [('_sum', 'seconds'), ('_count', 'requests')])
+        metric('movies_view_db_seconds', 'summary', 'Time spent in SQL queries per view.',
+               [('_sum', 'db_seconds'), ('_count', 'requests')])
+        metric('movies_view_template_seconds', 'summary', 'Template rendering time per view.',
+               [('_sum', 'template_seconds'), ('_count', 'requests')])
+        metric('movies_view_queries', 'summary', 'SQL queries per request per view.',
+               [('_sum', 'queries'), ('_count', 'requests')])
+        metric('movies_view_queries_max', 'gauge', 'Largest number of SQL queries seen in one request.',
+               [('', 'queries_max')])
+        metric('movies_view_query_budget_exceeded_total', 'counter', 'Requests that exceeded the query budget.',
+               [('', 'budget_exceeded')])
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+
+METRICS = MetricsRegistry()
+
+
+def get_query_budgets():
+    return {**QUERY_BUDGETS, **getattr(settings, 'MOVIES_QUERY_BUDGETS', {})}
+
+
+def server_timing(stats, total):
+    return (
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries", '
+        f'tpl;dur={stats.template_time * 1000:.1f}, '
+        f'total;dur={total * 1000:.1f}'
+    )
+
+
+def instrument_connections():
+    """
+    Поставить record_query на соединения текущего потока; обёртка ставится
+    один раз и не снимается. В начало списка - чтобы не мешать execute_wrapper(),
+    который снимает свою обёртку с конца
+    """
+    for connection in connections.all():
+        if record_query not in connection.execute_wrappers:
+            connection.execute_wrappers.insert(0, record_query)
+
+
+class InstrumentationMiddleware:
+    """Считает запросы к БД и время ответа по имени URL"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MOVIES_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.budgets = get_query_budgets()
+        self.raise_on_budget = getattr(settings, 'MOVIES_QUERY_BUDGET_ACTION', 'log') == 'raise'
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install_template_timer()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            instrument_connections()
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            # Async ORM и синхронные представления выполняют запросы в потоке
+            # sync_to_async(thread_sensitive=True): обёртка ставится на его соединения,
+            # а _current попадает туда вместе с контекстом
+            await sync_to_async(instrument_connections)()
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, stats, time.perf_counter() - start)
+
+    def finish(self, request, response, stats, total):
+        match = request.resolver_match
+        view = match.view_name if match else UNRESOLVED
+        budget = self.budgets.get(view)
+        over_budget = budget is not None and stats.queries > budget
+        METRICS.record(view, stats, total, over_budget)
+        response['Server-Timing'] = server_timing(stats, total)
+
+        if over_budget:
+            message = f'{view} ran {stats.queries} SQL queries, budget is {budget} ({request.get_full_path()})'
+            if self.raise_on_budget:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,275 @@
+"""
+Материализованные рейтинги: лучшие фильмы каталога, категории и жанра.
+
+Рейтинг (board) области 'all', 'category:<pk>' или 'genre:<pk>' хранится
+в кэше: первые LEADERBOARD_SIZE + LEADERBOARD_SLACK пар (rating, pk) в
+порядке списка с sort=-rating и число фильмов области. movies.signals
+после коммита правят затронутые рейтинги на месте: фильм вставляется,
+переставляется или удаляется, не трогая БД. Если после удаления в рейтинге
+осталось меньше LEADERBOARD_SIZE записей, а фильмов больше, он удаляется
+и строится заново при следующем чтении. Первая страница «лучших в жанре»
+- это чтение рейтинга из кэша и один запрос фильмов по pk.
+
+Правки одного рейтинга идут под блокировкой в кэше (cache.add); не
+дождавшись её, правка удаляет рейтинг. Каждая правка меняет ревизию
+рейтинга, и рейтинг, построенный по БД одновременно с ней, не сохраняется.
+"""
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .config import LEADERBOARD_LOCK_TIMEOUT, LEADERBOARD_SIZE, LEADERBOARD_SLACK, LEADERBOARD_TIMEOUT
+from .models import Movie
+
+
+GENERATION_KEY = 'movies:leaderboard:generation'
+ALL = 'all'
+
+
+def category_scope(pk):
+    return f'category:{pk}'
+
+
+def genre_scope(pk):
+    return f'genre:{pk}'
+
+
+def movie_scopes(category_id, genre_ids=()):
+    """Рейтинги, в которые входит фильм"""
+    scopes = [ALL, *(genre_scope(pk) for pk in genre_ids)]
+    if category_id is not None:
+        scopes.append(category_scope(category_id))
+    return scopes
+
+
+def leaderboard_scope(movie_filter):
+    """Рейтинг, которым можно ответить на фильтр (movies.filters), или None"""
+    if movie_filter.sort != '-rating' or movie_filter.q or movie_filter.rating is not None:
+        return None
+    category, genres = movie_filter.category, movie_filter.genre
+    if category is None and not genres:
+        return ALL
+    if category is None and len(genres) == 1:
+        return genre_scope(genres[0])
+    if category is not None and not genres:
+        return category_scope(category)
+    return None
+
+
+def _rating(value):
+    # float из Movie.objects.create(rating=8.2) и Decimal из БД сравниваются одинаково
+    return Decimal(str(value))
+
+
+def _generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+async def _ageneration():
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def board_key(scope, generation=None):
+    return f'movies:leaderboard:{generation or _generation()}:{scope}'
+
+
+def reset_leaderboards():
+    """Перестроить все рейтинги (после массовых изменений без сигналов)"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def scope_queryset(scope, using=None):
+    movies = Movie.objects.using(using)
+    if scope == ALL:
+        return movies
+    kind, pk = scope.split(':')
+    if kind == 'category':
+        return movies.filter(category_id=pk)
+    return movies.filter(genres__id=pk)
+
+
+def _board(rows, count):
+    return {'entries': [(_rating(rating), pk) for pk, rating in rows], 'count': count}
+
+
+def _top_rows(scope, using=None):
+    return scope_queryset(scope, using).order_by('-rating', '-pk').values_list('pk', 'rating')
+
+
+def build_board(scope, using=None):
+    queryset = scope_queryset(scope, using)
+    rows = list(_top_rows(scope, using)[:LEADERBOARD_SIZE + LEADERBOARD_SLACK])
+    return _board(rows, len(rows) if len(rows) < LEADERBOARD_SIZE + LEADERBOARD_SLACK else queryset.count())
+
+
+async def abuild_board(scope, using=None):
+    queryset = scope_queryset(scope, using)
+    rows = [row async for row in _top_rows(scope, using)[:LEADERBOARD_SIZE + LEADERBOARD_SLACK]]
+    return _board(rows, len(rows) if len(rows) < LEADERBOARD_SIZE + LEADERBOARD_SLACK else await queryset.acount())
+
+
+def _revision_key(key):
+    return f'{key}:revision'
+
+
+def _store_board(key, board, revision):
+    # Правка после чтения revision могла не попасть в построенный рейтинг
+    cache.add(key, board, LEADERBOARD_TIMEOUT)
+    if cache.get(_revision_key(key)) != revision:
+        cache.delete(key)
+
+
+async def _astore_board(key, board, revision):
+    await cache.aadd(key, board, LEADERBOARD_TIMEOUT)
+    if await cache.aget(_revision_key(key)) != revision:
+        await cache.adelete(key)
+
+
+def get_boards(scopes, using=None):
+    """Рейтинги областей scopes одним чтением из кэша; недостающие строятся"""
+    generation = _generation()
+    keys = {scope: board_key(scope, generation) for scope in scopes}
+    cached = cache.get_many(keys.values())
+    boards = {}
+    for scope, key in keys.items():
+        if key not in cached:
+            revision = cache.get(_revision_key(key))
+            cached[key] = build_board(scope, using)
+            _store_board(key, cached[key], revision)
+        boards[scope] = cached[key]
+    return boards
+
+
+async def aget_boards(scopes, using=None):
+    generation = await _ageneration()
+    keys = {scope: board_key(scope, generation) for scope in scopes}
+    cached = await cache.aget_many(keys.values())
+    boards = {}
+    for scope, key in keys.items():
+        if key not in cached:
+            revision = await cache.aget(_revision_key(key))
+            cached[key] = await abuild_board(scope, using)
+            await _astore_board(key, cached[key], revision)
+        boards[scope] = cached[key]
+    return boards
+
+
+def _ordered(movies, ids):
+    """Фильмы в порядке рейтинга или None, если какого-то уже нет (удалён в обход сигналов)"""
+    if len(movies) < len(ids):
+        return None
+    return [movies[pk] for pk in ids]
+
+
+def top_movies(scope, limit, queryset=None):
+    """
+    (фильмы, число фильмов области) для первых limit мест или None,
+    если рейтинг не может ответить (limit больше LEADERBOARD_SIZE, устарел)
+    """
+    if limit > LEADERBOARD_SIZE:
+        return None
+    queryset = Movie.objects.all() if queryset is None else queryset
+    board = get_boards([scope], using=queryset.db)[scope]
+    ids = [pk for rating, pk in board['entries'][:limit]]
+    movies = _ordered(queryset.order_by().in_bulk(ids), ids)
+    if movies is None:
+        cache.delete(board_key(scope))
+        return None
+    return movies, board['count']
+
+
+async def atop_movies(scope, limit, queryset=None):
+    if limit > LEADERBOARD_SIZE:
+        return None
+    queryset = Movie.objects.all() if queryset is None else queryset
+    board = (await aget_boards([scope], using=queryset.db))[scope]
+    ids = [pk for rating, pk in board['entries'][:limit]]
+    movies = _ordered({movie.pk: movie async for movie in queryset.filter(pk__in=ids).order_by()}, ids)
+    if movies is None:
+        await cache.adelete(board_key(scope, await _ageneration()))
+        return None
+    return movies, board['count']
+
+
+def get_popular_movies(limit=5):
+    """Лучшие фильмы каталога для шаблонов"""
+    top = top_movies(ALL, limit)
+    return top[0] if top is not None else list(Movie.objects.order_by('-rating', '-pk')[:limit])
+
+
+@contextmanager
+def board_lock(key):
+    """
+    Блокировка правки рейтинга; False, если её держит другая правка. Не ждём:
+    правка выполняется после коммита в потоке запроса
+    """
+    lock = f'{key}:lock'
+    if not cache.add(lock, True, LEADERBOARD_LOCK_TIMEOUT):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        cache.delete(lock)
+
+
+def _apply(scope, pk, rating, joined, left):
+    key = board_key(scope)
+    with board_lock(key) as locked:
+        cache.set(_revision_key(key), time.time_ns(), LEADERBOARD_TIMEOUT)
+        if not locked:
+            # Рейтинг правит кто-то ещё - проще построить его заново при чтении
+            cache.delete(key)
+            return
+        _patch(key, pk, rating, joined, left)
+
+
+def _patch(key, pk, rating, joined, left):
+    board = cache.get(key)
+    if board is None:
+        return
+    old = board['entries']
+    # Полный рейтинг содержит все фильмы области - вставлять можно в любое место
+    complete = len(old) >= board['count']
+    count = board['count'] + joined - left
+    entries = [entry for entry in old if entry[1] != pk]
+    if rating is not None and not left:
+        entry = (_rating(rating), pk)
+        if complete or (entries and entry > entries[-1]):
+            entries.append(entry)
+            entries.sort(reverse=True)
+    entries = entries[:LEADERBOARD_SIZE + LEADERBOARD_SLACK]
+    if len(entries) < min(count, LEADERBOARD_SIZE):
+        cache.delete(key)
+    else:
+        cache.set(key, {'entries': entries, 'count': count}, LEADERBOARD_TIMEOUT)
+
+
+def update_leaderboards(pk, rating, scopes, joined=False, left=False, using=None):
+    """
+    После коммита: фильм pk с рейтингом rating вошёл в рейтинги scopes
+    (joined), покинул их (left) или сменил рейтинг в них
+    """
+    def apply():
+        for scope in scopes:
+            _apply(scope, pk, rating, joined, left)
+
+    transaction.on_commit(apply, using=using)
+
+
+def drop_leaderboard(scope, using=None):
+    transaction.on_commit(lambda: cache.delete(board_key(scope)), using=using)
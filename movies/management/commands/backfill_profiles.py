@@ -0,0 +1,35 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from movies.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Create missing profiles for users that have none (pages no longer create them on GET)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Profiles created per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many profiles are missing')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to backfill')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        missing = (
+            User.objects.using(using).filter(profile__isnull=True)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{missing.count()} users have no profile')
+            return
+
+        created = 0
+        # Каждая пачка - новый запрос: вставки не сбивают курсор выборки
+        while chunk := list(missing[:options['batch_size']]):
+            with transaction.atomic(using=using):
+                # ignore_conflicts: профиль мог появиться параллельно (регистрация)
+                UserProfile.objects.using(using).bulk_create(
+                    [UserProfile(user_id=pk) for pk in chunk], ignore_conflicts=True
+                )
+            created += len(chunk)
+        self.stdout.write(self.style.SUCCESS(f'Created {created} missing profiles'))
@@ -0,0 +1,160 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from movies.benchmark import (
+    SCENARIO_NAMES, benchmark_meta, compare_results, run_benchmark, run_concurrent, seed_catalogue,
+    sqlite_modes,
+)
+from movies.models import Movie
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic catalogue in a separate test database, run scripted request mixes '
+        'through the test client and report p50/p95/p99 latency and query counts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=10000, help='Number of movies to generate')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the catalogue and request mix')
+        parser.add_argument('--iterations', type=int, default=50, help='Requests per scenario')
+        parser.add_argument(
+            '--scenario', action='append', choices=SCENARIO_NAMES, dest='scenarios',
+            help='Run only this scenario (repeatable)',
+        )
+        parser.add_argument(
+            '--warm', action='store_true', help='Keep the caches (including the page cache) between requests',
+        )
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Reuse the benchmark database and its catalogue if it already has --size movies',
+        )
+        parser.add_argument('--output', help='Write results as JSON to this file')
+        parser.add_argument('--baseline', help='Compare against results stored in this JSON file')
+        parser.add_argument('--threshold', type=float, default=20, help='Allowed p95 growth in percent')
+        parser.add_argument(
+            '--concurrent', action='store_true',
+            help='Run reader and writer threads against the default and the tuned SQLite setup instead of the scenarios',
+        )
+        parser.add_argument('--readers', type=int, default=4, help='Reader threads for --concurrent')
+        parser.add_argument('--writers', type=int, default=2, help='Writer threads for --concurrent')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode for --concurrent')
+        parser.add_argument(
+            '--mode', action='append', choices=list(sqlite_modes()), dest='modes',
+            help='Run only this SQLite mode with --concurrent (repeatable)',
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if options['concurrent']:
+            if connection.vendor != 'sqlite':
+                raise CommandError('--concurrent compares SQLite setups and needs an SQLite database')
+            if options['baseline']:
+                raise CommandError('--baseline cannot be combined with --concurrent')
+            if connection.creation.is_in_memory_db(connection.creation._get_test_db_name()):
+                # Потокам нужен общий файл, а не база в памяти
+                connection.settings_dict['TEST']['NAME'] = os.path.join(
+                    tempfile.gettempdir(), 'filmroom_benchmark.sqlite3'
+                )
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f'Cannot read baseline: {exc}')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        try:
+            results = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+
+        if baseline is not None:
+            self.report_comparison(compare_results(results, baseline, options['threshold']))
+
+    def run(self, options):
+        size = options['size']
+        if Movie.objects.count() != size:
+            if Movie.objects.exists():
+                raise CommandError('The benchmark database holds a different catalogue, run without --keepdb')
+            self.stdout.write(f'Seeding {size} movies (seed {options["seed"]})...')
+            seed_catalogue(size, seed=options['seed'], progress=self.seed_progress if options['verbosity'] > 1 else None)
+
+        if options['concurrent']:
+            return self.run_concurrent(options)
+
+        self.stdout.write(f'{"scenario":<18}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>10}  statuses')
+
+        def progress(name, result):
+            queries = f'{result["queries_min"]}-{result["queries_max"]}'
+            self.stdout.write(
+                f'{name:<18}{result["p50_ms"]:>10.1f}{result["p95_ms"]:>10.1f}{result["p99_ms"]:>10.1f}'
+                f'{queries:>10}  {result["statuses"]}'
+            )
+
+        scenarios = run_benchmark(
+            scenarios=options['scenarios'],
+            iterations=options['iterations'],
+            seed=options['seed'],
+            warm=options['warm'],
+            progress=progress,
+        )
+        return {
+            'meta': benchmark_meta(size, options['seed'], options['iterations'], options['warm']),
+            'scenarios': scenarios,
+        }
+
+    def run_concurrent(self, options):
+        self.stdout.write(
+            f'{options["readers"]} readers, {options["writers"]} writers, {options["duration"]:g} s per mode'
+        )
+        self.stdout.write(f'{"mode":<10}{"":<8}{"ops/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"locked":>8}')
+
+        def progress(name, result):
+            for kind in ('reads', 'writes'):
+                row = result[kind]
+                self.stdout.write(
+                    f'{name:<10}{kind:<8}{row["per_second"]:>10.1f}{row.get("p50_ms", 0):>10.1f}'
+                    f'{row.get("p95_ms", 0):>10.1f}{row.get("p99_ms", 0):>10.1f}{row["locked_errors"]:>8}'
+                )
+
+        concurrent = run_concurrent(
+            readers=options['readers'],
+            writers=options['writers'],
+            duration=options['duration'],
+            seed=options['seed'],
+            modes=options['modes'],
+            progress=progress,
+        )
+        meta = benchmark_meta(options['size'], options['seed'], options['iterations'], options['warm'])
+        meta.update(readers=options['readers'], writers=options['writers'], duration=options['duration'])
+        return {'meta': meta, 'concurrent': concurrent}
+
+    def seed_progress(self, created):
+        self.stdout.write(f'  {created} movies')
+
+    def report_comparison(self, rows):
+        regressions = [row for row in rows if row['regressed']]
+        for row in rows:
+            line = (
+                f'{row["scenario"]:<18} p95 {row["baseline_p95_ms"]:.1f} -> {row["p95_ms"]:.1f} ms '
+                f'({row["p95_change_pct"]:+.1f}%), queries {row["baseline_queries_max"]} -> {row["queries_max"]}'
+            )
+            self.stdout.write(self.style.ERROR(line) if row['regressed'] else line)
+        if regressions:
+            raise CommandError(f'{len(regressions)} scenario(s) regressed against the baseline')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
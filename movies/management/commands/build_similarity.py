@@ -0,0 +1,33 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from movies.config import SIMILAR_CHUNK_SIZE
+from movies.similarity import build_similarity_index, np
+
+
+class Command(BaseCommand):
+    help = 'Precompute the "More like this" neighbours of every movie from genres, category and text'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to index')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Worker processes scoring batches of movies (1 scores in this process)',
+        )
+        parser.add_argument('--chunk-size', type=int, default=SIMILAR_CHUNK_SIZE, help='Movies per batch')
+
+    def handle(self, *args, **options):
+        def progress(done, total):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{done}/{total} movies scored')
+
+        movies, neighbours = build_similarity_index(
+            using=options['database'], workers=options['workers'], chunk_size=options['chunk_size'],
+            progress=progress,
+        )
+        engine = 'NumPy' if np is not None else 'pure Python'
+        self.stdout.write(self.style.SUCCESS(
+            f'Similarity index built with {engine}: {neighbours} neighbours for {movies} movies'
+        ))
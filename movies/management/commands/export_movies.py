@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from movies.config import EXPORT_CHUNK_SIZE
+from movies.exporter import EXPORT_FORMATS, ExportError, export_queryset, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        'Export the movie catalogue as CSV, JSON Lines or Parquet, streaming it in chunks. '
+        'Parquet output requires pyarrow'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help='Output format')
+        parser.add_argument('--output', '-o', default='-', help="Output file, or '-' for standard output")
+        parser.add_argument('--q', dest='search_query', help='Only movies matching this search query')
+        parser.add_argument('--category', type=int, help='Only movies in this category id')
+        parser.add_argument('--genre', type=int, action='append', help='Only movies with this genre id (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='Rows fetched per query')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to export from')
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        binary = EXPORT_FORMATS[fmt]['binary']
+        path = options['output']
+        if path == '-' and binary:
+            raise CommandError(f'{fmt} output is binary, use --output')
+
+        queryset = export_queryset(
+            search_query=options['search_query'],
+            category_id=options['category'],
+            genre_ids=options['genre'],
+            using=options['database'],
+        )
+        try:
+            chunks = stream_export(queryset, fmt, chunk_size=options['chunk_size'])
+        except ExportError as exc:
+            raise CommandError(exc)
+
+        if path == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+
+        mode = 'wb' if binary else 'w'
+        with open(path, mode, **({} if binary else {'encoding': 'utf-8', 'newline': ''})) as f:
+            for chunk in chunks:
+                f.write(chunk)
+        self.stderr.write(self.style.SUCCESS(f'Exported movies to {path}'))
@@ -0,0 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from movies.images import IMAGE_FIELDS, generate_renditions
+
+
+class Command(BaseCommand):
+    help = 'Generate missing poster and avatar renditions for existing media'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate renditions that already exist')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker threads')
+
+    def handle(self, *args, **options):
+        for model, (field, flag, sizes) in IMAGE_FIELDS.items():
+            queryset = model.objects.exclude(**{f'{field}__isnull': True}).exclude(**{field: ''})
+            if not options['force']:
+                queryset = queryset.filter(**{flag: False})
+            pks = list(queryset.values_list('pk', flat=True))
+
+            def run(pk, model=model):
+                try:
+                    return generate_renditions(model, pk)
+                except Exception as exc:
+                    self.stderr.write(f'{model.__name__} {pk}: {exc}')
+                    return False
+                finally:
+                    if options['workers'] > 1:
+                        connections.close_all()
+
+            if options['workers'] > 1:
+                with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                    done = sum(executor.map(run, pks))
+            else:
+                done = sum(map(run, pks))
+            self.stdout.write(self.style.SUCCESS(
+                f'{model._meta.verbose_name_plural}: {done} of {len(pks)} renditions generated'
+            ))
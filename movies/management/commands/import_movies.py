@@ -0,0 +1,66 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from movies.config import IMPORT_MAX_ERRORS
+from movies.importer import MovieImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Import movies from a CSV or JSON Lines file, upserting by title and release date. '
+        'Columns: title, description, release_date, category, genres, rating, author'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Path to the file, or '-' for standard input")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Input format (default: from the file extension)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction')
+        parser.add_argument('--genre-separator', default='|', help='Separator for genres in CSV')
+        parser.add_argument(
+            '--rebuild-index', action='store_true',
+            help='Rebuild the search index once at the end instead of indexing every batch',
+        )
+        parser.add_argument(
+            '--max-errors', type=int, default=IMPORT_MAX_ERRORS,
+            help='Rejected rows to list at the end; the rest are only counted and logged',
+        )
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to import into')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format']
+        if fmt is None:
+            ext = os.path.splitext(path)[1].lower()
+            fmt = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}.get(ext)
+            if fmt is None:
+                raise CommandError('Cannot detect the input format, use --format')
+        if path != '-' and not os.path.exists(path):
+            raise CommandError(f'File not found: {path}')
+
+        importer = MovieImporter(
+            using=options['database'],
+            batch_size=options['batch_size'],
+            genre_separator=options['genre_separator'],
+            index=not options['rebuild_index'],
+            max_errors=options['max_errors'],
+        )
+
+        def progress(importer):
+            if options['verbosity'] >= 1:
+                self.stdout.write(
+                    f'{importer.processed} rows: {importer.created} created, {importer.updated} updated, '
+                    f'{importer.skipped} skipped ({importer.rate:.0f} rows/s)'
+                )
+
+        importer.run(read_rows(path, fmt), progress=progress)
+
+        for line, error in importer.errors:
+            self.stderr.write(f'Row {line}: {error}')
+        if importer.errors_omitted:
+            self.stderr.write(f'... and {importer.errors_omitted} more errors (logged by movies.importer)')
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.processed} rows in {importer.elapsed:.1f}s ({importer.rate:.0f} rows/s): '
+            f'{importer.created} created, {importer.updated} updated, {importer.skipped} skipped'
+        ))
@@ -47,14 +47,16 @@ class Command(BaseCommand):
                 'description': 'This is a sample movie description',
                 'category': categories[0],
                 'author': user,
-                'rating': 8.5
+                'rating': 8.5,
+                'author_rating': 8.5,
             },
             {
                 'title': 'Sample Movie 2',
                 'description': 'Another sample movie with an action-packed plot',
                 'category': categories[1],
                 'author': user,
-                'rating': 7.2
+                'rating': 7.2,
+                'author_rating': 7.2,
             },
         ]
         
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from movies.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to rebuild')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        backend = get_search_backend(using)
+        count = backend.rebuild(using=using)
+        self.stdout.write(self.style.SUCCESS(
+            f'Search index rebuilt with {backend.__class__.__name__}: {count} movies'
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from movies.cache import bump_catalogue_version
+from movies.counters import reconcile_counters
+from movies.leaderboards import reset_leaderboards
+from movies.page_cache import CATALOGUE_TAG, invalidate_pages
+
+
+class Command(BaseCommand):
+    help = 'Recompute denormalised movie counts on categories and genres and rebuild the leaderboards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to reconcile')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            categories, genres = reconcile_counters(using=using)
+            bump_catalogue_version(using=using)
+            invalidate_pages([CATALOGUE_TAG], using=using)
+        reset_leaderboards()
+        self.stdout.write(self.style.SUCCESS(
+            f'Counters reconciled: {categories} categories and {genres} genres had drifted'
+        ))
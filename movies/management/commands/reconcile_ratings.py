@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from movies.cache import bump_catalogue_version
+from movies.leaderboards import reset_leaderboards
+from movies.page_cache import CATALOGUE_TAG, invalidate_pages
+from movies.ratings import reconcile_ratings
+
+
+class Command(BaseCommand):
+    help = 'Recompute vote sums, vote counts and Bayesian ratings of all movies from the ratings table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to reconcile')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        with transaction.atomic(using=using):
+            fixed = reconcile_ratings(using=using)
+            bump_catalogue_version(using=using)
+            invalidate_pages([CATALOGUE_TAG], using=using)
+        reset_leaderboards()
+        self.stdout.write(self.style.SUCCESS(f'Ratings reconciled: {fixed} movies had drifted'))
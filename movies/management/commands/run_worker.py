@@ -0,0 +1,51 @@
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from movies.cache import is_shared_cache
+from movies.config import TASK_POLL_INTERVAL
+from movies.tasks import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background tasks (image renditions, file deletion) from the database queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias holding the queue')
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Tasks run at the same time (1 runs them in this thread)',
+        )
+        parser.add_argument(
+            '--mode', choices=['thread', 'process'], default='thread',
+            help='Run tasks in a thread pool or a process pool',
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=TASK_POLL_INTERVAL,
+            help='Seconds to wait when the queue is empty',
+        )
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        if not is_shared_cache():
+            self.stderr.write(self.style.WARNING(
+                'The default cache is local to this process: cache invalidation from tasks will not reach '
+                'the web processes. Set REDIS_URL to share it.'
+            ))
+        worker = Worker(
+            concurrency=options['concurrency'], mode=options['mode'], using=options['database'],
+            poll_interval=options['poll_interval'],
+        )
+        # Остановка по сигналу дожидается начатых задач
+        handlers = {signum: signal.signal(signum, worker.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        if options['verbosity'] > 1:
+            self.stdout.write(f'Worker {worker.name} started')
+        try:
+            worker.run(burst=options['burst'])
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(
+            f'{worker.processed} tasks processed, {worker.failed} failed'
+        ))
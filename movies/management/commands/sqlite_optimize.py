@@ -0,0 +1,91 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from movies.models import Category, Genre
+from movies.views import MovieListView
+
+
+PRAGMAS = ['journal_mode', 'synchronous', 'mmap_size', 'cache_size', 'busy_timeout', 'temp_store']
+DUMMY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Refresh SQLite planner statistics (PRAGMA optimize, or ANALYZE with --full), show the '
+        'connection PRAGMAs and the query plans of the queries MovieListView runs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Run a full ANALYZE instead of PRAGMA optimize')
+        parser.add_argument('--no-plans', action='store_true', help='Skip the query plan report')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='Database alias to optimize')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            raise CommandError(f'{options["database"]} is not an SQLite database')
+
+        with connection.cursor() as cursor:
+            for pragma in PRAGMAS:
+                cursor.execute(f'PRAGMA {pragma}')
+                row = cursor.fetchone()
+                # mmap_size у базы в памяти не возвращает строки
+                self.stdout.write(f'{pragma} = {row[0] if row else "n/a"}')
+            if options['full']:
+                cursor.execute('ANALYZE')
+                self.stdout.write(self.style.SUCCESS('ANALYZE complete'))
+            else:
+                # Пересобирает статистику только там, где она устарела
+                cursor.execute('PRAGMA analysis_limit=1000')
+                cursor.execute('PRAGMA optimize')
+                self.stdout.write(self.style.SUCCESS('PRAGMA optimize complete'))
+
+        if not options['no_plans']:
+            self.report_plans(connection)
+
+    def list_requests(self):
+        """Типичные запросы к списку фильмов"""
+        requests = [{}, {'sort': '-rating'}, {'sort': 'title'}, {'q': 'the'}, {'rating': '7'}, {'page': 'last'}]
+        genre = Genre.objects.order_by('-movie_count').values_list('pk', flat=True).first()
+        category = Category.objects.order_by('-movie_count').values_list('pk', flat=True).first()
+        if genre:
+            requests.append({'genre': str(genre), 'sort': '-rating'})
+        if category:
+            requests.append({'category': str(category)})
+        return requests
+
+    def report_plans(self, connection):
+        factory = RequestFactory()
+        view = MovieListView.as_view()
+        seen, scans, temp_sorts = set(), 0, 0
+        # Без кэша, чтобы увидеть все запросы, включая фасеты
+        with override_settings(CACHES=DUMMY_CACHE):
+            for params in self.list_requests():
+                request = factory.get('/', params)
+                request.user = AnonymousUser()
+                with CaptureQueriesContext(connection) as captured:
+                    response = view(request)
+                    if response.status_code == 200:
+                        response.render()
+                for query in captured.captured_queries:
+                    sql = query['sql']
+                    if not sql.startswith('SELECT') or sql in seen:
+                        continue
+                    seen.add(sql)
+                    with connection.cursor() as cursor:
+                        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                        plan = [row[-1] for row in cursor.fetchall()]
+                    self.stdout.write(f'\n{params or "home"}: {sql[:160]}')
+                    for step in plan:
+                        full_scan = step.startswith('SCAN') and 'INDEX' not in step and 'fts' not in step
+                        temp_sort = 'TEMP B-TREE' in step
+                        scans += full_scan
+                        temp_sorts += temp_sort
+                        line = f'    {step}'
+                        self.stdout.write(self.style.WARNING(line) if full_scan or temp_sort else line)
+        self.stdout.write(
+            f'\n{len(seen)} distinct queries: {scans} full table scans, {temp_sorts} temporary sorts'
+        )
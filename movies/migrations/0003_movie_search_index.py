@@ -0,0 +1,46 @@
+from django.db import migrations
+
+
+SQLITE_CREATE = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS movies_movie_fts USING fts5("
+    "title, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+)
+SQLITE_FILL = (
+    "INSERT INTO movies_movie_fts(rowid, title, description) "
+    "SELECT id, title, description FROM movies_movie"
+)
+SQLITE_DROP = "DROP TABLE IF EXISTS movies_movie_fts"
+
+POSTGRES_CREATE = (
+    "CREATE INDEX IF NOT EXISTS movies_movie_search_idx ON movies_movie USING GIN "
+    "((to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))))"
+)
+POSTGRES_DROP = "DROP INDEX IF EXISTS movies_movie_search_idx"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_CREATE)
+        schema_editor.execute(SQLITE_FILL)
+    elif vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_CREATE)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(SQLITE_DROP)
+    elif vendor == 'postgresql':
+        schema_editor.execute(POSTGRES_DROP)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0002_alter_movie_options_movie_author_movie_rating_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
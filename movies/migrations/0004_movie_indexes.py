@@ -0,0 +1,50 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0003_movie_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='category',
+            options={'ordering': ['name'], 'verbose_name_plural': 'Categories'},
+        ),
+        migrations.AlterModelOptions(
+            name='genre',
+            options={'ordering': ['name']},
+        ),
+        migrations.AlterModelOptions(
+            name='userprofile',
+            options={'ordering': ['-created_at'], 'verbose_name': 'User Profile', 'verbose_name_plural': 'User Profiles'},
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='rating',
+            field=models.DecimalField(db_index=True, decimal_places=1, default=0, max_digits=3),
+        ),
+        migrations.AlterField(
+            model_name='movie',
+            name='title',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['title', '-created_at'], name='movies_movi_title_eed414_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['-rating'], name='movies_movi_rating_85da77_idx'),
+        ),
+    ]
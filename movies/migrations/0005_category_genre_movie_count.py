@@ -0,0 +1,33 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_movie_counts(apps, schema_editor):
+    Category = apps.get_model('movies', 'Category')
+    Genre = apps.get_model('movies', 'Genre')
+    using = schema_editor.connection.alias
+    for model in (Category, Genre):
+        for obj in model.objects.using(using).annotate(total=Count('movies')):
+            if obj.total:
+                model.objects.using(using).filter(pk=obj.pk).update(movie_count=obj.total)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0004_movie_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='movie_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Movies'),
+        ),
+        migrations.AddField(
+            model_name='genre',
+            name='movie_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Movies'),
+        ),
+        migrations.RunPython(fill_movie_counts, migrations.RunPython.noop),
+    ]
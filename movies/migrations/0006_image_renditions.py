@@ -0,0 +1,23 @@
+# Generated by Django 6.0.2 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0005_category_genre_movie_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='poster_renditions',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='avatar_renditions',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 14:31
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0006_image_renditions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movie',
+            index=models.Index(fields=['author', '-created_at'], name='movies_movi_author__4d7efd_idx'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:02
+
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def keep_author_ratings(apps, schema_editor):
+    # Рейтинг, выставленный автором, становится априорной оценкой для голосов
+    Movie = apps.get_model('movies', 'Movie')
+    Movie.objects.using(schema_editor.connection.alias).exclude(rating=0).update(author_rating=F('rating'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0007_movie_author_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='author_rating',
+            field=models.DecimalField(blank=True, decimal_places=1, max_digits=3, null=True, verbose_name='Author rating'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Votes'),
+        ),
+        migrations.AddField(
+            model_name='movie',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Rating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveSmallIntegerField(validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(10)])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='movies.movie')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'movie'), name='unique_user_movie_rating'), models.CheckConstraint(condition=models.Q(('score__gte', 1), ('score__lte', 10)), name='rating_score_range')],
+            },
+        ),
+        migrations.RunPython(keep_author_ratings, migrations.RunPython.noop),
+    ]
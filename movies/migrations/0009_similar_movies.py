@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 15:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('movies', '0008_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarMovie',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbours', to='movies.movie')),
+                ('similar', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbour_of', to='movies.movie')),
+            ],
+            options={
+                'ordering': ['movie', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('movie', 'rank'), name='unique_movie_neighbour_rank')],
+            },
+        ),
+    ]
@@ -1,7 +1,21 @@
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.http import HttpResponseForbidden
+from django.core.paginator import Page, Paginator
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .cache import aget_categories, aget_genres, catalogue_key, get_categories, get_genres
+from .conditional import ahas_pending_messages, conditional_response, has_pending_messages, set_validators
+from .config import CACHE_TIMEOUT, PROFILE_MOVIES_PER_PAGE, RATING_FACETS
+from .facets import afacet_counts, facet_counts, rating_facet_label
+from .filters import MovieFilter
+from .models import Movie
+from .leaderboards import leaderboard_scope
+from .pagination import KeysetPage, KeysetPaginator
+from .routers import PIN_COOKIE, replica_reads
 
 
 class MovieOwnerTestMixin(UserPassesTestMixin):
@@ -13,6 +27,14 @@ class MovieOwnerTestMixin(UserPassesTestMixin):
         movie = self.get_object()
         return movie.author == self.request.user or self.request.user.is_staff
     
+    def get_object(self, queryset=None):
+        # test_func() и get()/post() представления берут один и тот же фильм
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_movie'):
+            self._movie = super().get_object()
+        return self._movie
+    
     def handle_no_permission(self):
         messages.error(self.request, 'You do not have permission to perform this action')
         return redirect('movies:list')
@@ -30,3 +52,256 @@ class ProfileOwnerTestMixin(UserPassesTestMixin):
     def handle_no_permission(self):
         messages.error(self.request, 'You can only edit your own profile')
         return redirect('movies:profile')
+
+
+class ReplicaReadMixin:
+    """
+    GET и HEAD читают с реплик (movies.routers). Ответ рендерится внутри
+    dispatch, чтобы ленивые запросы шаблона тоже ушли на реплику
+    """
+    
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or PIN_COOKIE in request.COOKIES:
+            return super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            response = super().dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+        return response
+
+
+class AsyncReplicaReadMixin:
+    """ReplicaReadMixin для асинхронных представлений"""
+    
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or PIN_COOKIE in request.COOKIES:
+            return await super().dispatch(request, *args, **kwargs)
+        with replica_reads():
+            return await super().dispatch(request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    Условный GET (movies.conditional): get_validators() возвращает
+    (etag, last_modified) до рендеринга, актуальная версия у клиента - 304.
+    Страница с ожидающими сообщениями рендерится всегда и без валидаторов
+    """
+    
+    def get_validators(self):
+        return None, None
+    
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or has_pending_messages(request):
+            return super().dispatch(request, *args, **kwargs)
+        etag, last_modified = self.get_validators()
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
+
+class AsyncConditionalGetMixin:
+    """ConditionalGetMixin для асинхронных представлений: aget_validators()"""
+    
+    async def aget_validators(self):
+        return None, None
+    
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or await ahas_pending_messages(request):
+            return await super().dispatch(request, *args, **kwargs)
+        etag, last_modified = await self.aget_validators()
+        response = conditional_response(request, etag, last_modified)
+        if response is None:
+            response = await super().dispatch(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified)
+
+
+class MovieFilterMixin:
+    """
+    Общая фильтрация и сортировка фильмов по GET-параметрам
+    (используется списком фильмов и AJAX-фильтром)
+    """
+    def get_filter(self):
+        """Фильтр запроса (movies.filters), разбирается один раз"""
+        if not hasattr(self, '_movie_filter'):
+            self._movie_filter = MovieFilter.from_query(self.request.GET)
+        return self._movie_filter
+    
+    def get_cache_key(self, name, exclude=(), version=None):
+        """Ключ кэша поколения каталога (по умолчанию текущего) для этого фильтра и страницы"""
+        pagination = [self.request.GET.get(key, '') for key in ('page', 'after') if key not in exclude]
+        digest = self.get_filter().without(*exclude).digest(*pagination)
+        return catalogue_key(f'{name}:{digest}', version)
+    
+    def has_filters(self):
+        return self.get_filter().has_filters()
+    
+    def filter_queryset(self, qs, exclude=(), rank=False):
+        """Применить фильтры из GET, кроме перечисленных в exclude"""
+        return self.get_filter().without(*exclude).apply(qs, rank=rank)
+    
+    def get_filtered_queryset(self):
+        # Карточкам жанры не нужны, поэтому prefetch_related('genres') здесь не делается
+        return self.get_filter().queryset(Movie.objects.select_related('category', 'author'))
+    
+    def get_facets(self):
+        """Фасетные счётчики для текущих фильтров (из кэша поколения каталога)"""
+        key = self.get_cache_key('facets', exclude=('sort', 'page', 'after'))
+        facets = cache.get(key)
+        if facets is None:
+            facets = facet_counts(**self.get_facet_querysets())
+            cache.set(key, facets, CACHE_TIMEOUT)
+        return facets
+    
+    async def aget_facets(self, version):
+        key = self.get_cache_key('facets', exclude=('sort', 'page', 'after'), version=version)
+        facets = await cache.aget(key)
+        if facets is None:
+            facets = await afacet_counts(**self.get_facet_querysets(), version=version)
+            await cache.aset(key, facets, CACHE_TIMEOUT)
+        return facets
+    
+    def get_facet_querysets(self):
+        base = Movie.objects.all()
+        # В режиме all счётчик жанра - сколько фильмов останется, если добавить и его
+        genre_exclude = ('genre',) if self.get_filter().genre_mode == 'any' else ()
+        return {
+            'queryset': self.filter_queryset(base),
+            'genre_queryset': self.filter_queryset(base, exclude=genre_exclude),
+            'category_queryset': self.filter_queryset(base, exclude=('category',)),
+            'unfiltered': not self.has_filters(),
+        }
+    
+    def facet_url(self, name, value):
+        """Ссылка на текущую выборку с другим значением фасета name"""
+        params = self.request.GET.copy()
+        for key in (name, 'page', 'after'):
+            params.pop(key, None)
+        if value is not None:
+            params[name] = value
+        return f'?{params.urlencode()}'
+    
+    def get_facet_context(self):
+        return self.build_facet_context(self.get_facets(), get_genres(), get_categories())
+    
+    async def aget_facet_context(self, version):
+        facets = await self.aget_facets(version)
+        return self.build_facet_context(facets, await aget_genres(version), await aget_categories(version))
+    
+    def build_facet_context(self, facets, genres, categories):
+        current_category = self.request.GET.get('category', '')
+        current_rating = self.request.GET.get('rating', '')
+        return {
+            'genre_facets': [
+                {'genre': genre, 'count': facets['genres'].get(genre.pk, 0)}
+                for genre in genres
+            ],
+            'category_facets': [
+                {
+                    'category': category,
+                    'count': facets['categories'].get(category.pk, 0),
+                    'url': self.facet_url('category', category.pk),
+                    'active': str(category.pk) == current_category,
+                }
+                for category in categories
+            ],
+            'rating_facets': [
+                {
+                    'value': low,
+                    'label': rating_facet_label(low, high),
+                    'count': facets['ratings'].get(low, 0),
+                    'url': self.facet_url('rating', low),
+                    'active': str(low) == current_rating,
+                }
+                for low, high in RATING_FACETS
+            ],
+            'clear_category_url': self.facet_url('category', None),
+            'clear_rating_url': self.facet_url('rating', None),
+        }
+    
+    def get_filter_context(self):
+        """Текущие фильтры для формы, ссылок сортировки и пагинации"""
+        params = self.request.GET.copy()
+        params.pop('page', None)
+        params.pop('after', None)
+        movie_filter = self.get_filter()
+        return {
+            'querystring': params.urlencode(),
+            'q': self.request.GET.get('q', ''),
+            'category': self.request.GET.get('category', ''),
+            'rating': self.request.GET.get('rating', ''),
+            'sort': self.request.GET.get('sort', '-created_at'),
+            'selected_genres': list(movie_filter.genre),
+            'genre_mode': movie_filter.genre_mode,
+        }
+
+
+class LeaderboardMixin:
+    """
+    Первая страница списка с sort=-rating из рейтинга (movies.leaderboards):
+    порядок и число фильмов берутся из кэша, фильмы - одним запросом по pk
+    """
+    
+    def get_leaderboard_scope(self):
+        get = self.request.GET
+        if get.get('page') not in (None, '', '1') or get.get('after'):
+            return None
+        return leaderboard_scope(self.get_filter())
+    
+    def leaderboard_page(self, queryset, page_size, movies, count):
+        """(paginator, page) первой страницы, как их построил бы обычный путь"""
+        if self.is_cursor_mode():
+            paginator = KeysetPaginator(queryset, page_size, count_mode=self.count_mode)
+            if self.count_mode != 'none':
+                paginator.count = count
+            has_next = count > page_size
+            next_cursor = paginator.encode_cursor(movies[-1]) if has_next else None
+            return paginator, KeysetPage(movies, paginator, has_next, next_cursor, has_previous=False)
+        paginator = Paginator(queryset, page_size)
+        paginator.count = count
+        return paginator, Page(movies, 1, paginator)
+
+
+class CardsFragmentMixin:
+    """Ответ AJAX-фильтра: карточки и заголовки со следующей страницей и фасетами"""
+    
+    def get_next_page(self, page):
+        """(курсор, адрес) следующей страницы или (None, None)"""
+        if not page.has_next():
+            return None, None
+        params = self.request.GET.copy()
+        params['after'] = page.next_cursor
+        return page.next_cursor, f'{self.request.path}?{params.urlencode()}'
+    
+    def fragment_response(self, content, next_cursor, next_url, facets):
+        response = HttpResponse(content)
+        response['X-Facets'] = facets
+        if next_cursor:
+            response['X-Next-Cursor'] = next_cursor
+            response['X-Next-Page-Url'] = next_url
+        return response
+
+
+class ProfileMoviesMixin:
+    """
+    Фильмы автора страницами по курсору (профиль и его AJAX-фрагмент).
+    Индекс (author, -created_at) делает любую страницу одинаково дешёвой
+    """
+    movies_per_page = PROFILE_MOVIES_PER_PAGE
+    
+    def get_movies_paginator(self, user, count_mode='none'):
+        movies = (
+            Movie.objects.filter(author=user)
+            .select_related('category', 'author')
+            .order_by('-created_at', '-pk')
+        )
+        return KeysetPaginator(movies, self.movies_per_page, count_mode=count_mode)
+    
+    def get_movies_page(self, paginator, user):
+        """Страница и адрес следующей во фрагменте movies:profile_movies (или None)"""
+        page = paginator.page(self.request.GET.get('after'))
+        next_url = None
+        if page.has_next():
+            url = reverse('movies:profile_movies', kwargs={'username': user.username})
+            next_url = f'{url}?{urlencode({"after": page.next_cursor})}'
+        return page, next_url
@@ -1,10 +1,17 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import DEFERRED
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+
+from .config import MAX_VOTE, MIN_VOTE, TASK_MAX_ATTEMPTS
 
 
 class Category(models.Model):
 	name = models.CharField(max_length=100, unique=True)
+	# Денормализованный счётчик, поддерживается сигналами (movies.counters)
+	movie_count = models.PositiveIntegerField('Movies', default=0, editable=False)
 
 	class Meta:
 		verbose_name_plural = 'Categories'
@@ -14,11 +21,13 @@ class Category(models.Model):
 		return self.name
 	
 	def get_movie_count(self):
-		return self.movies.count()
+		return self.movie_count
 
 
 class Genre(models.Model):
 	name = models.CharField(max_length=100, unique=True)
+	# Денормализованный счётчик, поддерживается сигналами (movies.counters)
+	movie_count = models.PositiveIntegerField('Movies', default=0, editable=False)
 
 	class Meta:
 		ordering = ['name']
@@ -27,12 +36,14 @@ class Genre(models.Model):
 		return self.name
 	
 	def get_movie_count(self):
-		return self.movies.count()
+		return self.movie_count
 
 
 class UserProfile(models.Model):
 	user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
 	avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+	# Уменьшенные копии аватара готовы (movies.images)
+	avatar_renditions = models.BooleanField(default=False, editable=False)
 	bio = models.TextField(max_length=500, blank=True)
 	birth_date = models.DateField(null=True, blank=True)
 	phone = models.CharField(max_length=20, blank=True)
@@ -47,6 +58,33 @@ class UserProfile(models.Model):
 	def __str__(self):
 		return f'{self.user.username} Profile'
 	
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		instance._loaded_avatar = instance.__dict__.get('avatar', DEFERRED)
+		instance._loaded_values = dict(zip(field_names, values))
+		return instance
+	
+	def save(self, *args, **kwargs):
+		super().save(*args, **kwargs)
+		self._loaded_values = {f.attname: self._prep_value(f) for f in self._meta.concrete_fields}
+	
+	def _prep_value(self, field):
+		return field.get_prep_value(field.value_from_object(self))
+	
+	def get_changed_fields(self):
+		"""
+		Поля, изменённые после загрузки или сохранения.
+		None - профиль ещё не сохранён (или загружен не из БД)
+		"""
+		loaded = getattr(self, '_loaded_values', None)
+		if self._state.adding or loaded is None:
+			return None
+		return [
+			f.name for f in self._meta.concrete_fields
+			if f.attname in loaded and not f.primary_key and self._prep_value(f) != loaded[f.attname]
+		]
+	
 	def get_absolute_url(self):
 		return reverse('movies:user_profile', kwargs={'username': self.user.username})
 
@@ -56,10 +94,18 @@ class Movie(models.Model):
 	description = models.TextField(blank=True)
 	release_date = models.DateField(null=True, blank=True)
 	poster = models.ImageField(upload_to='posters/', null=True, blank=True)
+	# Уменьшенные копии постера готовы (movies.images)
+	poster_renditions = models.BooleanField(default=False, editable=False)
 	category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='movies')
 	genres = models.ManyToManyField(Genre, blank=True, related_name='movies')
 	author = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='movies')
+	# Байесовское среднее голосов (movies.ratings), 0 - не оценён
 	rating = models.DecimalField(max_digits=3, decimal_places=1, default=0, db_index=True)
+	# Оценка автора - априорное среднее для голосов пользователей
+	author_rating = models.DecimalField('Author rating', max_digits=3, decimal_places=1, null=True, blank=True)
+	# Сумма и число голосов, меняются только F()-выражениями (movies.ratings)
+	rating_sum = models.PositiveIntegerField(default=0, editable=False)
+	rating_count = models.PositiveIntegerField('Votes', default=0, editable=False)
 	created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 	updated_at = models.DateTimeField(auto_now=True)
 
@@ -68,6 +114,8 @@ class Movie(models.Model):
 		indexes = [
 			models.Index(fields=['title', '-created_at']),
 			models.Index(fields=['-rating']),
+			# Фильмы автора в профиле: WHERE author_id = ? ORDER BY created_at DESC
+			models.Index(fields=['author', '-created_at']),
 		]
 
 	def __str__(self):
@@ -76,5 +124,94 @@ class Movie(models.Model):
 	def get_absolute_url(self):
 		return reverse('movies:detail', kwargs={'pk': self.pk})
 	
+	@classmethod
+	def from_db(cls, db, field_names, values):
+		instance = super().from_db(db, field_names, values)
+		# Категория на момент загрузки - чтобы при сохранении поправить счётчики без запроса
+		instance._loaded_category_id = instance.__dict__.get('category_id', DEFERRED)
+		instance._loaded_poster = instance.__dict__.get('poster', DEFERRED)
+		instance._loaded_rating = instance.__dict__.get('rating', DEFERRED)
+		return instance
+	
 	def get_rating_display(self):
 		return f"{self.rating}/10"
+
+
+class Rating(models.Model):
+	"""Голос пользователя за фильм; один на пару (пользователь, фильм)"""
+	user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='ratings')
+	movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='ratings')
+	score = models.PositiveSmallIntegerField(validators=[MinValueValidator(MIN_VOTE), MaxValueValidator(MAX_VOTE)])
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		ordering = ['-updated_at']
+		constraints = [
+			models.UniqueConstraint(fields=['user', 'movie'], name='unique_user_movie_rating'),
+			models.CheckConstraint(
+				condition=models.Q(score__gte=MIN_VOTE, score__lte=MAX_VOTE), name='rating_score_range',
+			),
+		]
+
+	def __str__(self):
+		return f'{self.user} - {self.movie}: {self.score}'
+
+
+class SimilarMovie(models.Model):
+	"""Сосед фильма в индексе похожих фильмов (movies.similarity)"""
+	movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='neighbours')
+	similar = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='neighbour_of')
+	rank = models.PositiveSmallIntegerField()
+	score = models.FloatField()
+
+	class Meta:
+		ordering = ['movie', 'rank']
+		constraints = [
+			# Соседи читаются по этому индексу: WHERE movie_id = ? ORDER BY rank
+			models.UniqueConstraint(fields=['movie', 'rank'], name='unique_movie_neighbour_rank'),
+		]
+
+	def __str__(self):
+		return f'{self.movie_id} -> {self.similar_id} ({self.score:.3f})'
+
+
+class Task(models.Model):
+	"""Фоновая задача в очереди movies.tasks"""
+	QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+	STATUS_CHOICES = [
+		(QUEUED, 'Queued'),
+		(RUNNING, 'Running'),
+		(DONE, 'Done'),
+		(FAILED, 'Failed'),
+	]
+
+	name = models.CharField(max_length=100)
+	kwargs = models.JSONField(default=dict, blank=True)
+	key = models.CharField(max_length=255, null=True, blank=True, help_text='Idempotency key')
+	status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	max_attempts = models.PositiveSmallIntegerField(default=TASK_MAX_ATTEMPTS)
+	run_after = models.DateTimeField(default=timezone.now)
+	locked_until = models.DateTimeField(null=True, blank=True)
+	worker = models.CharField(max_length=100, blank=True)
+	last_error = models.TextField(blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		ordering = ['run_after']
+		indexes = [
+			# Выборка обработчиком: WHERE status = ? AND run_after <= ? ORDER BY run_after
+			models.Index(fields=['status', 'run_after'], name='task_status_run_after_idx'),
+		]
+		constraints = [
+			# Ожидающая задача с ключом одна; выполняемая не мешает поставить новую
+			models.UniqueConstraint(
+				fields=['key'], condition=models.Q(status='queued'), name='unique_queued_task_key',
+			),
+		]
+
+	def __str__(self):
+		return f'{self.name} #{self.pk} ({self.status})'
+
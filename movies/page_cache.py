@@ -0,0 +1,241 @@
+"""
+Кэш целых страниц каталога для анонимных посетителей.
+
+PageCacheMiddleware стоит до сессий и сообщений: запрос списка или
+страницы фильма без cookie сессии и сообщений отдаётся из кэша
+MOVIES_PAGE_CACHE_ALIAS, не доходя ни до них, ни до представления.
+Ключ - путь, нормализованный query string и версии тегов страницы.
+Теги выводятся из URL: страница фильма зависит от movie:<pk>, список - от
+тега, которому обязан соответствовать любой фильм на странице и в её
+фасетах (rating:<low>, category:<pk> вместе с genre:<pk> или list).
+Тег catalogue есть у всех страниц: счётчики категорий в навигации, названия,
+авторы. movies.signals увеличивают версии только тегов изменённого фильма,
+и остальные страницы остаются в кэше. Ответы, которые ставят cookie,
+используют CSRF-токен или выводят сообщения, не сохраняются.
+"""
+import hashlib
+import time
+from decimal import Decimal
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
+
+from .config import PAGE_CACHE_TIMEOUT, RATING_FACETS
+from .filters import MovieFilter
+from .models import Movie
+
+
+TAG_KEY = 'movies:pages:tag:{}'
+# GET-параметры списка (MovieFilter и пагинация); с другими параметрами кэш не используется
+LIST_PARAMS = {'q', 'category', 'genre', 'genre_mode', 'rating', 'sort', 'page', 'after'}
+CACHED_VIEWS = {'movies:list', 'movies:detail'}
+CATALOGUE_TAG = 'catalogue'
+LIST_TAG = 'list'
+
+
+def get_page_cache():
+    return caches[getattr(settings, 'MOVIES_PAGE_CACHE_ALIAS', 'pages')]
+
+
+def rating_tag(rating):
+    """Тег диапазона RATING_FACETS, в который попадает рейтинг"""
+    rating = Decimal(rating)
+    for low, high in RATING_FACETS:
+        if rating >= low:
+            return f'rating:{low}'
+    return f'rating:{RATING_FACETS[-1][0]}'
+
+
+def list_page_tags(query):
+    """Теги страницы списка с GET-параметрами query"""
+    movie_filter = MovieFilter.from_query(query)
+    if movie_filter.rating is not None:
+        # Рейтинг входит во все выборки страницы, включая фасеты
+        return [f'rating:{movie_filter.rating}']
+    if movie_filter.category is not None and movie_filter.genre:
+        # Карточки - фильмы категории, фасет категорий - фильмы этих жанров
+        return [f'category:{movie_filter.category}', *(f'genre:{genre}' for genre in movie_filter.genre)]
+    return [LIST_TAG]
+
+
+def page_tags(view_name, kwargs, query):
+    if view_name == 'movies:detail':
+        return [CATALOGUE_TAG, f'movie:{kwargs["pk"]}']
+    return [CATALOGUE_TAG, *list_page_tags(query)]
+
+
+def normalize_query(query):
+    """Query string с параметрами в постоянном порядке"""
+    return '&'.join(f'{key}={value}' for key, value in sorted(
+        (key, value) for key in query for value in query.getlist(key)
+    ))
+
+
+def page_key(path, query, versions):
+    payload = ':'.join([getattr(settings, 'MOVIES_ETAG_VERSION', ''), path, normalize_query(query), *map(str, versions)])
+    return f'movies:pages:{hashlib.md5(payload.encode()).hexdigest()}'
+
+
+def get_tag_versions(tags):
+    page_cache = get_page_cache()
+    keys = [TAG_KEY.format(tag) for tag in tags]
+    versions = page_cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Как у поколения каталога: начальное значение от времени
+            page_cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = page_cache.get(key)
+    return [versions[key] for key in keys]
+
+
+async def aget_tag_versions(tags):
+    page_cache = get_page_cache()
+    keys = [TAG_KEY.format(tag) for tag in tags]
+    versions = await page_cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            await page_cache.aadd(key, time.time_ns(), timeout=None)
+            versions[key] = await page_cache.aget(key)
+    return [versions[key] for key in keys]
+
+
+def _bump_tags(tags):
+    page_cache = get_page_cache()
+    for tag in tags:
+        key = TAG_KEY.format(tag)
+        try:
+            page_cache.incr(key)
+        except ValueError:
+            page_cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_pages(tags, using=None):
+    """Сбросить страницы с тегами tags сразу и ещё раз после коммита"""
+    tags = set(tags)
+    _bump_tags(tags)
+    transaction.on_commit(lambda: _bump_tags(tags), using=using)
+
+
+def movie_tags(pk, category_id, ratings):
+    """Теги страниц, на которых (или в фасетах которых) выводится фильм"""
+    tags = {f'movie:{pk}', LIST_TAG, *(rating_tag(rating) for rating in ratings)}
+    if category_id is not None:
+        tags.add(f'category:{category_id}')
+    return tags
+
+
+def invalidate_movie_pages(pk, using=None):
+    """Сбросить страницы фильма, изменённого без сигналов (QuerySet.update)"""
+    row = Movie.objects.using(using).filter(pk=pk).values_list('category_id', 'rating').first()
+    if row is not None:
+        invalidate_pages(movie_tags(pk, row[0], [row[1]]), using=using)
+
+
+def all_rating_tags():
+    return [f'rating:{low}' for low, high in RATING_FACETS]
+
+
+def is_cacheable_request(request):
+    if request.method != 'GET' or 'HTTP_AUTHORIZATION' in request.META:
+        return False
+    cookies = request.COOKIES
+    # Без сессии посетитель анонимный и у него нет сообщений в сессии
+    return settings.SESSION_COOKIE_NAME not in cookies and 'messages' not in cookies
+
+
+def is_cacheable_response(request, response):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    # Токен CSRF или сообщения, выведенные при рендеринге, не должны попасть к другим посетителям
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+        return False
+    storage = getattr(request, '_messages', None)
+    if storage is not None and (storage.used or storage.added_new):
+        return False
+    cache_control = response.get('Cache-Control', '')
+    return 'private' not in cache_control and 'no-store' not in cache_control
+
+
+def cached_response(request, entry):
+    content, headers = entry
+    response = HttpResponse(content, headers=headers)
+    response['X-Page-Cache'] = 'hit'
+    conditional = get_conditional_response(
+        request,
+        etag=response.get('ETag'),
+        last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+        response=response,
+    )
+    return conditional or response
+
+
+class PageCacheMiddleware:
+    """Отдаёт анонимным посетителям список и страницы фильмов из кэша"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'MOVIES_PAGE_CACHE', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def match(self, request):
+        """Совпадение URL, если страницу можно взять из кэша, иначе None"""
+        if not is_cacheable_request(request):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.view_name not in CACHED_VIEWS:
+            return None
+        query = request.GET
+        if (match.view_name == 'movies:detail' and query) or not LIST_PARAMS.issuperset(query):
+            return None
+        # Для метрик InstrumentationMiddleware при попадании в кэш
+        request.resolver_match = match
+        return match
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        match = self.match(request)
+        if match is None:
+            return self.get_response(request)
+        page_cache = get_page_cache()
+        versions = get_tag_versions(page_tags(match.view_name, match.kwargs, request.GET))
+        key = page_key(request.path_info, request.GET, versions)
+        entry = page_cache.get(key)
+        if entry is not None:
+            return cached_response(request, entry)
+        response = self.get_response(request)
+        if is_cacheable_response(request, response):
+            page_cache.set(key, (response.content, dict(response.items())), PAGE_CACHE_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    async def __acall__(self, request):
+        match = self.match(request)
+        if match is None:
+            return await self.get_response(request)
+        page_cache = get_page_cache()
+        versions = await aget_tag_versions(page_tags(match.view_name, match.kwargs, request.GET))
+        key = page_key(request.path_info, request.GET, versions)
+        entry = await page_cache.aget(key)
+        if entry is not None:
+            return cached_response(request, entry)
+        response = await self.get_response(request)
+        if is_cacheable_response(request, response):
+            await page_cache.aset(key, (response.content, dict(response.items())), PAGE_CACHE_TIMEOUT)
+            response['X-Page-Cache'] = 'miss'
+        return response
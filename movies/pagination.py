@@ -0,0 +1,220 @@
+"""
+Keyset-пагинация (по курсору) для упорядоченных querysets.
+
+Вместо OFFSET следующая страница выбирается условием по ключам сортировки
+последней записи, поэтому любая страница стоит столько же, сколько первая.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .config import COUNT_ESTIMATE_CAP
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorJSONEncoder(DjangoJSONEncoder):
+    """DjangoJSONEncoder обрезает микросекунды, а ключу нужна точность"""
+
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def estimate_count(queryset, cap=COUNT_ESTIMATE_CAP):
+    """
+    Приблизительное число строк: оценка планировщика для PostgreSQL,
+    для остальных БД - COUNT, ограниченный cap записями
+    """
+    queryset = queryset.order_by()
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    return queryset[:cap].count()
+
+
+async def aestimate_count(queryset, cap=COUNT_ESTIMATE_CAP):
+    """estimate_count() для асинхронных представлений"""
+    if connections[queryset.db].vendor == 'postgresql':
+        # План читается курсором, у которого нет асинхронного API
+        return await sync_to_async(estimate_count)(queryset, cap)
+    return await queryset.order_by()[:cap].acount()
+
+
+async def apaginate(queryset, per_page, number):
+    """
+    Страница number (или 'last') обычной пагинации с OFFSET через async ORM.
+    Возвращает (Paginator, Page) с уже загруженными count и объектами,
+    шаблон с ними в БД не обращается. Неверный номер - InvalidPage
+    """
+    paginator = Paginator(queryset, per_page)
+    paginator.count = await queryset.acount()
+    number = paginator.num_pages if number == 'last' else paginator.validate_number(number)
+    bottom = (number - 1) * per_page
+    rows = [obj async for obj in queryset[bottom:bottom + per_page].aiterator()]
+    return paginator, Page(rows, number, paginator)
+
+
+class KeysetPage:
+    def __init__(self, object_list, paginator, has_next, next_cursor, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    """
+    count_mode: 'exact' - COUNT(*), 'estimate' - приблизительно (см. estimate_count),
+    'none' - не считать вовсе
+    """
+
+    def __init__(self, queryset, per_page, count_mode='none'):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count_mode = count_mode
+        self.ordering = self.get_ordering(queryset)
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        for key in ordering:
+            if not isinstance(key, str) or '__' in key or '?' in key:
+                raise ValueError(f'Unsupported ordering for keyset pagination: {key!r}')
+        if not ordering or ordering[-1].lstrip('-') not in ('pk', 'id'):
+            # pk в конце делает ключ уникальным
+            ordering.append('-pk' if ordering and ordering[-1].startswith('-') else 'pk')
+        return ordering
+
+    def _convert(self, name, value):
+        if name == 'pk':
+            return self.queryset.model._meta.pk.to_python(value)
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Аннотация (например, search_rank) - значение уже из JSON
+            if not isinstance(value, (int, float)):
+                raise InvalidCursor(f'Invalid cursor value for {name}')
+            return value
+        return field.to_python(value)
+
+    def encode_cursor(self, obj):
+        values = [getattr(obj, key.lstrip('-')) for key in self.ordering]
+        data = json.dumps({'o': self.ordering, 'v': values}, cls=CursorJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            values = data['v']
+            if data['o'] != self.ordering or not isinstance(values, list) or len(values) != len(self.ordering):
+                raise InvalidCursor('Cursor does not match the current ordering')
+            # В курсоре только строки и числа: None, списки и словари в фильтр не попадают
+            if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+                raise InvalidCursor('Invalid cursor value')
+            return [self._convert(key.lstrip('-'), value) for key, value in zip(self.ordering, values)]
+        except InvalidCursor:
+            raise
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError) as exc:
+            raise InvalidCursor(str(exc))
+
+    def after_q(self, values):
+        """
+        Условие «строго после» для лексикографического ключа:
+        a <= v1 AND (a < v1 OR (a = v1 AND b < v2) OR ...)
+        """
+        q = Q()
+        for i, key in enumerate(self.ordering):
+            lookup = 'lt' if key.startswith('-') else 'gt'
+            condition = Q(**{f'{key.lstrip("-")}__{lookup}': values[i]})
+            for prev_key, prev_value in zip(self.ordering[:i], values[:i]):
+                condition &= Q(**{prev_key.lstrip('-'): prev_value})
+            q |= condition
+        first = self.ordering[0]
+        bound = 'lte' if first.startswith('-') else 'gte'
+        return Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & q
+
+    def _page_queryset(self, cursor):
+        if cursor:
+            return self.queryset.filter(self.after_q(self.decode_cursor(cursor)))
+        return self.queryset
+
+    def _make_page(self, rows, cursor):
+        # Лишняя запись показывает, есть ли следующая страница, без COUNT(*)
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        next_cursor = self.encode_cursor(rows[-1]) if has_next else None
+        return KeysetPage(rows, self, has_next, next_cursor, has_previous=bool(cursor))
+
+    def page(self, cursor=None):
+        queryset = self._page_queryset(cursor)
+        return self._make_page(list(queryset[:self.per_page + 1]), cursor)
+
+    async def apage(self, cursor=None):
+        queryset = self._page_queryset(cursor)
+        return self._make_page([obj async for obj in queryset[:self.per_page + 1].aiterator()], cursor)
+
+    async def acount(self):
+        """Посчитать count заранее, чтобы count_label в шаблоне не обращался к БД"""
+        if 'count' not in self.__dict__:
+            if self.count_mode == 'exact':
+                self.count = await self.queryset.acount()
+            elif self.count_mode == 'estimate':
+                self.count = await aestimate_count(self.queryset)
+        return self.count
+
+    @cached_property
+    def count(self):
+        if self.count_mode == 'exact':
+            return self.queryset.count()
+        if self.count_mode == 'estimate':
+            return estimate_count(self.queryset)
+        return None
+
+    @property
+    def count_label(self):
+        count = self.count
+        if count is None:
+            return ''
+        if self.count_mode == 'exact':
+            return str(count)
+        if connections[self.queryset.db].vendor == 'postgresql':
+            return f'~{count}'
+        return f'{count}+' if count >= COUNT_ESTIMATE_CAP else str(count)
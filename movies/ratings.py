@@ -0,0 +1,168 @@
+"""
+Голоса пользователей и рейтинг фильма.
+
+Movie.rating - байесовское среднее: оценка автора (author_rating, без неё
+RATING_PRIOR_MEAN) считается за RATING_PRIOR_VOTES голосов и усредняется с
+голосами пользователей. Сумма и число голосов хранятся в самом фильме и
+меняются F()-выражениями в том же UPDATE, что пересчитывает рейтинг, поэтому
+список сортируется по готовому столбцу с индексом -rating, а голос блокирует
+только строку своего фильма до конца короткой транзакции. QuerySet.update()
+сигналов не вызывает: кэш каталога, рейтинги (movies.leaderboards) и страницы
+сбрасываются здесь же и только если изменился округлённый рейтинг.
+reconcile_ratings пересчитывает агрегаты по таблице Rating.
+"""
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import DEFAULT_DB_ALIAS, router, transaction
+from django.db.models import (
+    Case, Count, DecimalField, F, FloatField, IntegerField, OuterRef, Q, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+from django.db.models.lookups import Exact
+from django.utils import timezone
+
+from .cache import bump_catalogue_version
+from .config import RATING_PRIOR_MEAN, RATING_PRIOR_VOTES, RECONCILE_CHUNK_SIZE
+from .leaderboards import movie_scopes, update_leaderboards
+from .models import Movie, Rating
+from .page_cache import invalidate_pages, movie_tags
+
+
+def bayesian_rating(prior, total, count):
+    """Рейтинг по оценке автора prior (или None), сумме и числу голосов"""
+    if prior is None and not count:
+        return Decimal(0)
+    prior = Decimal(str(RATING_PRIOR_MEAN if prior is None else prior))
+    average = (prior * RATING_PRIOR_VOTES + total) / (count + RATING_PRIOR_VOTES)
+    return average.quantize(Decimal('0.1'), ROUND_HALF_UP)
+
+
+def rating_expression(total=F('rating_sum'), count=F('rating_count')):
+    """
+    bayesian_rating в SQL; total и count - выражения суммы и числа голосов.
+    Считается в целых десятых: ROUND_HALF_UP - это (2N + D) / 2D с целочисленным
+    делением (SQLite, PostgreSQL), поэтому на границах .x5 результат тот же, что
+    у bayesian_rating, а не зависит от двоичного округления float
+    """
+    prior = Coalesce(
+        Cast(Round(F('author_rating') * 10), IntegerField()), Value(int(RATING_PRIOR_MEAN * 10)),
+        output_field=IntegerField(),
+    )
+    numerator = prior * RATING_PRIOR_VOTES + total * 10
+    denominator = count + RATING_PRIOR_VOTES
+    tenths = (numerator * 2 + denominator) / (denominator * 2)
+    return Case(
+        When(Q(Exact(count, 0), author_rating__isnull=True), then=Value(Decimal(0))),
+        default=Cast(Cast(tenths, FloatField()) / Value(10.0), DecimalField(max_digits=3, decimal_places=1)),
+        output_field=DecimalField(max_digits=3, decimal_places=1),
+    )
+
+
+def invalidate_rating(pk, category_id, previous, rating, using=None):
+    """Сбросить всё, где выводится фильм, после изменения голосов в обход сигналов"""
+    if Decimal(str(previous)) == Decimal(str(rating)):
+        # Карточки и списки не изменились - только число голосов на странице фильма
+        invalidate_pages([f'movie:{pk}'], using=using)
+        return
+    genre_ids = Movie.genres.through.objects.using(using).filter(movie_id=pk).values_list('genre_id', flat=True)
+    update_leaderboards(pk, rating, movie_scopes(category_id, list(genre_ids)), using=using)
+    invalidate_pages(movie_tags(pk, category_id, [previous, rating]), using=using)
+    bump_catalogue_version(using=using)
+
+
+def _update_movie(movies, **values):
+    """UPDATE фильма с пересчётом рейтинга; (рейтинг, число голосов) после него"""
+    movies.update(updated_at=timezone.now(), **values)
+    return movies.values_list('rating', 'rating_count').get()
+
+
+def rate_movie(user, movie_id, score, using=None):
+    """
+    Голос user за фильм (новый или изменённый). Возвращает (рейтинг,
+    число голосов); Movie.DoesNotExist, если фильма нет
+    """
+    using = using or router.db_for_write(Movie)
+    movies = Movie.objects.using(using).filter(pk=movie_id)
+    with transaction.atomic(using=using):
+        # Блокировка строки фильма упорядочивает голоса за него; другие фильмы не ждут
+        previous, count, category_id = movies.select_for_update().values_list(
+            'rating', 'rating_count', 'category_id'
+        ).get()
+        votes = Rating.objects.using(using).filter(user=user, movie_id=movie_id)
+        old_score = votes.values_list('score', flat=True).first()
+        if old_score == score:
+            return previous, count
+        if old_score is None:
+            Rating.objects.using(using).create(user=user, movie_id=movie_id, score=score)
+        else:
+            votes.update(score=score, updated_at=timezone.now())
+        # SET вычисляется по прежним значениям строки - приращения входят в рейтинг явно
+        total, joined = score - (old_score or 0), int(old_score is None)
+        rating, count = _update_movie(
+            movies,
+            rating_sum=F('rating_sum') + total,
+            rating_count=F('rating_count') + joined,
+            rating=rating_expression(F('rating_sum') + total, F('rating_count') + joined),
+        )
+        invalidate_rating(movie_id, category_id, previous, rating, using=using)
+    return rating, count
+
+
+def refresh_rating(movie, using=None):
+    """Пересчитать рейтинг по сохранённым голосам (после смены оценки автора)"""
+    using = using or router.db_for_write(Movie)
+    movies = Movie.objects.using(using).filter(pk=movie.pk)
+    with transaction.atomic(using=using):
+        previous = movies.select_for_update().values_list('rating', flat=True).get()
+        movie.rating, movie.rating_count = _update_movie(movies, rating=rating_expression())
+        movie._loaded_rating = movie.rating
+        invalidate_rating(movie.pk, movie.category_id, previous, movie.rating, using=using)
+    return movie.rating
+
+
+def edited_fields(form):
+    """
+    update_fields для сохранения фильма из формы: пишутся только её поля, поэтому
+    голоса (сумма, число и рейтинг), поданные после загрузки фильма, не затираются
+    """
+    names = {field.name for field in Movie._meta.concrete_fields}
+    return [name for name in form.fields if name in names] + ['updated_at']
+
+
+def user_score(user, movie_id):
+    """Голос пользователя за фильм или None"""
+    if not user.is_authenticated:
+        return None
+    return Rating.objects.filter(user=user, movie_id=movie_id).values_list('score', flat=True).first()
+
+
+async def auser_score(user, movie_id):
+    if not user.is_authenticated:
+        return None
+    return await Rating.objects.filter(user=user, movie_id=movie_id).values_list('score', flat=True).afirst()
+
+
+def _vote_subquery(aggregate):
+    votes = Rating.objects.filter(movie_id=OuterRef('pk')).order_by().values('movie_id')
+    return Coalesce(Subquery(votes.annotate(value=aggregate).values('value'), output_field=IntegerField()), Value(0))
+
+
+def reconcile_ratings(using=DEFAULT_DB_ALIAS):
+    """
+    Пересчитать суммы, число голосов и рейтинги фильмов, у которых они
+    разошлись с таблицей Rating. Возвращает число исправленных фильмов
+    """
+    movies = Movie.objects.using(using)
+    total, count = _vote_subquery(Sum('score')), _vote_subquery(Count('*'))
+    drifted = movies.annotate(total=total, count=count).filter(
+        ~Q(rating_sum=F('total')) | ~Q(rating_count=F('count'))
+        | ~Q(rating=rating_expression(F('total'), F('count')))
+    )
+    ids = list(drifted.values_list('pk', flat=True))
+    now = timezone.now()
+    for start in range(0, len(ids), RECONCILE_CHUNK_SIZE):
+        # SET вычисляется по прежней строке: рейтинг - по тем же подзапросам
+        movies.filter(pk__in=ids[start:start + RECONCILE_CHUNK_SIZE]).update(
+            rating_sum=total, rating_count=count, rating=rating_expression(total, count), updated_at=now,
+        )
+    return len(ids)
@@ -0,0 +1,83 @@
+"""
+Чтение с реплик для страниц каталога.
+
+Представления с ReplicaReadMixin выполняют GET внутри replica_reads(), и
+ReadReplicaRouter отправляет их чтения на одну из DATABASE_REPLICAS. Всё
+остальное (записи, POST, миграции) идёт в default. После запроса, который
+мог писать, ReplicaPinMiddleware на REPLICA_PIN_SECONDS ставит cookie,
+и чтения этого клиента остаются на основной БД - пользователь сразу видит
+свои изменения, даже если реплика отстаёт.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'filmroom_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_replica_reads = contextvars.ContextVar('movies_replica_reads', default=False)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if not _replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        replicas = get_replicas()
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и основная БД
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in get_replicas()
+
+
+class ReplicaPinMiddleware:
+    """Закрепить клиента за основной БД после запроса, который мог писать"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method not in SAFE_METHODS and get_replicas():
+            pin_seconds = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(PIN_COOKIE, '1', max_age=pin_seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,170 @@
+"""
+Полнотекстовый поиск по фильмам.
+
+Бэкенд выбирается по движку БД (FTS5 для SQLite, tsvector/GIN для PostgreSQL,
+icontains для остальных) либо явно через настройку MOVIES_SEARCH_BACKEND.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q, BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .config import MAX_SEARCH_LENGTH
+from .models import Movie
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+VENDOR_BACKENDS = {
+    'sqlite': 'movies.search.SQLiteFTSBackend',
+    'postgresql': 'movies.search.PostgresSearchBackend',
+}
+DEFAULT_BACKEND = 'movies.search.IcontainsSearchBackend'
+
+_backends = {}
+
+
+def tokenize(query):
+    """Разбить поисковую строку на нормализованные токены"""
+    if not query:
+        return []
+    return TOKEN_RE.findall(query.strip()[:MAX_SEARCH_LENGTH].lower())
+
+
+class BaseSearchBackend:
+    def search(self, queryset, query, rank=False):
+        """
+        Отфильтровать queryset по запросу. При rank=True добавляется
+        аннотация search_rank (чем больше, тем релевантнее)
+        """
+        tokens = tokenize(query)
+        if tokens:
+            return self.filter(queryset, tokens, rank)
+        if rank:
+            queryset = queryset.annotate(search_rank=RawSQL('0', [], output_field=FloatField()))
+        return queryset
+
+    def filter(self, queryset, tokens, rank):
+        raise NotImplementedError
+
+    def index_movies(self, movies, using=DEFAULT_DB_ALIAS):
+        pass
+
+    def index_movie(self, movie, using=DEFAULT_DB_ALIAS):
+        self.index_movies([movie], using=using)
+
+    def remove_movie(self, pk, using=DEFAULT_DB_ALIAS):
+        pass
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        return Movie.objects.using(using).count()
+
+
+class IcontainsSearchBackend(BaseSearchBackend):
+    """Запасной вариант без индекса: LIKE по каждому токену"""
+
+    def filter(self, queryset, tokens, rank):
+        q_obj = Q()
+        for token in tokens:
+            q_obj &= (Q(title__icontains=token) | Q(description__icontains=token))
+        queryset = queryset.filter(q_obj)
+        if rank:
+            queryset = queryset.annotate(search_rank=RawSQL('0', [], output_field=FloatField()))
+        return queryset
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    Виртуальная таблица FTS5, rowid которой совпадает с id фильма.
+    Синхронизируется сигналами из movies.signals
+    """
+    table = 'movies_movie_fts'
+
+    def match_expression(self, tokens):
+        return ' AND '.join('"%s"*' % token for token in tokens)
+
+    def filter(self, queryset, tokens, rank):
+        match = self.match_expression(tokens)
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [match]
+        ))
+        if rank:
+            # bm25 возвращает отрицательные значения: меньше - лучше
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f'SELECT -bm25({self.table}, 10.0, 1.0) FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND rowid = "{Movie._meta.db_table}"."id"',
+                [match],
+                output_field=FloatField(),
+            ))
+        return queryset
+
+    def index_movies(self, movies, using=DEFAULT_DB_ALIAS):
+        rows = [(m.pk, m.title or '', m.description or '') for m in movies]
+        if not rows:
+            return
+        with connections[using].cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table}(rowid, title, description) VALUES (%s, %s, %s)', rows
+            )
+
+    def remove_movie(self, pk, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [pk])
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table}(rowid, title, description) '
+                f'SELECT id, title, description FROM {Movie._meta.db_table}'
+            )
+            cursor.execute(f"INSERT INTO {self.table}({self.table}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Поиск по выражению to_tsvector, покрытому GIN-индексом movies_movie_search_idx.
+    Индекс строится по выражению, поэтому отдельная синхронизация не нужна
+    """
+    index_name = 'movies_movie_search_idx'
+    document = (
+        "to_tsvector('simple', coalesce(\"movies_movie\".\"title\", '') || ' ' || "
+        "coalesce(\"movies_movie\".\"description\", ''))"
+    )
+
+    def filter(self, queryset, tokens, rank):
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        queryset = queryset.filter(RawSQL(
+            f"{self.document} @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField()
+        ))
+        if rank:
+            queryset = queryset.annotate(search_rank=RawSQL(
+                f"ts_rank({self.document}, to_tsquery('simple', %s))", [tsquery], output_field=FloatField()
+            ))
+        return queryset
+
+    def rebuild(self, using=DEFAULT_DB_ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f'REINDEX INDEX {self.index_name}')
+        return super().rebuild(using=using)
+
+
+def get_search_backend(using=DEFAULT_DB_ALIAS):
+    """Вернуть экземпляр поискового бэкенда для указанной БД"""
+    path = getattr(settings, 'MOVIES_SEARCH_BACKEND', None)
+    if not path:
+        path = VENDOR_BACKENDS.get(connections[using].vendor, DEFAULT_BACKEND)
+    if path not in _backends:
+        _backends[path] = import_string(path)()
+    return _backends[path]
+
+
+def search_movies(queryset, query, rank=False):
+    """Применить полнотекстовый поиск к queryset фильмов"""
+    return get_search_backend(queryset.db).search(queryset, query, rank=rank)
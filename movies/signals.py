@@ -1,24 +1,290 @@
-from django.db.models.signals import post_save, post_delete
+"""
+Обработчики сигналов моделей каталога.
+
+На каждую пару (сигнал, отправитель) - один обработчик, который по порядку
+берёт прежнее состояние, правит счётчики и рейтинги (movies.leaderboards)
+и сбрасывает кэши; шаги - обычные функции, и порядок задан только здесь.
+Состояние между pre_* и post_* одной операции передаётся атрибутами
+экземпляра (_previous_author, _previous_category_id, _deleted_genre_ids,
+_removed_genre_ids, _cleared_movie_ids); их забирает обработчик post_* в самом начале.
+"""
+from decimal import Decimal
+
+from django.db.models import DEFERRED
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile, Movie
+from django.utils import timezone
+from .cache import bump_catalogue_version
+from .counters import adjust_category_count, adjust_genre_counts
+from .images import IMAGE_FIELDS, schedule_image_deletion, schedule_renditions
+from .leaderboards import category_scope, drop_leaderboard, genre_scope, movie_scopes, update_leaderboards
+from .models import UserProfile, Movie, Category, Genre
+from .page_cache import CATALOGUE_TAG, all_rating_tags, invalidate_pages, movie_tags
+from .search import get_search_backend
+
+
+SEARCH_FIELDS = {'title', 'description'}
+# Поля пользователя, которые выводятся в карточках фильмов
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name'}
+POST_M2M_ACTIONS = ('post_add', 'post_remove', 'post_clear')
+
+
+def invalidate_catalogue(using):
+    bump_catalogue_version(using=using)
+    # Названия и счётчики категорий выводятся на каждой странице
+    invalidate_pages([CATALOGUE_TAG], using=using)
+
+
+# Пользователи
+
+def save_loaded_profile(user):
+    # Профиль сохраняется вместе с пользователем, только если он загружен и его
+    # поля менялись: обновление last_login при входе ничего не пишет
+    related = User.profile.related
+    if not related.is_cached(user):
+        return
+    profile = related.get_cached_value(user)
+    if profile is None:
+        return
+    changed = profile.get_changed_fields()
+    if changed is None:
+        profile.save()
+    elif changed:
+        profile.save(update_fields=changed)
+
+
+def author_values(user):
+    return tuple(getattr(user, name) for name in sorted(AUTHOR_FIELDS))
+
+
+@receiver(pre_save, sender=User)
+def user_pre_save(sender, instance, using, update_fields=None, **kwargs):
+    if instance._state.adding or (update_fields is not None and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    instance._previous_author = (
+        User.objects.using(using).filter(pk=instance.pk).values_list(*sorted(AUTHOR_FIELDS)).first()
+    )
 
 
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def user_saved(sender, instance, created, using, update_fields=None, **kwargs):
+    previous_author = instance.__dict__.pop('_previous_author', DEFERRED)
     if created:
         UserProfile.objects.get_or_create(user=instance)
+        return
+    save_loaded_profile(instance)
+    # Каталог сбрасывается, только если изменилось имя автора в карточках:
+    # сохранение при входе (last_login) и правка почты или пароля его не трогают
+    if previous_author is not DEFERRED and previous_author != author_values(instance):
+        invalidate_catalogue(using)
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    try:
-        instance.profile.save()
-    except UserProfile.DoesNotExist:
-        UserProfile.objects.create(user=instance)
+# Постеры и аватары (movies.images)
+
+def reset_image_renditions(sender, instance, update_fields):
+    field, flag, sizes = IMAGE_FIELDS[sender]
+    if update_fields is not None and field not in update_fields:
+        return
+    loaded = getattr(instance, f'_loaded_{field}', DEFERRED)
+    if loaded is DEFERRED or loaded != getattr(instance, field).name:
+        setattr(instance, flag, False)
+
+
+def queue_image_renditions(sender, instance, using, update_fields):
+    field, flag, sizes = IMAGE_FIELDS[sender]
+    if update_fields is not None and field not in update_fields:
+        return
+    setattr(instance, f'_loaded_{field}', getattr(instance, field).name)
+    if getattr(instance, field) and not getattr(instance, flag):
+        schedule_renditions(instance, using=using)
+
+
+def delete_image_files(sender, instance, using):
+    # Файлы удаляет обработчик очереди и только после коммита удаления строки
+    if getattr(instance, IMAGE_FIELDS[sender][0]):
+        schedule_image_deletion(instance, using=using)
+
+
+@receiver(pre_save, sender=UserProfile)
+def profile_pre_save(sender, instance, update_fields=None, **kwargs):
+    reset_image_renditions(sender, instance, update_fields)
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, using, update_fields=None, **kwargs):
+    queue_image_renditions(sender, instance, using, update_fields)
+
+
+@receiver(post_delete, sender=UserProfile)
+def profile_deleted(sender, instance, using, **kwargs):
+    delete_image_files(sender, instance, using)
+
+
+# Фильмы
+
+def previous_category_id(instance, using):
+    if instance._state.adding:
+        return None
+    previous = getattr(instance, '_loaded_category_id', DEFERRED)
+    if previous is DEFERRED:
+        previous = Movie.objects.using(using).filter(pk=instance.pk).values_list('category_id', flat=True).first()
+    return previous
+
+
+def update_movie_leaderboards(instance, created, rating, previous_rating, previous_category, using):
+    if created:
+        update_leaderboards(instance.pk, rating, movie_scopes(instance.category_id), joined=True, using=using)
+        return
+    if previous_category not in (DEFERRED, instance.category_id):
+        if previous_category is not None:
+            update_leaderboards(instance.pk, None, [category_scope(previous_category)], left=True, using=using)
+        if instance.category_id is not None and rating is DEFERRED:
+            drop_leaderboard(category_scope(instance.category_id), using=using)
+        elif instance.category_id is not None:
+            update_leaderboards(instance.pk, rating, [category_scope(instance.category_id)], joined=True, using=using)
+    if rating is DEFERRED or (previous_rating is not DEFERRED and Decimal(str(rating)) == previous_rating):
+        return
+    genre_ids = Movie.genres.through.objects.using(using).filter(movie_id=instance.pk).values_list('genre_id', flat=True)
+    update_leaderboards(instance.pk, rating, movie_scopes(instance.category_id, list(genre_ids)), using=using)
+
+
+def invalidate_saved_movie_pages(instance, rating, previous_rating, using):
+    if DEFERRED in (rating, previous_rating):
+        # Прежний рейтинг неизвестен - сбрасываются все диапазоны
+        tags = [*movie_tags(instance.pk, instance.category_id, []), *all_rating_tags()]
+    else:
+        tags = movie_tags(instance.pk, instance.category_id, [rating, previous_rating])
+    invalidate_pages(tags, using=using)
+
+
+@receiver(pre_save, sender=Movie)
+def movie_pre_save(sender, instance, using, update_fields=None, **kwargs):
+    reset_image_renditions(sender, instance, update_fields)
+    if update_fields is None or 'category' in update_fields:
+        instance._previous_category_id = previous_category_id(instance, using)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, created, using, update_fields=None, **kwargs):
+    # Прежнее состояние: категория из pre_save (DEFERRED - не сохранялась), рейтинг с загрузки
+    previous_category = instance.__dict__.pop('_previous_category_id', DEFERRED)
+    previous_rating = getattr(instance, '_loaded_rating', DEFERRED)
+    rating = instance.__dict__.get('rating', DEFERRED)
+    category_changed = previous_category not in (DEFERRED, instance.category_id)
+
+    queue_image_renditions(sender, instance, using, update_fields)
+    if not update_fields or SEARCH_FIELDS & set(update_fields):
+        get_search_backend(using).index_movie(instance, using=using)
+    update_movie_leaderboards(instance, created, rating, previous_rating, previous_category, using)
+    if category_changed:
+        adjust_category_count(previous_category, -1, using=using)
+        adjust_category_count(instance.category_id, 1, using=using)
+
+    if created or category_changed:
+        # Изменились счётчики категорий в навигации
+        invalidate_catalogue(using)
+    else:
+        bump_catalogue_version(using=using)
+        invalidate_saved_movie_pages(instance, rating, previous_rating, using)
+
+    # Сохранённое состояние - прежнее для следующего save()
+    if previous_category is not DEFERRED:
+        instance._loaded_category_id = instance.category_id
+    instance._loaded_rating = rating
+
+
+@receiver(pre_delete, sender=Movie)
+def movie_pre_delete(sender, instance, using, **kwargs):
+    instance._deleted_genre_ids = list(
+        Movie.genres.through.objects.using(using).filter(movie_id=instance.pk).values_list('genre_id', flat=True)
+    )
 
 
 @receiver(post_delete, sender=Movie)
-def delete_movie_poster(sender, instance, **kwargs):
-    if instance.poster:
-        instance.poster.delete(save=False)
+def movie_deleted(sender, instance, using, **kwargs):
+    genre_ids = instance.__dict__.pop('_deleted_genre_ids', [])
+
+    delete_image_files(sender, instance, using)
+    get_search_backend(using).remove_movie(instance.pk, using=using)
+    update_leaderboards(instance.pk, None, movie_scopes(instance.category_id, genre_ids), left=True, using=using)
+    adjust_category_count(instance.category_id, -1, using=using)
+    adjust_genre_counts(genre_ids, -1, using=using)
+    invalidate_catalogue(using)
+
+
+# Жанры фильмов
+
+def remember_removed_genres(sender, instance, action, reverse, pk_set, using):
+    links = sender.objects.using(using)
+    own = {'genre_id': instance.pk} if reverse else {'movie_id': instance.pk}
+    if action == 'pre_remove':
+        # pk_set при удалении может содержать несвязанные объекты - считаем реальные связи
+        other = 'movie_id__in' if reverse else 'genre_id__in'
+        removed = links.filter(**own, **{other: pk_set})
+    else:
+        removed = links.filter(**own)
+        if reverse:
+            instance._cleared_movie_ids = list(removed.values_list('movie_id', flat=True))
+    instance._removed_genre_ids = list(removed.values_list('genre_id', flat=True))
+
+
+def update_genre_leaderboards(instance, action, reverse, pk_set, removed_genre_ids, using):
+    if reverse:
+        drop_leaderboard(genre_scope(instance.pk), using=using)
+    elif action == 'post_add':
+        scopes = [genre_scope(pk) for pk in pk_set]
+        update_leaderboards(instance.pk, instance.rating, scopes, joined=True, using=using)
+    else:
+        scopes = [genre_scope(pk) for pk in removed_genre_ids]
+        update_leaderboards(instance.pk, None, scopes, left=True, using=using)
+
+
+def invalidate_genre_pages(instance, action, reverse, pk_set, using):
+    bump_catalogue_version(using=using)
+    if reverse or action == 'post_clear':
+        invalidate_pages([CATALOGUE_TAG], using=using)
+        return
+    tags = movie_tags(instance.pk, instance.category_id, [instance.rating])
+    invalidate_pages([*tags, *(f'genre:{pk}' for pk in pk_set)], using=using)
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_changed(sender, instance, action, reverse, pk_set, using, **kwargs):
+    if action in ('pre_remove', 'pre_clear'):
+        remember_removed_genres(sender, instance, action, reverse, pk_set, using)
+    if action not in POST_M2M_ACTIONS:
+        return
+    removed_genre_ids = instance.__dict__.pop('_removed_genre_ids', [])
+    cleared_movie_ids = instance.__dict__.pop('_cleared_movie_ids', [])
+
+    update_genre_leaderboards(instance, action, reverse, pk_set, removed_genre_ids, using)
+    if action == 'post_add':
+        adjust_genre_counts([instance.pk] * len(pk_set) if reverse else pk_set, 1, using=using)
+    else:
+        adjust_genre_counts(removed_genre_ids, -1, using=using)
+
+    # Жанры выводятся на странице фильма, а её ETag строится по updated_at
+    if not reverse:
+        movie_ids = [instance.pk]
+    elif action == 'post_clear':
+        movie_ids = cleared_movie_ids
+    else:
+        movie_ids = pk_set
+    Movie.objects.using(using).filter(pk__in=movie_ids).update(updated_at=timezone.now())
+    invalidate_genre_pages(instance, action, reverse, pk_set, using)
+
+
+# Категории и жанры
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Genre)
+def taxonomy_saved(sender, using, **kwargs):
+    invalidate_catalogue(using)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Genre)
+def taxonomy_deleted(sender, instance, using, **kwargs):
+    drop_leaderboard(category_scope(instance.pk) if sender is Category else genre_scope(instance.pk), using=using)
+    invalidate_catalogue(using)
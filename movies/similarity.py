@@ -0,0 +1,302 @@
+"""
+Индекс похожих фильмов («More like this» на странице фильма).
+
+Индекс строится пакетно (команда build_similarity). Фильм - разреженный
+вектор признаков: жанры, категория и слова названия и описания, хэшированные
+каждый вид в свой диапазон SLOTS, с весом SIMILAR_WEIGHTS[вид] * idf.
+Близость - косинус векторов. Кандидаты берутся из инвертированного индекса,
+списки которого обрезаны до SIMILAR_MAX_POSTING лучших по рейтингу фильмов,
+и точно пересчитываются только SIMILAR_MAX_CANDIDATES лучших по частичной
+сумме: работа на фильм ограничена и не растёт с каталогом, а память линейна
+по числу фильмов (массивы array, без словаря слов). Строки обрабатываются
+пачками по SIMILAR_CHUNK_SIZE в процессах-обработчиках; с NumPy (необязательная
+зависимость) пачка считается векторно. Для фильма хранятся SIMILAR_MOVIES
+соседей (SimilarMovie), страница фильма читает их одним запросом. Фильмы,
+добавленные после построения, получат соседей при следующем запуске.
+"""
+import heapq
+import math
+import time
+import zlib
+from array import array
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import accumulate, islice
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .config import (
+    SIMILAR_CHUNK_SIZE, SIMILAR_MAX_CANDIDATES, SIMILAR_MAX_POSTING, SIMILAR_MOVIES, SIMILAR_TEXT_TERMS,
+    SIMILAR_WEIGHTS,
+)
+from .importer import batched
+from .models import Movie, SimilarMovie
+from .page_cache import CATALOGUE_TAG, invalidate_pages
+from .search import TOKEN_RE
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+VERSION_KEY = 'movies:similar:version'
+# Число хэшированных признаков каждого вида; виды не пересекаются
+SLOTS = {'genre': 1 << 12, 'category': 1 << 12, 'text': 1 << 18}
+OFFSETS = dict(zip(SLOTS, accumulate(SLOTS.values(), initial=0)))
+DIMENSION = sum(SLOTS.values())
+MIN_TOKEN_LENGTH = 3
+
+
+def _slot(kind, key):
+    return OFFSETS[kind] + zlib.crc32(str(key).encode()) % SLOTS[kind]
+
+
+def movie_features(category_id, genre_ids, title, description):
+    """Отсортированные номера признаков фильма"""
+    features = {_slot('genre', pk) for pk in genre_ids}
+    if category_id is not None:
+        features.add(_slot('category', category_id))
+    # Слова названия идут первыми и всегда попадают в SIMILAR_TEXT_TERMS
+    words = dict.fromkeys(
+        word for word in TOKEN_RE.findall(f'{title} {description}'.lower()) if len(word) >= MIN_TOKEN_LENGTH
+    )
+    features.update(_slot('text', word) for word in islice(words, SIMILAR_TEXT_TERMS))
+    return sorted(features)
+
+
+class SimilarityIndex:
+    """
+    Векторы признаков фильмов в формате CSR: строка - фильм в порядке
+    рейтинга, pks[строка] - его pk. Целиком передаётся обработчикам
+    """
+
+    def __init__(self):
+        self.pks = array('q')
+        self.indptr = array('q', [0])
+        self.indices = array('i')
+        self.weights = self.norms = self.post_ptr = self.post_rows = None
+
+    def __len__(self):
+        return len(self.pks)
+
+    def __getstate__(self):
+        # Представления NumPy строятся в каждом процессе заново
+        return {key: value for key, value in self.__dict__.items() if key != '_arrays'}
+
+    def add(self, pk, features):
+        self.pks.append(pk)
+        self.indices.extend(features)
+        self.indptr.append(len(self.indices))
+
+    def features(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def finish(self):
+        """Веса признаков (idf), нормы векторов и инвертированный индекс"""
+        total = len(self)
+        df = array('q', bytes(8 * DIMENSION))
+        for feature in self.indices:
+            df[feature] += 1
+        self.weights = array('d', bytes(8 * DIMENSION))
+        for kind, offset in OFFSETS.items():
+            for feature in range(offset, offset + SLOTS[kind]):
+                if df[feature]:
+                    self.weights[feature] = SIMILAR_WEIGHTS[kind] * math.log(1 + total / df[feature])
+        weights = self.weights
+        self.norms = array('d', (
+            math.sqrt(sum(weights[feature] ** 2 for feature in self.features(row))) for row in range(total)
+        ))
+        # Списки фильмов признака обрезаны: строки идут по рейтингу, остаются лучшие
+        self.post_ptr = array('q', [0])
+        for feature in range(DIMENSION):
+            self.post_ptr.append(self.post_ptr[-1] + min(df[feature], SIMILAR_MAX_POSTING))
+        self.post_rows = array('i', bytes(4 * self.post_ptr[-1]))
+        fill = self.post_ptr[:-1]
+        for row in range(total):
+            for feature in self.features(row):
+                if fill[feature] < self.post_ptr[feature + 1]:
+                    self.post_rows[fill[feature]] = row
+                    fill[feature] += 1
+
+    def arrays(self):
+        """Массивы индекса как ndarray без копирования"""
+        if getattr(self, '_arrays', None) is None:
+            self._arrays = (
+                np.frombuffer(self.indptr, dtype=np.int64),
+                np.frombuffer(self.indices, dtype=np.int32),
+                np.frombuffer(self.weights, dtype=np.float64) ** 2,
+                np.frombuffer(self.norms, dtype=np.float64),
+                np.frombuffer(self.post_ptr, dtype=np.int64),
+                np.frombuffer(self.post_rows, dtype=np.int32),
+            )
+        return self._arrays
+
+
+def build_index(using=DEFAULT_DB_ALIAS, chunk_size=SIMILAR_CHUNK_SIZE):
+    """Прочитать фильмы пачками и построить SimilarityIndex"""
+    index = SimilarityIndex()
+    movies = Movie.objects.using(using).order_by('-rating', '-pk').values_list(
+        'pk', 'category_id', 'title', 'description'
+    )
+    links = Movie.genres.through.objects.using(using)
+    for chunk in batched(movies.iterator(chunk_size=chunk_size), chunk_size):
+        genres = defaultdict(list)
+        for movie_id, genre_id in links.filter(movie_id__in=[row[0] for row in chunk]).values_list(
+            'movie_id', 'genre_id'
+        ):
+            genres[movie_id].append(genre_id)
+        for pk, category_id, title, description in chunk:
+            index.add(pk, movie_features(category_id, genres[pk], title, description))
+    index.finish()
+    return index
+
+
+def _row_neighbours(index, row, limit):
+    """[(строка соседа, близость), ...] без NumPy"""
+    weights, post_ptr, post_rows = index.weights, index.post_ptr, index.post_rows
+    own = {feature: weights[feature] ** 2 for feature in index.features(row)}
+    partial = defaultdict(float)
+    for feature, gain in own.items():
+        for other in post_rows[post_ptr[feature]:post_ptr[feature + 1]]:
+            partial[other] += gain
+    partial.pop(row, None)
+    scored = []
+    # При равной частичной сумме выше фильм с лучшим рейтингом (меньший номер строки)
+    for other in heapq.nlargest(SIMILAR_MAX_CANDIDATES, partial, key=lambda other: (partial[other], -other)):
+        dot = sum(own.get(feature, 0.0) for feature in index.features(other))
+        scored.append((-dot / (index.norms[row] * index.norms[other]), other))
+    return [(other, -score) for score, other in heapq.nsmallest(limit, scored)]
+
+
+def _rows_neighbours_numpy(index, rows, limit):
+    """_row_neighbours для пачки строк на NumPy"""
+    indptr, indices, gains, norms, post_ptr, post_rows = index.arrays()
+    dense = np.zeros(DIMENSION)
+    result = []
+    for row in rows:
+        features = indices[indptr[row]:indptr[row + 1]]
+        starts, ends = post_ptr[features], post_ptr[features + 1]
+        others = np.concatenate([post_rows[start:end] for start, end in zip(starts, ends)] or [post_rows[:0]])
+        others, inverse = np.unique(others, return_inverse=True)
+        partial = np.bincount(inverse, weights=np.repeat(gains[features], ends - starts), minlength=len(others))
+        keep = others != row
+        others, partial = others[keep], partial[keep]
+        if not len(others):
+            result.append([])
+            continue
+        if len(others) > SIMILAR_MAX_CANDIDATES:
+            others = others[np.lexsort((others, -partial))[:SIMILAR_MAX_CANDIDATES]]
+        # Точные скалярные произведения: признаки кандидатов по плотному вектору фильма
+        dense[features] = gains[features]
+        starts = indptr[others]
+        lengths = indptr[others + 1] - starts
+        ends = np.cumsum(lengths)
+        positions = np.repeat(starts - ends + lengths, lengths) + np.arange(ends[-1])
+        dots = np.add.reduceat(dense[indices[positions]], ends - lengths)
+        dense[features] = 0
+        scores = dots / (norms[others] * norms[row])
+        # По убыванию близости, при равенстве - выше по рейтингу, как в _row_neighbours
+        order = np.lexsort((others, -scores))[:limit]
+        result.append([(int(others[i]), float(scores[i])) for i in order])
+    return result
+
+
+def score_rows(index, rows, limit=SIMILAR_MOVIES):
+    """[(pk, [(pk соседа, близость), ...]), ...] для строк rows"""
+    if np is not None:
+        found = _rows_neighbours_numpy(index, rows, limit)
+    else:
+        found = [_row_neighbours(index, row, limit) for row in rows]
+    pks = index.pks
+    return [(pks[row], [(pks[other], score) for other, score in neighbours]) for row, neighbours in zip(rows, found)]
+
+
+_worker_index = None
+
+
+def _init_worker(index):
+    global _worker_index
+    _worker_index = index
+
+
+def _score_range(bounds):
+    return score_rows(_worker_index, range(*bounds))
+
+
+def _score_chunks(index, chunk_size, workers):
+    bounds = [(start, min(start + chunk_size, len(index))) for start in range(0, len(index), chunk_size)]
+    if workers <= 1:
+        for start, stop in bounds:
+            yield score_rows(index, range(start, stop))
+        return
+    # Обработчики в БД не обращаются; индекс передаётся им один раз при запуске
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(index,)) as executor:
+        pending = deque()
+        for chunk in bounds:
+            # Не больше двух пачек на обработчик: готовые результаты не копятся в памяти
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_score_range, chunk))
+        while pending:
+            yield pending.popleft().result()
+
+
+def save_neighbours(results, using=DEFAULT_DB_ALIAS):
+    """Заменить соседей фильмов пачки одной транзакцией; удалённые за время расчёта пропускаются"""
+    pks = [pk for pk, neighbours in results]
+    mentioned = {*pks, *(other for pk, neighbours in results for other, score in neighbours)}
+    existing = set(Movie.objects.using(using).filter(pk__in=mentioned).values_list('pk', flat=True))
+    rows = [
+        SimilarMovie(movie_id=pk, similar_id=other, rank=rank, score=score)
+        for pk, neighbours in results if pk in existing
+        for rank, (other, score) in enumerate(item for item in neighbours if item[0] in existing)
+    ]
+    with transaction.atomic(using=using):
+        SimilarMovie.objects.using(using).filter(movie_id__in=pks).delete()
+        SimilarMovie.objects.using(using).bulk_create(rows)
+    return len(rows)
+
+
+def build_similarity_index(using=DEFAULT_DB_ALIAS, workers=1, chunk_size=SIMILAR_CHUNK_SIZE, progress=None):
+    """
+    Пересчитать соседей всех фильмов. progress(обработано, всего) вызывается
+    после каждой пачки. Возвращает (число фильмов, число записанных соседей)
+    """
+    index = build_index(using, chunk_size)
+    done = saved = 0
+    for results in _score_chunks(index, chunk_size, workers):
+        saved += save_neighbours(results, using)
+        done += len(results)
+        if progress:
+            progress(done, len(index))
+    bump_similarity_version(using)
+    return len(index), saved
+
+
+def get_similarity_version():
+    """Версия индекса для ETag страницы фильма"""
+    return cache.get(VERSION_KEY, 0)
+
+
+async def aget_similarity_version():
+    return await cache.aget(VERSION_KEY, 0)
+
+
+def bump_similarity_version(using=None):
+    cache.set(VERSION_KEY, time.time_ns(), timeout=None)
+    invalidate_pages([CATALOGUE_TAG], using=using)
+
+
+def similar_queryset(movie_id):
+    return Movie.objects.filter(neighbour_of__movie_id=movie_id).order_by('neighbour_of__rank')
+
+
+def similar_movies(movie_id, limit=SIMILAR_MOVIES):
+    """Соседи фильма из индекса, одним запросом"""
+    return list(similar_queryset(movie_id)[:limit])
+
+
+async def asimilar_movies(movie_id, limit=SIMILAR_MOVIES):
+    return [movie async for movie in similar_queryset(movie_id)[:limit]]
@@ -0,0 +1,200 @@
+"""
+Фоновые задачи в очереди на базе данных.
+
+enqueue() добавляет строку Task в текущую транзакцию: задача появляется в
+очереди вместе с данными, которые её породили (и пропадает при откате), а
+запрос отвечает сразу после коммита. Команда run_worker забирает готовые
+задачи (на PostgreSQL - FOR UPDATE SKIP LOCKED, на SQLite - условным UPDATE
+с меткой обработчика) и выполняет их в пуле потоков или процессов; брокер не
+нужен. Упавшая задача повторяется через TASK_RETRY_DELAY * 2^(попытка - 1)
+секунд, после max_attempts попыток остаётся в статусе failed. Задача
+обработчика, пропавшего на время дольше TASK_LEASE, выполняется заново,
+поэтому задачи должны быть идемпотентны. Ключ идемпотентности: пока задача с
+ключом ждёт в очереди, такая же не добавляется - она и так прочитает
+актуальные данные при выполнении.
+"""
+import logging
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, router, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .config import TASK_LEASE, TASK_POLL_INTERVAL, TASK_RETENTION, TASK_RETRY_DELAY
+from .models import Task
+
+
+logger = logging.getLogger(__name__)
+
+# имя -> функция; заполняется декоратором @task при импорте модулей приложения
+_registry = {}
+
+
+def task(name):
+    """Зарегистрировать функцию как задачу name; аргументы - JSON-совместимые"""
+    def register(func):
+        _registry[name] = func
+        func.task_name = name
+        return func
+    return register
+
+
+def enqueue(name, key=None, delay=0, using=None, **kwargs):
+    """
+    Поставить задачу name(**kwargs) в очередь в текущей транзакции. Если
+    задача с тем же key уже ждёт выполнения, новая не добавляется
+    """
+    if name not in _registry:
+        raise ValueError(f'Unknown task: {name}')
+    using = using or router.db_for_write(Task)
+    run_after = timezone.now() + timedelta(seconds=delay)
+    # Конфликт с ожидающей задачей по unique_queued_task_key пропускается самой БД
+    Task.objects.using(using).bulk_create(
+        [Task(name=name, key=key, kwargs=kwargs, run_after=run_after)], ignore_conflicts=True,
+    )
+
+
+def _due(now):
+    return Q(status=Task.QUEUED, run_after__lte=now) | Q(status=Task.RUNNING, locked_until__lt=now)
+
+
+def claim_tasks(worker, limit, using=DEFAULT_DB_ALIAS, lease=TASK_LEASE):
+    """Забрать до limit готовых задач для обработчика worker"""
+    now = timezone.now()
+    locked_until = now + timedelta(seconds=lease)
+    tasks = Task.objects.using(using)
+    with transaction.atomic(using=using):
+        ids = list(
+            tasks.select_for_update(skip_locked=True).filter(_due(now))
+            .order_by('run_after').values_list('pk', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        # Повторная проверка в UPDATE: без SKIP LOCKED (SQLite) те же строки мог выбрать другой обработчик
+        tasks.filter(_due(now), pk__in=ids).update(
+            status=Task.RUNNING, worker=worker, locked_until=locked_until,
+            attempts=F('attempts') + 1, updated_at=now,
+        )
+    return list(tasks.filter(pk__in=ids, status=Task.RUNNING, worker=worker, locked_until=locked_until))
+
+
+def execute(name, kwargs, close_connections=True):
+    """Выполнить задачу; текст ошибки или None. Выполняется в пуле обработчика"""
+    try:
+        _registry[name](**kwargs)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        if close_connections:
+            # Соединения потоковые: закрываем соединения этого потока
+            connections.close_all()
+    return None
+
+
+def finish_task(task, error, using=DEFAULT_DB_ALIAS):
+    """Записать результат; задача, перехваченная другим обработчиком, не трогается"""
+    now = timezone.now()
+    tasks = Task.objects.using(using).filter(pk=task.pk, worker=task.worker, locked_until=task.locked_until)
+    if error is None:
+        tasks.update(status=Task.DONE, locked_until=None, last_error='', updated_at=now)
+    elif task.attempts < task.max_attempts:
+        delay = TASK_RETRY_DELAY * 2 ** (task.attempts - 1)
+        logger.warning('Task %s #%s failed (attempt %s), retrying in %ss', task.name, task.pk, task.attempts, delay)
+        try:
+            with transaction.atomic(using=using):
+                tasks.update(
+                    status=Task.QUEUED, run_after=now + timedelta(seconds=delay),
+                    locked_until=None, last_error=error, updated_at=now,
+                )
+        except IntegrityError:
+            # Пока задача выполнялась, её поставили заново - работу сделает новая
+            tasks.delete()
+    else:
+        logger.error('Task %s #%s failed after %s attempts:\n%s', task.name, task.pk, task.attempts, error)
+        tasks.update(status=Task.FAILED, locked_until=None, last_error=error, updated_at=now)
+
+
+def purge_tasks(older_than=TASK_RETENTION, using=DEFAULT_DB_ALIAS):
+    """Удалить выполненные задачи старше older_than секунд"""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return Task.objects.using(using).filter(status=Task.DONE, updated_at__lt=cutoff).delete()[0]
+
+
+class Worker:
+    """
+    Обработчик очереди: держит до concurrency задач в пуле потоков или
+    процессов (mode 'thread' / 'process'). Один поток - задачи выполняются
+    в текущем потоке, без пула
+    """
+
+    def __init__(self, concurrency=1, mode='thread', using=DEFAULT_DB_ALIAS,
+                 poll_interval=TASK_POLL_INTERVAL, lease=TASK_LEASE):
+        self.concurrency = max(concurrency, 1)
+        self.mode = mode
+        self.using = using
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.name = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.stopping = False
+        self.processed = self.failed = 0
+        self._purged_at = 0
+
+    def stop(self, *args):
+        """Не брать новые задачи; начатые дорабатываются"""
+        self.stopping = True
+
+    def _pool(self):
+        if self.mode == 'process':
+            # С fork все процессы пула стартуют на первой задаче: запускаем их сразу,
+            # пока у родителя нет открытых соединений, которые достались бы потомкам
+            connections.close_all()
+            pool = ProcessPoolExecutor(self.concurrency, mp_context=multiprocessing.get_context('fork'))
+            pool.submit(int).result()
+            return pool
+        if self.concurrency > 1:
+            return ThreadPoolExecutor(self.concurrency, thread_name_prefix='tasks')
+        return None
+
+    def _finish(self, task, error):
+        finish_task(task, error, using=self.using)
+        self.processed += 1
+        self.failed += error is not None
+
+    def _idle(self):
+        if time.monotonic() - self._purged_at > 60 * 60:
+            purge_tasks(using=self.using)
+            self._purged_at = time.monotonic()
+
+    def run(self, burst=False):
+        """Обрабатывать очередь до stop(); burst - выйти, когда очередь опустеет"""
+        pool = self._pool()
+        pending = {}
+        try:
+            while not self.stopping or pending:
+                free = self.concurrency - len(pending)
+                tasks = claim_tasks(self.name, free, self.using, self.lease) if free and not self.stopping else []
+                for task in tasks:
+                    if pool is None:
+                        self._finish(task, execute(task.name, task.kwargs, close_connections=False))
+                    else:
+                        pending[pool.submit(execute, task.name, task.kwargs)] = task
+                if pending:
+                    done, _ = wait(pending, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._finish(pending.pop(future), future.result())
+                elif not tasks:
+                    if burst or self.stopping:
+                        break
+                    self._idle()
+                    time.sleep(self.poll_interval)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return self.processed
@@ -1,5 +1,7 @@
 from django import template
 
+from movies.images import available_formats, rendition_name
+
 register = template.Library()
 
 
@@ -31,3 +33,22 @@ def get_genre_count(movie):
 @register.simple_tag
 def get_movie_count_by_author(author):
     return author.movies.count()
+
+
+@register.inclusion_tag('movies/_picture.html')
+def picture(fieldfile, ready, rendition, retina, alt='', css_class='', style=''):
+    """
+    <picture> с WebP/JPEG-копиями и srcset для retina. Пока копии
+    не готовы, выводится оригинал
+    """
+    def srcset(ext):
+        return ', '.join([
+            f'{fieldfile.storage.url(rendition_name(fieldfile.name, rendition, ext))} 1x',
+            f'{fieldfile.storage.url(rendition_name(fieldfile.name, retina, ext))} 2x',
+        ])
+    
+    context = {'fieldfile': fieldfile, 'ready': ready, 'alt': alt, 'css_class': css_class, 'style': style}
+    if fieldfile and ready:
+        context['sources'] = [{'ext': ext, 'srcset': srcset(ext)} for ext, fmt in available_formats()]
+        context['src'] = fieldfile.storage.url(rendition_name(fieldfile.name, rendition, 'jpg'))
+    return context
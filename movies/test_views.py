@@ -1,8 +1,70 @@
-from django.test import TestCase, Client
+import asyncio
+import base64
+import json
+import os
+import re
+from decimal import Decimal
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import cache, caches
+from django.http import Http404, HttpResponse
+from django.middleware.csrf import get_token
+from django.test import AsyncClient, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.db.models import Value
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from .async_views import AsyncAjaxFilterView, AsyncMovieDetailView, AsyncMovieListView
+from .benchmark import compare_results, percentile, run_benchmark, run_concurrent, seed_catalogue, sqlite_modes
+from .cache import get_catalogue_version, get_categories
+from .config import MOVIES_PER_PAGE, MOVIE_SORT_OPTIONS, POSTER_RENDITIONS, PROFILE_MOVIES_PER_PAGE
+from .context_processors import categories
+from .counters import reconcile_counters
+from .facets import facet_counts
+from .filters import MovieFilter
+from .forms import MovieEditForm
+from .images import generate_renditions, rendition_name
+from .leaderboards import (
+    ALL, board_lock, board_key, build_board, category_scope, genre_scope, get_boards, reset_leaderboards, top_movies,
+)
+from .instrumentation import METRICS, QueryBudgetExceeded, record_query
+from .models import Movie, Category, Genre, Rating, SimilarMovie, Task, UserProfile
+from .page_cache import CATALOGUE_TAG, get_tag_versions, is_cacheable_response, list_page_tags
+from .pagination import KeysetPaginator, InvalidCursor
+from .ratings import bayesian_rating, edited_fields, rate_movie, rating_expression, reconcile_ratings, refresh_rating
+from .routers import PIN_COOKIE, ReadReplicaRouter, replica_reads
+from .search import get_search_backend
+from .similarity import build_similarity_index, similar_movies
+from .tasks import Worker, claim_tasks, enqueue, task
+from .testing import CacheResetTestCase, QueryCountAssertionsMixin
+from .urls import catalogue_view
+from .views import AjaxFilterView, MovieDetailView, MovieListView
+
+
+# Страничный кэш и реакция на бюджет запросов задаются окружением. В тестах страничный
+# кэш выключен (PageCacheTest включает его сам), а превышение бюджета - ошибка
+TEST_SETTINGS = override_settings(MOVIES_PAGE_CACHE=False, MOVIES_QUERY_BUDGET_ACTION='raise')
+
+
+def setUpModule():
+    TEST_SETTINGS.enable()
 
-from .models import Movie, Category, Genre, UserProfile
+
+def tearDownModule():
+    TEST_SETTINGS.disable()
 
 
 class MovieListViewTest(TestCase):
@@ -108,3 +170,1490 @@ class UserProfileTest(TestCase):
     def test_user_profile_created_on_user_creation(self):
         self.assertTrue(hasattr(self.user, 'profile'))
         self.assertIsInstance(self.user.profile, UserProfile)
+
+
+class MovieSearchTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.inception = Movie.objects.create(title='Inception', description='A thief who steals corporate secrets')
+        cls.interstellar = Movie.objects.create(title='Interstellar', description='Explorers travel through a wormhole')
+        cls.heat = Movie.objects.create(title='Heat', description='A group of professional thieves')
+    
+    def test_prefix_search(self):
+        response = self.client.get(reverse('movies:list'), {'q': 'Incep'})
+        self.assertEqual(list(response.context['movies']), [self.inception])
+    
+    def test_all_tokens_must_match(self):
+        response = self.client.get(reverse('movies:list'), {'q': 'thie corporate'})
+        self.assertEqual(list(response.context['movies']), [self.inception])
+    
+    def test_title_match_ranked_first(self):
+        self.heat.description = 'Not Interstellar'
+        self.heat.save()
+        response = self.client.get(reverse('movies:list'), {'q': 'interstellar'})
+        self.assertEqual(list(response.context['movies']), [self.interstellar, self.heat])
+    
+    def test_deleted_movie_not_found(self):
+        self.heat.delete()
+        response = self.client.get(reverse('movies:ajax_filter'), {'q': 'heat'})
+        self.assertNotContains(response, 'professional thieves')
+    
+    def test_rebuild_command(self):
+        Movie.objects.filter(pk=self.heat.pk).update(title='Ronin')
+        call_command('rebuild_search_index', stdout=StringIO())
+        response = self.client.get(reverse('movies:list'), {'q': 'ronin'})
+        self.assertEqual(list(response.context['movies']), [self.heat])
+
+
+class AjaxFilterViewTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.movies = [
+            Movie.objects.create(title=f'Movie {i:02d}', rating=i % 10)
+            for i in range(MOVIES_PER_PAGE + 3)
+        ]
+    
+    def test_first_page_is_capped(self):
+        response = self.client.get(reverse('movies:ajax_filter'))
+        self.assertEqual(len(response.context['movies']), MOVIES_PER_PAGE)
+        self.assertIn('X-Next-Cursor', response)
+    
+    def test_next_cursor_returns_rest(self):
+        first = self.client.get(reverse('movies:ajax_filter'))
+        response = self.client.get(first['X-Next-Page-Url'])
+        self.assertEqual(len(response.context['movies']), 3)
+        self.assertNotIn('X-Next-Cursor', response)
+    
+    def test_sort_is_honoured(self):
+        response = self.client.get(reverse('movies:ajax_filter'), {'sort': 'title'})
+        self.assertEqual(response.context['movies'][0], self.movies[0])
+        self.assertIn('sort=title', response['X-Next-Page-Url'])
+    
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('movies:ajax_filter'), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
+class KeysetPaginationTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        # Повторяющиеся рейтинги проверяют разрешение связей по pk
+        for i in range(30):
+            Movie.objects.create(title=f'Movie {i % 7}', rating=i % 3)
+    
+    def collect(self, sort):
+        seen = []
+        params = {'sort': sort}
+        while True:
+            response = self.client.get(reverse('movies:list'), {**params, 'after': params.get('after', '')})
+            seen.extend(m.pk for m in response.context['movies'])
+            page = response.context['page_obj']
+            if not page.has_next():
+                return seen
+            params['after'] = page.next_cursor
+    
+    def test_cursor_walk_matches_offset_order(self):
+        for sort, label in MOVIE_SORT_OPTIONS:
+            expected = list(
+                Movie.objects.order_by(sort, '-pk' if sort.startswith('-') else 'pk').values_list('pk', flat=True)
+            )
+            self.assertEqual(self.collect(sort), expected, sort)
+    
+    def test_count_modes(self):
+        qs = Movie.objects.order_by('-rating')
+        self.assertEqual(KeysetPaginator(qs, 5, count_mode='exact').count, 30)
+        self.assertEqual(KeysetPaginator(qs, 5, count_mode='estimate').count, 30)
+        self.assertIsNone(KeysetPaginator(qs, 5).count)
+    
+    def test_cursor_from_other_sort_is_rejected(self):
+        page = KeysetPaginator(Movie.objects.order_by('title'), 5).page()
+        with self.assertRaises(InvalidCursor):
+            KeysetPaginator(Movie.objects.order_by('-rating'), 5).page(page.next_cursor)
+    
+    def test_malformed_cursor_values_are_rejected(self):
+        def cursor(ordering, values):
+            data = json.dumps({'o': ordering, 'v': values}).encode()
+            return base64.urlsafe_b64encode(data).decode().rstrip('=')
+        
+        cases = [
+            ('-created_at', cursor(['-created_at', '-pk'], ['notadate', 1])),
+            ('-rating', cursor(['-rating', '-pk'], ['abc', 1])),
+            ('-created_at', cursor(['-created_at', '-pk'], ['2026-01-01T00:00:00+00:00', 'x'])),
+            ('-created_at', cursor(['-created_at', '-pk'], [None, {'a': 1}])),
+        ]
+        for sort, after in cases:
+            params = {'sort': sort, 'after': after}
+            self.assertEqual(self.client.get(reverse('movies:list'), params).status_code, 400)
+            self.assertEqual(self.client.get(reverse('movies:ajax_filter'), params).status_code, 400)
+    
+    def test_invalid_cursor_is_bad_request(self):
+        for name in ('movies:list', 'movies:ajax_filter'):
+            response = self.client.get(reverse(name), {'after': 'garbage'})
+            self.assertEqual(response.status_code, 400, name)
+
+class CatalogueCacheTest(CacheResetTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        Category.objects.create(name='Drama')
+    
+    def test_cached_lists_do_not_query(self):
+        get_categories()
+        with self.assertNumQueries(0):
+            self.assertEqual([c.name for c in get_categories()], ['Drama'])
+    
+    def test_save_invalidates(self):
+        get_categories()
+        Category.objects.create(name='Comedy')
+        self.assertEqual([c.name for c in get_categories()], ['Comedy', 'Drama'])
+    
+    def test_context_is_lazy(self):
+        request = RequestFactory().get('/')
+        with self.assertNumQueries(0):
+            categories(request)
+
+
+class CardCacheTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.movie = Movie.objects.create(title='Alien', description='In space no one can hear you scream')
+    
+    def test_repeat_ajax_request_skips_database(self):
+        url = reverse('movies:ajax_filter')
+        self.client.get(url, {'genre': ['2', '1'], 'q': 'Alien'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': ' alien ', 'genre': ['1', '2']})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_movie_change_invalidates(self):
+        url = reverse('movies:ajax_filter')
+        self.assertContains(self.client.get(url), 'Alien')
+        self.movie.title = 'Aliens'
+        self.movie.save()
+        self.assertContains(self.client.get(url), 'Aliens')
+    
+    def test_list_page_reuses_cached_cards(self):
+        self.client.get(reverse('movies:list'))
+        with self.assertNumQueries(1):
+            # Остаётся только COUNT(*) пагинатора
+            response = self.client.get(reverse('movies:list'))
+        self.assertContains(response, 'Alien')
+
+
+class MovieCounterTest(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.drama = Category.objects.create(name='Drama')
+        cls.comedy = Category.objects.create(name='Comedy')
+        cls.action = Genre.objects.create(name='Action')
+        cls.romance = Genre.objects.create(name='Romance')
+    
+    def assertCounts(self, drama, comedy, action, romance):
+        for obj in (self.drama, self.comedy, self.action, self.romance):
+            obj.refresh_from_db()
+        self.assertEqual(
+            [c.movie_count for c in (self.drama, self.comedy, self.action, self.romance)],
+            [drama, comedy, action, romance],
+        )
+    
+    def test_counters_follow_movie_lifecycle(self):
+        movie = Movie.objects.create(title='Heat', category=self.drama)
+        movie.genres.add(self.action, self.romance)
+        self.assertCounts(1, 0, 1, 1)
+        
+        movie = Movie.objects.get(pk=movie.pk)
+        movie.category = self.comedy
+        movie.save()
+        movie.genres.remove(self.romance, self.romance)
+        self.assertCounts(0, 1, 1, 0)
+        
+        self.romance.movies.add(movie)
+        self.action.movies.clear()
+        self.assertCounts(0, 1, 0, 1)
+        
+        movie.delete()
+        self.assertCounts(0, 0, 0, 0)
+    
+    def test_reconcile_command_fixes_drift(self):
+        movie = Movie.objects.create(title='Heat', category=self.drama)
+        movie.genres.add(self.action)
+        Category.objects.update(movie_count=7)
+        Genre.objects.update(movie_count=0)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertCounts(1, 0, 1, 0)
+    
+    def test_drifted_counters_stay_at_zero(self):
+        movie = Movie.objects.create(title='Heat', category=self.drama)
+        movie.genres.add(self.action, self.romance)
+        Category.objects.update(movie_count=0)
+        Genre.objects.update(movie_count=0)
+        movie.genres.remove(self.romance)
+        movie.delete()
+        self.assertCounts(0, 0, 0, 0)
+
+
+class FacetTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.drama = Category.objects.create(name='Drama')
+        cls.comedy = Category.objects.create(name='Comedy')
+        cls.action = Genre.objects.create(name='Action')
+        cls.romance = Genre.objects.create(name='Romance')
+        for i, (category, genres, rating) in enumerate([
+            (cls.drama, [cls.action], 9.5),
+            (cls.drama, [cls.action, cls.romance], 8.2),
+            (cls.comedy, [cls.romance], 6),
+            (None, [], 3),
+        ]):
+            movie = Movie.objects.create(title=f'Movie {i}', category=category, rating=rating)
+            movie.genres.set(genres)
+    
+    def facets(self, **params):
+        response = self.client.get(reverse('movies:ajax_filter'), params)
+        return json.loads(response['X-Facets'])
+    
+    def test_unfiltered_counts(self):
+        facets = self.facets()
+        self.assertEqual(facets['genres'], {str(self.action.pk): 2, str(self.romance.pk): 2})
+        self.assertEqual(facets['categories'], {str(self.drama.pk): 2, str(self.comedy.pk): 1})
+        self.assertEqual(facets['ratings'], {'9': 1, '8': 1, '7': 0, '5': 1, '0': 1})
+    
+    def test_genre_facet_ignores_own_filter(self):
+        facets = self.facets(genre=self.action.pk)
+        self.assertEqual(facets['genres'], {str(self.action.pk): 2, str(self.romance.pk): 2})
+        self.assertEqual(facets['categories'], {str(self.drama.pk): 2})
+        self.assertEqual(facets['ratings'], {'9': 1, '8': 1, '7': 0, '5': 0, '0': 0})
+    
+    def test_facets_use_single_query(self):
+        view = MovieListView()
+        view.request = RequestFactory().get('/', {'category': self.drama.pk, 'q': 'movie'})
+        with self.assertNumQueries(1):
+            facet_counts(
+                view.filter_queryset(Movie.objects.all()),
+                genre_queryset=view.filter_queryset(Movie.objects.all(), exclude=('genre',)),
+                category_queryset=view.filter_queryset(Movie.objects.all(), exclude=('category',)),
+            )
+    
+    def test_rating_filter(self):
+        response = self.client.get(reverse('movies:list'), {'rating': 8})
+        self.assertEqual([m.title for m in response.context['movies']], ['Movie 1'])
+    
+    def test_all_genres_mode(self):
+        both = {'genre': [self.action.pk, self.romance.pk]}
+        
+        def titles(**params):
+            return [m.title for m in self.client.get(reverse('movies:list'), params).context['movies']]
+        
+        self.assertEqual(titles(**both), ['Movie 2', 'Movie 1', 'Movie 0'])
+        self.assertEqual(titles(**both, genre_mode='all'), ['Movie 1'])
+        # Счётчик жанра в режиме all - сколько фильмов останется с ним
+        facets = self.facets(genre=self.action.pk, genre_mode='all')
+        self.assertEqual(facets['genres'], {str(self.action.pk): 2, str(self.romance.pk): 1})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageRenditionTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        buffer = BytesIO()
+        Image.new('RGB', (900, 1350), 'red').save(buffer, 'PNG')
+        cls.movie = Movie.objects.create(title='Alien', poster=SimpleUploadedFile('alien.png', buffer.getvalue()))
+    
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+    
+    def test_upload_queues_generation(self):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'PNG')
+        movie = Movie.objects.create(title='Heat', poster=SimpleUploadedFile('heat.png', buffer.getvalue()))
+        movie.poster = SimpleUploadedFile('heat2.png', buffer.getvalue())
+        movie.save()
+        # Ожидающая задача одна на фильм, генерации в запросе нет
+        self.assertEqual(Task.objects.filter(key=f'renditions:movies.movie:{movie.pk}').count(), 1)
+        self.assertFalse(Movie.objects.get(pk=movie.pk).poster_renditions)
+        call_command('run_worker', burst=True, stdout=StringIO(), stderr=StringIO())
+        self.assertTrue(Movie.objects.get(pk=movie.pk).poster_renditions)
+    
+    def test_delete_queues_file_removal(self):
+        buffer = BytesIO()
+        Image.new('RGB', (10, 10)).save(buffer, 'PNG')
+        movie = Movie.objects.create(title='Heat', poster=SimpleUploadedFile('heat.png', buffer.getvalue()))
+        generate_renditions(Movie, movie.pk)
+        storage, name = movie.poster.storage, movie.poster.name
+        movie.delete()
+        self.assertTrue(storage.exists(name))
+        call_command('run_worker', burst=True, stdout=StringIO(), stderr=StringIO())
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(storage.exists(rendition_name(name, 'card', 'jpg')))
+    
+    def test_renditions_are_generated(self):
+        url = reverse('movies:detail', args=[self.movie.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertTrue(generate_renditions(Movie, self.movie.pk))
+        self.movie.refresh_from_db()
+        self.assertTrue(self.movie.poster_renditions)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'srcset')
+        for rendition, size in POSTER_RENDITIONS.items():
+            path = rendition_name(self.movie.poster.name, rendition, 'jpg')
+            with Image.open(self.movie.poster.storage.path(path)) as image:
+                self.assertEqual(image.size, size)
+    
+    def test_cards_use_srcset_when_ready(self):
+        response = self.client.get(reverse('movies:list'))
+        self.assertNotContains(response, 'srcset')
+        call_command('generate_renditions', stdout=StringIO())
+        response = self.client.get(reverse('movies:list'))
+        self.assertContains(response, '.retina.webp 2x')
+
+
+class MovieFilterTest(TestCase):
+    
+    def parse(self, **params):
+        return MovieFilter.from_query(RequestFactory().get('/', params).GET)
+    
+    def test_normalisation_and_digest(self):
+        movie_filter = self.parse(q='  The MATRIX ', genre=['3', '1', '3'], category='2', rating='7', sort='bogus')
+        self.assertEqual(movie_filter.as_dict(), {
+            'q': 'the matrix', 'category': 2, 'genre': (1, 3), 'genre_mode': 'any', 'rating': 7, 'sort': '-created_at',
+        })
+        same = self.parse(sort='-created_at', rating='7', category='2', genre=['1', '3'], q='the matrix')
+        self.assertEqual(movie_filter, same)
+        self.assertEqual(movie_filter.digest('2'), same.digest('2'))
+        self.assertNotEqual(movie_filter.digest(), same.without('genre').digest())
+        # Неверные значения - как будто фильтра нет
+        self.assertFalse(self.parse(category='x', genre=['1', 'x'], rating='4', genre_mode='none').has_filters())
+        self.assertEqual(self.parse(genre='1', genre_mode='all').without('genre').genre_mode, 'any')
+    
+    def test_genres_use_exists_without_distinct(self):
+        sql = str(MovieFilter(genre=[1, 2]).queryset(Movie.objects.all()).query).upper()
+        self.assertIn('EXISTS', sql)
+        self.assertNotIn('DISTINCT', sql)
+        sql = str(MovieFilter(genre=[1, 2], genre_mode='all').apply(Movie.objects.all()).query).upper()
+        self.assertEqual(sql.count('EXISTS'), 2)
+
+
+class ImportMoviesTest(CacheResetTestCase):
+    
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+    
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+    
+    def test_csv_import_and_upsert(self):
+        User.objects.create_user(username='critic', password='x')
+        path = self.write('movies.csv', (
+            'title,description,release_date,category,genres,rating,author\n'
+            'Alien,Space horror,1979-05-25,Horror,Sci-Fi|Thriller,8.5,critic\n'
+            'Heat,Heist,1995-12-15,Crime,Thriller,8.3,\n'
+            'Broken,,not-a-date,,,1,\n'
+        ))
+        with self.assertLogs('movies.importer', 'WARNING') as logs:
+            call_command('import_movies', path, '--batch-size', '2', stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(logs.output, ["WARNING:movies.importer:Import row 3 skipped: invalid release_date 'not-a-date'"])
+        
+        alien = Movie.objects.get(title='Alien')
+        self.assertEqual(alien.author.username, 'critic')
+        self.assertEqual(alien.category.name, 'Horror')
+        self.assertEqual(sorted(g.name for g in alien.genres.all()), ['Sci-Fi', 'Thriller'])
+        self.assertEqual(Genre.objects.get(name='Thriller').movie_count, 2)
+        self.assertFalse(Movie.objects.filter(title='Broken').exists())
+        
+        path = self.write('update.jsonl', (
+            '{"title": "Alien", "release_date": "1979-05-25", "category": null, "genres": ["Horror"], "rating": 9}\n'
+            '{broken json\n'
+        ))
+        with self.assertLogs('movies.importer', 'WARNING') as logs:
+            call_command('import_movies', path, stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(logs.output, [
+            'WARNING:movies.importer:Import row 2 skipped: invalid JSON: '
+            'Expecting property name enclosed in double quotes: line 1 column 2 (char 1)',
+        ])
+        
+        alien = Movie.objects.get(title='Alien')
+        self.assertEqual(Movie.objects.count(), 2)
+        self.assertEqual(alien.rating, 9)
+        self.assertEqual(alien.author.username, 'critic')
+        self.assertIsNone(alien.category)
+        self.assertEqual([g.name for g in alien.genres.all()], ['Horror'])
+        self.assertEqual(Genre.objects.get(name='Thriller').movie_count, 1)
+        
+        response = self.client.get(reverse('movies:list'), {'q': 'space'})
+        self.assertEqual(list(response.context['movies']), [alien])
+    
+    def test_import_and_reconcile_invalidate_cached_pages(self):
+        path = self.write('one.csv', 'title,rating\nAlien,8\n')
+        for command, args in (('import_movies', [path]), ('reconcile_counters', [])):
+            before = get_tag_versions([CATALOGUE_TAG])
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command(command, *args, stdout=StringIO(), stderr=StringIO())
+            self.assertNotEqual(get_tag_versions([CATALOGUE_TAG]), before, command)
+    
+    def test_rejected_rows_are_capped_and_logged(self):
+        path = self.write('bad.jsonl', '{broken json\n' * 5 + '{"title": "Alien"}\n')
+        stderr = StringIO()
+        with self.assertLogs('movies.importer', 'WARNING') as logs:
+            call_command('import_movies', path, '--max-errors', '2', stdout=StringIO(), stderr=stderr)
+        self.assertEqual(len(logs.output), 5)
+        self.assertIn('Row 2:', stderr.getvalue())
+        self.assertNotIn('Row 3:', stderr.getvalue())
+        self.assertIn('... and 3 more errors', stderr.getvalue())
+        self.assertTrue(Movie.objects.filter(title='Alien').exists())
+
+
+class ExportMoviesTest(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        cls.user = User.objects.create_user(username='viewer', password='testpass123')
+        cls.drama = Category.objects.create(name='Drama')
+        cls.noir = Genre.objects.create(name='Noir')
+        cls.crime = Genre.objects.create(name='Crime')
+        for i in range(5):
+            movie = Movie.objects.create(title=f'Film {i}', description=f'Plot {i}', rating=6 + i, author=cls.user,
+                                         category=cls.drama if i % 2 else None)
+            movie.genres.add(cls.noir, cls.crime)
+    
+    def export(self, **params):
+        response = self.client.get(reverse('movies:export'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+    
+    def test_staff_only(self):
+        response = self.client.get(reverse('movies:export'))
+        self.assertEqual(response.status_code, 302)
+        self.client.login(username='viewer', password='testpass123')
+        response = self.client.get(reverse('movies:export'))
+        self.assertEqual(response.status_code, 403)
+    
+    def test_csv_export_streams_filtered_rows(self):
+        self.client.login(username='staff', password='testpass123')
+        lines = self.export(category=self.drama.pk).splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'title', 'description'])
+        self.assertEqual(len(lines), 3)
+        self.assertIn('Crime|Noir', lines[1])
+    
+    def test_jsonl_export_prefetches_genres_per_chunk(self):
+        self.client.login(username='staff', password='testpass123')
+        response = self.client.get(reverse('movies:export'), {'format': 'jsonl'})
+        # Фильмы и жанры читаются одной парой запросов на пачку, а не на каждую строку
+        with self.assertNumQueries(2):
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['genres'], ['Crime', 'Noir'])
+        self.assertEqual(rows[0]['author'], 'viewer')
+    
+    def test_command_writes_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'movies.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        call_command('export_movies', '--format', 'jsonl', '--output', path, '--genre', str(self.noir.pk),
+                     '--chunk-size', '2', stderr=StringIO())
+        with open(path, encoding='utf-8') as f:
+            self.assertEqual([json.loads(line)['title'] for line in f], [f'Film {i}' for i in range(5)])
+
+
+class InstrumentationTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(username='staff', password='testpass123', is_staff=True)
+        Movie.objects.create(title='Metered', description='Plot', rating=7)
+    
+    def setUp(self):
+        super().setUp()
+        METRICS.reset()
+    
+    def test_server_timing_and_metrics(self):
+        response = self.client.get(reverse('movies:list'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=')
+        row = METRICS.snapshot()['movies:list']
+        self.assertEqual(row['requests'], 1)
+        self.assertGreater(row['queries'], 0)
+        self.assertGreater(row['template_seconds'], 0)
+        
+        self.assertEqual(self.client.get(reverse('movies:metrics')).status_code, 403)
+        self.client.login(username='staff', password='testpass123')
+        response = self.client.get(reverse('movies:metrics'))
+        self.assertContains(response, 'movies_view_queries_count{view="movies:list"} 1')
+        self.assertContains(response, '# TYPE movies_view_duration_seconds summary')
+    
+    @override_settings(MOVIES_METRICS_TOKEN='s3cret')
+    def test_metrics_token(self):
+        response = self.client.get(reverse('movies:metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('movies:metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+    
+    @override_settings(MOVIES_QUERY_BUDGETS={'movies:detail': 0})
+    def test_query_budget(self):
+        movie = Movie.objects.get()
+        with override_settings(MOVIES_QUERY_BUDGET_ACTION='raise'):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(reverse('movies:detail', args=[movie.pk]))
+        with override_settings(MOVIES_QUERY_BUDGET_ACTION='log'):
+            client = Client()
+            with self.assertLogs('movies.instrumentation', 'WARNING'):
+                client.get(reverse('movies:detail', args=[movie.pk]))
+        self.assertEqual(METRICS.snapshot()['movies:detail']['budget_exceeded'], 2)
+    
+    def test_concurrent_async_requests_count_their_own_queries(self):
+        movie = Movie.objects.get()
+        urls = [reverse('movies:list'), reverse('movies:detail', args=[movie.pk])] * 3
+        
+        def queries(response):
+            return int(re.search(r'"(\d+) queries"', response['Server-Timing']).group(1))
+        
+        # Второй проход - с прогретым кэшем каталога, как и параллельные запросы
+        for url in urls[:2]:
+            self.client.get(url)
+        expected = [queries(self.client.get(url)) for url in urls[:2]] * 3
+        
+        async def fetch_all():
+            client = AsyncClient()
+            return await asyncio.gather(*(client.get(url) for url in urls))
+        
+        responses = async_to_sync(fetch_all)()
+        self.assertEqual([queries(response) for response in responses], expected)
+        self.assertEqual(connection.execute_wrappers.count(record_query), 1)
+    
+    @override_settings(MOVIES_INSTRUMENTATION=False)
+    def test_disabled(self):
+        response = Client().get(reverse('movies:list'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(METRICS.snapshot(), {})
+
+
+class BenchmarkHarnessTest(CacheResetTestCase):
+    
+    def test_seed_is_deterministic_and_scenarios_run(self):
+        seed_catalogue(60, seed=7)
+        titles = list(Movie.objects.order_by('pk').values_list('title', flat=True))
+        self.assertEqual(len(titles), 60)
+        self.assertEqual(Genre.objects.get(name='Noir').movie_count, Movie.objects.filter(genres__name='Noir').count())
+        
+        results = run_benchmark(iterations=3, seed=7)
+        self.assertEqual(set(results), {'home', 'search', 'genre_filter', 'combined_filter', 'deep_offset',
+                                        'ajax_filter', 'cursor_walk', 'detail', 'profile_heavy', 'profile'})
+        for result in results.values():
+            self.assertEqual(result['statuses'], {'200': 3})
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        
+        Movie.objects.all().delete()
+        User.objects.filter(username__startswith='bench').delete()
+        Category.objects.all().delete()
+        Genre.objects.all().delete()
+        seed_catalogue(60, seed=7)
+        self.assertEqual(list(Movie.objects.order_by('pk').values_list('title', flat=True)), titles)
+    
+    @override_settings(MOVIES_PAGE_CACHE=True)
+    def test_cold_runs_bypass_the_page_cache(self):
+        seed_catalogue(40, seed=7)
+        results = run_benchmark(scenarios=['home'], iterations=3, seed=7)
+        self.assertGreater(results['home']['queries_min'], 0)
+        results = run_benchmark(scenarios=['home'], iterations=3, seed=7, warm=True)
+        self.assertEqual(results['home']['queries_min'], 0)
+    
+    def test_compare_with_baseline(self):
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 99), 5)
+        baseline = {'scenarios': {'home': {'p95_ms': 10.0, 'queries_max': 5}, 'search': {'p95_ms': 10.0, 'queries_max': 5}}}
+        current = {'scenarios': {'home': {'p95_ms': 11.0, 'queries_max': 5}, 'search': {'p95_ms': 10.0, 'queries_max': 6}}}
+        rows = {row['scenario']: row for row in compare_results(current, baseline, threshold=20)}
+        self.assertFalse(rows['home']['regressed'])
+        self.assertTrue(rows['search']['regressed'])
+    
+    def test_sqlite_optimize_reports_list_query_plans(self):
+        seed_catalogue(60, seed=7)
+        out = StringIO()
+        call_command('sqlite_optimize', '--full', stdout=out)
+        output = out.getvalue()
+        self.assertIn('journal_mode = ', output)
+        self.assertIn('ANALYZE complete', output)
+        self.assertIn('distinct queries', output)
+        self.assertIn('movies_movie', output)
+    
+    def test_tuned_mode_uses_wal_and_immediate_transactions(self):
+        modes = sqlite_modes()
+        self.assertIn('journal_mode=DELETE', modes['default']['init_command'])
+        self.assertEqual(modes['tuned']['transaction_mode'], 'IMMEDIATE')
+        for pragma in ('journal_mode=WAL', 'synchronous=NORMAL', 'mmap_size', 'cache_size', 'busy_timeout'):
+            self.assertIn(pragma, modes['tuned']['init_command'])
+
+
+class ConcurrentBenchmarkTest(TransactionTestCase):
+    
+    def test_run_concurrent_serves_reads_and_writes(self):
+        seed_catalogue(40, seed=7)
+        # В тестовой базе в памяти с общим кэшем FTS5 не открывается из нескольких потоков сразу
+        with mock.patch('movies.benchmark.CONCURRENT_READ_SCENARIOS', ['home', 'genre_filter', 'detail', 'profile']):
+            results = run_concurrent(readers=2, writers=1, duration=0.3, seed=7, modes=['tuned'])
+        self.assertEqual(set(results), {'tuned'})
+        for kind in ('reads', 'writes'):
+            # Общий кэш SQLite блокирует таблицы целиком, поэтому учитываем и блокировки
+            stats = results['tuned'][kind]
+            self.assertGreater(stats['operations'] + stats['locked_errors'], 0, kind)
+
+
+@override_settings(MOVIES_QUERY_BUDGET_ACTION='log')
+class QueryCountRegressionTest(QueryCountAssertionsMixin, TestCase):
+    """Число запросов каждого представления не зависит от объёма данных"""
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Drama')
+        cls.genre = Genre.objects.create(name='Action')
+        cls.user = User.objects.create_user(username='testuser', password='testpass123', is_staff=True)
+        cls.movie = Movie.objects.create(
+            title='Test Movie',
+            description='Test Description',
+            category=cls.category,
+            author=cls.user,
+            rating=8.5
+        )
+        cls.movie.genres.add(cls.genre)
+    
+    def add_movies(self, count, author=None, genres=5):
+        """count фильмов с genres жанрами каждый, без сигналов"""
+        genre_objs = [Genre.objects.get_or_create(name=f'Genre {i}')[0] for i in range(genres)]
+        categories = [Category.objects.get_or_create(name=f'Category {i}')[0] for i in range(3)]
+        authors = [User.objects.get_or_create(username=f'author{i}')[0] for i in range(3)]
+        movies = Movie.objects.bulk_create([
+            Movie(
+                title=f'Extra movie {i}', description='Extra plot', rating=i % 10,
+                category=categories[i % 3], author=author or authors[i % 3],
+            )
+            for i in range(count)
+        ])
+        through = Movie.genres.through
+        through.objects.bulk_create([through(movie_id=m.pk, genre_id=g.pk) for m in movies for g in genre_objs])
+        get_search_backend().rebuild()
+        return movies
+    
+    def test_list_views(self):
+        urls = [
+            reverse('movies:list'),
+            reverse('movies:list') + '?genre=%d&sort=-rating' % self.genre.pk,
+            reverse('movies:list') + '?q=movie',
+            reverse('movies:ajax_filter'),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertConstantQueries(url, lambda: self.add_movies(11))
+    
+    def test_detail_and_edit_views(self):
+        self.client.login(username='testuser', password='testpass123')
+        
+        def grow():
+            self.add_movies(11)
+            self.movie.genres.add(*Genre.objects.exclude(pk=self.genre.pk))
+        
+        for name in ('movies:detail', 'movies:edit', 'movies:delete'):
+            with self.subTest(view=name):
+                self.assertConstantQueries(reverse(name, args=[self.movie.pk]), grow)
+        self.assertConstantQueries(reverse('movies:create'), grow)
+    
+    def test_profile_views(self):
+        # Пользователь с одним фильмом и с пятьюстами
+        self.client.login(username='testuser', password='testpass123')
+        grow = lambda: self.add_movies(499, author=self.user)
+        self.assertConstantQueries(reverse('movies:user_profile', args=['testuser']), grow)
+        self.assertConstantQueries(reverse('movies:profile'), grow)
+        self.assertConstantQueries(reverse('movies:profile_edit'), grow)
+        self.assertConstantQueries(reverse('movies:profile_movies', args=['testuser']), grow)
+    
+    def test_export_and_metrics(self):
+        self.client.login(username='testuser', password='testpass123')
+        self.assertConstantQueries(reverse('movies:export') + '?format=jsonl', lambda: self.add_movies(30))
+        self.assertConstantQueries(reverse('movies:metrics'), lambda: self.add_movies(1))
+    
+    def test_views_within_budget(self):
+        self.add_movies(24)
+        for name in ('movies:list', 'movies:ajax_filter'):
+            self.assertWithinQueryBudget(reverse(name), name)
+        self.assertWithinQueryBudget(reverse('movies:detail', args=[self.movie.pk]), 'movies:detail')
+        self.assertWithinQueryBudget(reverse('movies:user_profile', args=['testuser']), 'movies:user_profile')
+    
+    def test_failure_reports_sql(self):
+        with override_settings(MOVIES_QUERY_BUDGETS={'movies:detail': 1}):
+            with self.assertRaisesRegex(AssertionError, r'(?s)movies:detail ran \d+ queries, budget is 1.*SELECT'):
+                with self.assertLogs('movies.instrumentation', 'WARNING'):
+                    self.assertWithinQueryBudget(reverse('movies:detail', args=[self.movie.pk]), 'movies:detail')
+
+
+class ProfileMoviesPaginationTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='prolific', password='testpass123')
+        cls.movies = [
+            Movie.objects.create(title=f'Work {i:02d}', author=cls.user, rating=5)
+            for i in range(PROFILE_MOVIES_PER_PAGE + 5)
+        ]
+    
+    def test_profile_shows_first_page_and_fragment_continues(self):
+        response = self.client.get(reverse('movies:user_profile', args=['prolific']))
+        shown = list(response.context['user_movies'])
+        self.assertEqual(shown, self.movies[::-1][:PROFILE_MOVIES_PER_PAGE])
+        self.assertEqual(response.context['user_movies_count'], str(PROFILE_MOVIES_PER_PAGE + 5))
+        next_url = response.context['next_movies_url']
+        self.assertTrue(next_url.startswith(reverse('movies:profile_movies', args=['prolific'])))
+        
+        response = self.client.get(next_url)
+        self.assertEqual(list(response.context['movies']), self.movies[::-1][PROFILE_MOVIES_PER_PAGE:])
+        self.assertNotIn('X-Next-Page-Url', response)
+        
+        for name in ('movies:profile_movies', 'movies:user_profile'):
+            response = self.client.get(reverse(name, args=['prolific']), {'after': 'garbage'})
+            self.assertEqual(response.status_code, 400)
+    
+    def test_own_profile_requires_login(self):
+        response = self.client.get(reverse('movies:profile'))
+        self.assertRedirects(response, reverse('movies:login'))
+        self.client.login(username='prolific', password='testpass123')
+        response = self.client.get(reverse('movies:profile'))
+        self.assertEqual(response.context['profile_user'], self.user)
+
+
+class ProfileWritesTest(TestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='reader', password='testpass123')
+        cls.bare = User.objects.create_user(username='bare', password='testpass123')
+        UserProfile.objects.filter(user=cls.bare).delete()
+    
+    def assertNoProfileWrites(self, func):
+        with CaptureQueriesContext(connection) as captured:
+            func()
+        writes = [q['sql'] for q in captured if 'movies_userprofile' in q['sql'] and not q['sql'].startswith('SELECT')]
+        self.assertEqual(writes, [])
+    
+    def test_get_never_creates_profile(self):
+        self.client.login(username='bare', password='testpass123')
+        self.assertNoProfileWrites(lambda: self.client.get(reverse('movies:user_profile', args=['bare'])))
+        self.assertNoProfileWrites(lambda: self.client.get(reverse('movies:profile_edit')))
+        self.assertFalse(UserProfile.objects.filter(user=self.bare).exists())
+        
+        self.client.post(reverse('movies:profile_edit'), {'bio': 'Hello', 'phone': ''})
+        self.assertEqual(UserProfile.objects.get(user=self.bare).bio, 'Hello')
+    
+    def test_user_save_writes_profile_only_when_changed(self):
+        self.assertNoProfileWrites(lambda: self.client.login(username='reader', password='testpass123'))
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        self.assertNoProfileWrites(user.save)
+        
+        user.profile.bio = 'Changed'
+        with CaptureQueriesContext(connection) as captured:
+            user.save()
+        updates = [q['sql'] for q in captured if q['sql'].startswith('UPDATE "movies_userprofile"')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"avatar"', updates[0])
+        self.assertEqual(UserProfile.objects.get(user=self.user).bio, 'Changed')
+        self.assertNoProfileWrites(user.save)
+    
+    def test_only_author_name_changes_reset_the_catalogue(self):
+        version = get_catalogue_version()
+        self.client.login(username='reader', password='testpass123')
+        user = User.objects.get(pk=self.user.pk)
+        user.email = 'reader@example.com'
+        user.save()
+        self.assertEqual(get_catalogue_version(), version)
+        
+        user.first_name = 'Renamed'
+        user.save()
+        self.assertGreater(get_catalogue_version(), version)
+    
+    def test_backfill_command(self):
+        out = StringIO()
+        call_command('backfill_profiles', '--dry-run', stdout=out)
+        self.assertIn('1 users have no profile', out.getvalue())
+        call_command('backfill_profiles', '--batch-size', '1', stdout=StringIO())
+        self.assertTrue(UserProfile.objects.filter(user=self.bare).exists())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReadReplicaRouterTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='writer', password='testpass123')
+        cls.movie = Movie.objects.create(title='Routed', author=cls.user)
+    
+    def test_router_decisions(self):
+        router = ReadReplicaRouter()
+        self.assertEqual(router.db_for_read(Movie), 'default')
+        with replica_reads():
+            self.assertIn(router.db_for_read(Movie), ['replica1', 'replica2'])
+        self.assertEqual(router.db_for_write(Movie), 'default')
+        self.assertFalse(router.allow_migrate('replica1', 'movies'))
+        self.assertTrue(router.allow_migrate('default', 'movies'))
+    
+    def route_reads(self):
+        """Выбор реплики подменён: запросы остаются в тестовой БД, но вызовы видны"""
+        return mock.patch('movies.routers.random.choice', return_value='default')
+    
+    def test_catalogue_pages_read_from_replicas(self):
+        urls = [
+            reverse('movies:list'),
+            reverse('movies:ajax_filter'),
+            reverse('movies:detail', args=[self.movie.pk]),
+            reverse('movies:user_profile', args=['writer']),
+        ]
+        for url in urls:
+            with self.subTest(url=url), self.route_reads() as choice:
+                self.assertEqual(self.client.get(url).status_code, 200)
+                choice.assert_called_with(['replica1', 'replica2'])
+    
+    def test_writes_pin_client_to_primary(self):
+        self.client.login(username='writer', password='testpass123')
+        with self.route_reads() as choice:
+            response = self.client.post(reverse('movies:profile_edit'), {'bio': 'Fresh', 'phone': ''})
+            choice.assert_not_called()
+        self.assertIn(PIN_COOKIE, response.cookies)
+        with self.route_reads() as choice:
+            self.client.get(reverse('movies:user_profile', args=['writer']))
+            choice.assert_not_called()
+
+
+class AsyncViewsTest(CacheResetTestCase):
+    """
+    Асинхронные представления вызываются через async_to_sync: синхронный
+    запрос к БД из цикла событий (например, из шаблона) дал бы SynchronousOnlyOperation
+    """
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Drama')
+        cls.genre = Genre.objects.create(name='Action')
+        cls.user = User.objects.create_user(username='testuser', password='testpass123')
+        movies = [
+            Movie.objects.create(title=f'Movie {i:02d}', description='Plot', category=cls.category, author=cls.user, rating=i % 10)
+            for i in range(MOVIES_PER_PAGE + 3)
+        ]
+        movies[0].genres.add(cls.genre)
+        cls.movie = movies[0]
+    
+    def make_request(self, path, params=None, user=None):
+        request = RequestFactory().get(path, params or {})
+        request.user = user or AnonymousUser()
+        
+        async def auser():
+            return request.user
+        
+        request.auser = auser
+        return request
+    
+    def call(self, view_class, request, **kwargs):
+        return async_to_sync(view_class.as_view())(request, **kwargs)
+    
+    def test_route_selection(self):
+        with override_settings(MOVIES_ASYNC_VIEWS=[]):
+            self.assertFalse(iscoroutinefunction(catalogue_view('list', MovieListView, AsyncMovieListView)))
+        with override_settings(MOVIES_ASYNC_VIEWS=['list']):
+            view = catalogue_view('list', MovieListView, AsyncMovieListView)
+            self.assertIs(view.view_class, AsyncMovieListView)
+            self.assertTrue(iscoroutinefunction(view))
+            self.assertIs(catalogue_view('detail', MovieDetailView, AsyncMovieDetailView).view_class, MovieDetailView)
+    
+    def test_list_pages(self):
+        url = reverse('movies:list')
+        request = self.make_request(url, {'page': 2}, user=User.objects.get(pk=self.user.pk))
+        response = self.call(AsyncMovieListView, request)
+        self.assertEqual(response.status_code, 200)
+        # Профиль для навигации загружен заранее
+        self.assertTrue(User.profile.related.is_cached(request.user))
+        self.assertContains(response, 'Movie 02')
+        self.assertNotContains(response, 'Movie 03')
+        self.assertContains(response, 'testuser')
+        self.assertContains(response, f'id="facet-genre-{self.genre.pk}">(1)')
+        
+        response = self.call(AsyncMovieListView, self.make_request(url, {'genre': self.genre.pk}))
+        self.assertContains(response, 'Movie 00')
+        self.assertNotContains(response, 'Movie 01')
+        with self.assertRaises(Http404):
+            self.call(AsyncMovieListView, self.make_request(url, {'page': 99}))
+    
+    def test_cursor_mode_list(self):
+        url = reverse('movies:list')
+        with mock.patch.object(AsyncMovieListView, 'pagination_mode', 'cursor'):
+            response = self.call(AsyncMovieListView, self.make_request(url))
+        self.assertContains(response, f'Found: {MOVIES_PER_PAGE + 3}')
+        self.assertContains(response, '?after=')
+        
+        response = self.call(AsyncMovieListView, self.make_request(url, {'after': 'garbage'}))
+        self.assertEqual(response.status_code, 400)
+        response = self.call(AsyncAjaxFilterView, self.make_request(reverse('movies:ajax_filter'), {'after': 'garbage'}))
+        self.assertEqual(response.status_code, 400)
+    
+    def test_ajax_filter_matches_sync_view(self):
+        url = reverse('movies:ajax_filter')
+        params = {'sort': 'title', 'category': self.category.pk}
+        expected = AjaxFilterView.as_view()(self.make_request(url, params))
+        cache.clear()
+        response = self.call(AsyncAjaxFilterView, self.make_request(url, params))
+        self.assertEqual(response.content, expected.content)
+        for header in ('X-Facets', 'X-Next-Cursor', 'X-Next-Page-Url'):
+            self.assertEqual(response[header], expected[header])
+    
+    def test_detail(self):
+        url = reverse('movies:detail', args=[self.movie.pk])
+        response = self.call(AsyncMovieDetailView, self.make_request(url, user=self.user), pk=self.movie.pk)
+        self.assertContains(response, 'Movie 00')
+        self.assertContains(response, 'Action')
+        self.assertContains(response, reverse('movies:edit', args=[self.movie.pk]))
+        with self.assertRaises(Http404):
+            self.call(AsyncMovieDetailView, self.make_request(url), pk=0)
+    
+    async def test_middleware_counts_queries_under_asgi(self):
+        response = await self.async_client.get(reverse('movies:ajax_filter'))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'desc="[1-9]\d* queries"')
+
+
+class ConditionalGetTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Drama')
+        cls.genre = Genre.objects.create(name='Action')
+        cls.user = User.objects.create_user(username='testuser', password='testpass123')
+        cls.movie = Movie.objects.create(title='Alien', description='Space', category=cls.category, author=cls.user)
+    
+    def assertNotModified(self, url, etag, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+    
+    def test_detail_revalidation(self):
+        url = reverse('movies:detail', args=[self.movie.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+        # Только запрос версий фильма, списки категорий и жанров уже в кэше
+        self.assertNotModified(url, etag, 1)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        
+        self.movie.genres.add(self.genre)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Action')
+        etag = response['ETag']
+        
+        self.user.first_name = 'Ridley'
+        self.user.save()
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        etag = self.client.get(url)['ETag']
+        
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, reverse('movies:edit', args=[self.movie.pk]))
+    
+    def test_list_and_ajax_revalidation(self):
+        for name in ('movies:list', 'movies:ajax_filter'):
+            url = reverse(name)
+            etag = self.client.get(url, {'genre': ['2', '1'], 'q': 'Alien'})['ETag']
+            # Поколение каталога берётся из кэша: 304 без единого запроса
+            self.assertNotModified(url, etag, 0, q=' alien ', genre=['1', '2'])
+            self.assertNotEqual(self.client.get(url, {'q': 'Alien'}, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        
+        url = reverse('movies:list')
+        etag = self.client.get(url)['ETag']
+        Movie.objects.create(title='Aliens')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Aliens')
+        self.assertNotEqual(response['ETag'], etag)
+    
+    def test_new_session_and_pending_messages_skip_304(self):
+        url = reverse('movies:detail', args=[self.movie.pk])
+        self.client.login(username='testuser', password='testpass123')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Новый вход - новые cookie сессии и CSRF: страница с формой голоса рендерится заново
+        self.client.logout()
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        
+        self.client.post(reverse('movies:rate', args=[self.movie.pk]), {'score': 'x'})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Rating must be a whole number')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+    
+    def test_async_views_share_validators(self):
+        url = reverse('movies:detail', args=[self.movie.pk])
+        etag = self.client.get(url)['ETag']
+        request = RequestFactory().get(url, HTTP_IF_NONE_MATCH=etag)
+        request.user = AnonymousUser()
+        
+        async def auser():
+            return request.user
+        
+        request.auser = auser
+        response = async_to_sync(AsyncMovieDetailView.as_view())(request, pk=self.movie.pk)
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(MOVIES_PAGE_CACHE=True)
+class PageCacheTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.drama = Category.objects.create(name='Drama')
+        cls.comedy = Category.objects.create(name='Comedy')
+        cls.genre = Genre.objects.create(name='Action')
+        cls.user = User.objects.create_user(username='testuser', password='testpass123')
+        cls.alien = Movie.objects.create(title='Alien', category=cls.drama, author=cls.user, rating=8.5)
+        cls.heat = Movie.objects.create(title='Heat', category=cls.comedy, author=cls.user, rating=9.1)
+    
+    def get(self, url, params=None, **extra):
+        response = self.client.get(url, params, **extra)
+        return response, response.get('X-Page-Cache')
+    
+    def test_anonymous_pages_are_served_from_cache(self):
+        url = reverse('movies:list')
+        self.assertEqual(self.get(url, {'sort': 'title', 'genre': ['2', '1']})[1], 'miss')
+        # Тот же query string в другом порядке
+        with self.assertNumQueries(0):
+            response, state = self.get(url, {'genre': ['1', '2'], 'sort': 'title'})
+        self.assertEqual(state, 'hit')
+        self.assertFalse(response.cookies)
+        
+        detail = reverse('movies:detail', args=[self.alien.pk])
+        etag = self.get(detail)[0]['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Посторонние параметры кэш не используют
+        self.assertIsNone(self.get(detail, {'category': self.drama.pk})[1])
+    
+    def test_saving_movie_invalidates_only_its_pages(self):
+        url = reverse('movies:list')
+        pages = {
+            'alien': (reverse('movies:detail', args=[self.alien.pk]), None),
+            'heat': (reverse('movies:detail', args=[self.heat.pk]), None),
+            'home': (url, None),
+            'top': (url, {'rating': '9'}),
+            'drama_action': (url, {'category': self.drama.pk, 'genre': self.genre.pk}),
+            'comedy_action': (url, {'category': self.comedy.pk, 'genre': self.genre.pk}),
+        }
+        for page, params in pages.values():
+            self.get(page, params)
+        
+        self.alien.title = 'Aliens'
+        self.alien.save()
+        states = {name: self.get(page, params)[1] for name, (page, params) in pages.items()}
+        self.assertEqual(states, {
+            'alien': 'miss', 'heat': 'hit', 'home': 'miss', 'top': 'hit',
+            'drama_action': 'miss', 'comedy_action': 'hit',
+        })
+        self.assertContains(self.client.get(pages['alien'][0]), 'Aliens')
+        
+        # Новый рейтинг: сбрасываются страницы прежнего и нового диапазона
+        self.alien.rating = 9.5
+        self.alien.save()
+        self.assertContains(self.client.get(url, {'rating': '9'}), 'Aliens')
+        
+        self.get(*pages['alien'])
+        self.heat.genres.add(self.genre)
+        self.assertContains(self.client.get(url, pages['comedy_action'][1]), 'Heat')
+        self.assertEqual(self.get(*pages['alien'])[1], 'hit')
+        
+        # Новый фильм меняет счётчики категорий на всех страницах
+        Movie.objects.create(title='Up', category=self.comedy)
+        self.assertEqual(self.get(*pages['alien'])[1], 'miss')
+    
+    def test_visitors_with_session_or_messages_bypass_cache(self):
+        url = reverse('movies:list')
+        self.client.login(username='testuser', password='testpass123')
+        response, state = self.get(url)
+        self.assertIsNone(state)
+        self.assertContains(response, 'Add Movie')
+        self.client.logout()
+        self.assertNotContains(self.client.get(url), 'Add Movie')
+        
+        self.client.cookies['messages'] = 'pending'
+        self.assertIsNone(self.get(url)[1])
+    
+    def test_responses_with_csrf_token_or_cookies_are_not_stored(self):
+        request = RequestFactory().get('/')
+        self.assertTrue(is_cacheable_response(request, HttpResponse('page')))
+        get_token(request)
+        self.assertFalse(is_cacheable_response(request, HttpResponse('page')))
+        response = HttpResponse('page')
+        response.set_cookie('sessionid', 'x')
+        self.assertFalse(is_cacheable_response(RequestFactory().get('/'), response))
+    
+    def test_list_page_tags(self):
+        factory = RequestFactory()
+        
+        def tags(**params):
+            return list_page_tags(factory.get('/', params).GET)
+        
+        self.assertEqual(tags(rating='7', category='1'), ['rating:7'])
+        self.assertEqual(tags(category='1', genre=['3', '2']), ['category:1', 'genre:2', 'genre:3'])
+        # Фильтр по одному фасету: фасет считается по всему каталогу
+        self.assertEqual(tags(category='1'), ['list'])
+        self.assertEqual(tags(category='1', genre='x', rating='6'), ['list'])
+    
+    async def test_async_middleware(self):
+        url = reverse('movies:detail', args=[self.alien.pk])
+        self.assertEqual((await self.async_client.get(url))['X-Page-Cache'], 'miss')
+        self.assertEqual((await self.async_client.get(url))['X-Page-Cache'], 'hit')
+
+
+class LeaderboardTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.horror = Category.objects.create(name='Horror')
+        cls.drama = Category.objects.create(name='Drama')
+        cls.genre = Genre.objects.create(name='Slasher')
+        # Больше, чем помещается в рейтинг: часть фильмов видна только в БД
+        Movie.objects.bulk_create([
+            Movie(title=f'Horror {i}', category=cls.horror, rating=i / 4) for i in range(30)
+        ])
+        reconcile_counters()
+        cls.best = Movie.objects.get(title='Horror 29')
+    
+    def setUp(self):
+        super().setUp()
+        reset_leaderboards()
+    
+    def expected(self, scope, limit=MOVIES_PER_PAGE):
+        movies = Movie.objects.filter(category=self.horror) if scope != ALL else Movie.objects.all()
+        return list(movies.order_by('-rating', '-pk')[:limit])
+    
+    def test_top_movies_read_board_and_one_query(self):
+        scope = category_scope(self.horror.pk)
+        top_movies(scope, MOVIES_PER_PAGE)
+        with self.assertNumQueries(1):
+            movies, count = top_movies(scope, MOVIES_PER_PAGE)
+        self.assertEqual(movies, self.expected(scope))
+        self.assertEqual(count, 30)
+        self.assertIsNone(top_movies(scope, MOVIES_PER_PAGE * 10))
+    
+    def test_boards_follow_rating_category_and_genre_changes(self):
+        scopes = [ALL, category_scope(self.horror.pk), category_scope(self.drama.pk), genre_scope(self.genre.pk)]
+        get_boards(scopes)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            # Лучший фильм опускается ниже всех, кто есть в рейтинге
+            self.best.rating = 0
+            self.best.save()
+        expected = self.expected(ALL)
+        with self.assertNumQueries(1):
+            self.assertEqual(top_movies(ALL, MOVIES_PER_PAGE)[0], expected)
+        
+        movie = Movie.objects.get(title='Horror 3')
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.rating = 9.9
+            movie.category = self.drama
+            movie.save()
+            movie.genres.add(self.genre)
+        boards = get_boards(scopes)
+        self.assertEqual(boards[ALL]['entries'][0][1], movie.pk)
+        self.assertNotIn(movie.pk, [pk for rating, pk in boards[category_scope(self.horror.pk)]['entries']])
+        self.assertEqual(boards[category_scope(self.drama.pk)], {'entries': [(Decimal('9.9'), movie.pk)], 'count': 1})
+        self.assertEqual(boards[genre_scope(self.genre.pk)]['count'], 1)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            movie.delete()
+        boards = get_boards(scopes)
+        self.assertEqual(boards[ALL]['count'], 29)
+        self.assertEqual(boards[genre_scope(self.genre.pk)], {'entries': [], 'count': 0})
+        self.assertEqual(top_movies(ALL, MOVIES_PER_PAGE)[0], self.expected(ALL))
+    
+    def test_contended_or_concurrently_built_boards_are_dropped(self):
+        scope = category_scope(self.horror.pk)
+        key = board_key(scope)
+        get_boards([scope])
+        # Блокировку держит другая правка: рейтинг удаляется, а не правится без неё
+        with board_lock(key), mock.patch('movies.leaderboards.time.sleep') as sleep:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.best.rating = 0
+                self.best.save()
+        self.assertIsNone(cache.get(key))
+        sleep.assert_not_called()
+        
+        def build_during_commit(scope, using=None):
+            board = build_board(scope, using)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.best.rating = 9.9
+                self.best.save()
+            return board
+        
+        with mock.patch('movies.leaderboards.build_board', build_during_commit):
+            get_boards([scope])
+        # Рейтинг построен до коммита - в кэш он не попадает
+        self.assertIsNone(cache.get(key))
+        self.assertEqual(top_movies(scope, MOVIES_PER_PAGE)[0], self.expected(scope))
+    
+    def test_list_page_uses_board(self):
+        url = reverse('movies:list')
+        params = {'category': self.horror.pk, 'sort': '-rating'}
+        self.client.get(url, params)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params)
+        self.assertEqual(list(response.context['movies']), self.expected(category_scope(self.horror.pk)))
+        self.assertEqual(response.context['paginator'].count, 30)
+        # Без COUNT и без сортировки по рейтингу в SQL
+        self.assertFalse([q for q in captured.captured_queries if 'ORDER BY' in q['sql'] or 'COUNT' in q['sql']])
+        
+        second = self.client.get(url, {**params, 'page': 2})
+        self.assertEqual(second.context['movies'][0], self.expected(category_scope(self.horror.pk), 13)[-1])
+
+
+class RatingTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user(username='alice', password='testpass123')
+        cls.bob = User.objects.create_user(username='bob', password='testpass123')
+        cls.movie = Movie.objects.create(title='Alien', author=cls.alice, rating=8, author_rating=8)
+        cls.unrated = Movie.objects.create(title='Heat')
+    
+    def setUp(self):
+        super().setUp()
+        reset_leaderboards()
+    
+    def assertAggregates(self, movie, rating, total, count):
+        movie.refresh_from_db()
+        self.assertEqual((movie.rating, movie.rating_sum, movie.rating_count), (Decimal(rating), total, count))
+    
+    def test_votes_update_bayesian_average(self):
+        self.assertEqual(rate_movie(self.alice, self.movie.pk, 10), (Decimal('8.3'), 1))
+        self.assertEqual(rate_movie(self.bob, self.movie.pk, 4), (Decimal('7.7'), 2))
+        # Повторный голос заменяет прежний, а не добавляется
+        self.assertEqual(rate_movie(self.alice, self.movie.pk, 6), (Decimal('7.1'), 2))
+        self.assertAggregates(self.movie, '7.1', 10, 2)
+        self.assertEqual(Rating.objects.filter(movie=self.movie).count(), 2)
+        # Без оценки автора голоса усредняются с RATING_PRIOR_MEAN
+        self.assertEqual(rate_movie(self.bob, self.unrated.pk, 9), (Decimal('6.5'), 1))
+        self.assertEqual(bayesian_rating(None, 9, 1), Decimal('6.5'))
+        with self.assertRaises(Movie.DoesNotExist):
+            rate_movie(self.bob, 0, 5)
+    
+    def test_edit_keeps_concurrent_votes(self):
+        movie = Movie.objects.get(pk=self.movie.pk)
+        rate_movie(self.bob, self.movie.pk, 2)
+        form = MovieEditForm({'title': 'Aliens', 'author_rating': '8'}, instance=movie)
+        self.assertTrue(form.is_valid())
+        form.save(commit=False).save(update_fields=edited_fields(form))
+        self.assertAggregates(movie, '7.0', 2, 1)
+        self.assertEqual(movie.title, 'Aliens')
+        
+        self.client.login(username='alice', password='testpass123')
+        response = self.client.post(reverse('movies:edit', args=[movie.pk]), {'title': 'Aliens', 'author_rating': '5'})
+        self.assertRedirects(response, reverse('movies:detail', args=[movie.pk]))
+        self.assertAggregates(movie, '4.5', 2, 1)
+    
+    def test_plain_save_writes_every_field(self):
+        movie = Movie.objects.get(pk=self.unrated.pk)
+        movie.rating_count = 3
+        movie.save()
+        self.assertEqual(Movie.objects.get(pk=movie.pk).rating_count, 3)
+        # Строки уже нет - save() вставляет её заново
+        Movie.objects.filter(pk=movie.pk).delete()
+        movie.save()
+        self.assertEqual(Movie.objects.get(pk=movie.pk).title, 'Heat')
+    
+    def test_votes_update_leaderboards_and_pages(self):
+        get_boards([ALL])
+        with self.captureOnCommitCallbacks(execute=True):
+            rate_movie(self.alice, self.unrated.pk, 10)
+        self.assertIn((Decimal('6.7'), self.unrated.pk), get_boards([ALL])[ALL]['entries'])
+        response = self.client.get(reverse('movies:list'), {'sort': '-rating'})
+        self.assertEqual(list(response.context['movies']), [self.movie, self.unrated])
+        self.assertContains(self.client.get(reverse('movies:detail', args=[self.unrated.pk])), '1 vote')
+    
+    def test_rate_view(self):
+        url = reverse('movies:rate', args=[self.movie.pk])
+        self.assertRedirects(self.client.post(url, {'score': 9}), f"{reverse('movies:login')}?next={url}")
+        
+        self.client.login(username='bob', password='testpass123')
+        response = self.client.post(url, {'score': 9})
+        self.assertRedirects(response, reverse('movies:detail', args=[self.movie.pk]))
+        self.assertAggregates(self.movie, '8.2', 9, 1)
+        detail = self.client.get(reverse('movies:detail', args=[self.movie.pk]))
+        self.assertEqual(detail.context['user_score'], 9)
+        self.assertContains(detail, 'Change your vote')
+        
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        response = self.client.post(url, {'score': 3}, **ajax)
+        self.assertEqual(response.json(), {'rating': '7.2', 'rating_count': 1, 'score': 3})
+        self.assertEqual(self.client.post(url, {'score': 11}, **ajax).status_code, 400)
+        self.assertEqual(self.client.post(reverse('movies:rate', args=[0]), {'score': 5}).status_code, 404)
+    
+    def test_sql_rating_rounds_half_up_like_python(self):
+        # (8.1 * 5 + 43) / 10 = 8.35: float ROUND дал бы 8.3
+        movie = Movie.objects.create(title='Boundary', author_rating=Decimal('8.1'))
+        for i, score in enumerate([9, 9, 9, 8, 8]):
+            voter = User.objects.create_user(username=f'voter{i}', password='x')
+            rating, count = rate_movie(voter, movie.pk, score)
+        self.assertEqual(bayesian_rating(Decimal('8.1'), 43, 5), Decimal('8.4'))
+        self.assertEqual(rating, Decimal('8.4'))
+        self.assertAggregates(movie, '8.4', 43, 5)
+        self.assertEqual(reconcile_ratings(), 0)
+        
+        movies = Movie.objects.filter(pk=movie.pk)
+        for count in range(1, 16):
+            for total in range(count, count * 10 + 1):
+                if (Decimal('40.5') + total) * 20 % (count + 5):
+                    continue
+                expression = rating_expression(Value(total), Value(count))
+                sql_rating = movies.annotate(value=expression).values_list('value', flat=True).get()
+                self.assertEqual(sql_rating, bayesian_rating(Decimal('8.1'), total, count), (total, count))
+    
+    def test_reconcile_ratings(self):
+        rate_movie(self.alice, self.movie.pk, 10)
+        rate_movie(self.bob, self.movie.pk, 6)
+        Movie.objects.filter(pk=self.movie.pk).update(rating=1, rating_sum=0, rating_count=0)
+        before = dict(Movie.objects.values_list('pk', 'updated_at'))
+        out = StringIO()
+        call_command('reconcile_ratings', stdout=out)
+        self.assertIn('1 movies had drifted', out.getvalue())
+        self.assertAggregates(self.movie, '8.0', 16, 2)
+        # Переписан только разошедшийся фильм - и его ETag меняется
+        after = dict(Movie.objects.values_list('pk', 'updated_at'))
+        self.assertGreater(after.pop(self.movie.pk), before.pop(self.movie.pk))
+        self.assertEqual(after, before)
+        # Без голосов и оценки автора фильм остаётся неоценённым
+        self.assertAggregates(self.unrated, '0', 0, 0)
+
+
+class SimilarMoviesTest(CacheResetTestCase):
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.horror = Category.objects.create(name='Horror')
+        cls.comedy = Category.objects.create(name='Comedy')
+        cls.slasher, cls.space, cls.romance = (Genre.objects.create(name=name) for name in ('Slasher', 'Space', 'Romance'))
+        cls.alien = Movie.objects.create(title='Alien', description='Crew of a space freighter hunted', category=cls.horror)
+        cls.aliens = Movie.objects.create(title='Aliens', description='Marines hunted on a space colony', category=cls.horror)
+        cls.event = Movie.objects.create(title='Event Horizon', description='Rescue crew on a lost ship', category=cls.horror)
+        cls.notting = Movie.objects.create(title='Notting Hill', description='Bookseller meets a star', category=cls.comedy)
+        cls.plain = Movie.objects.create(title='Untitled')
+        for movie in (cls.alien, cls.aliens, cls.event):
+            movie.genres.add(cls.space, cls.slasher)
+        cls.notting.genres.add(cls.romance)
+    
+    def test_neighbours_ranked_by_shared_features(self):
+        self.assertEqual(build_similarity_index(), (5, 6))
+        self.assertEqual(similar_movies(self.alien.pk)[0], self.aliens)
+        self.assertEqual(set(similar_movies(self.alien.pk)), {self.aliens, self.event})
+        # Без общих признаков соседей нет
+        self.assertEqual(similar_movies(self.notting.pk), [])
+        self.assertEqual(similar_movies(self.plain.pk), [])
+        with self.assertNumQueries(1):
+            similar_movies(self.event.pk)
+        scores = list(SimilarMovie.objects.filter(movie=self.alien).values_list('score', flat=True))
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        self.assertTrue(all(0 < score <= 1 for score in scores))
+    
+    def test_rebuild_replaces_neighbours_and_detail_page(self):
+        url = reverse('movies:detail', args=[self.notting.pk])
+        response = self.client.get(url)
+        self.assertNotContains(response, 'More like this')
+        
+        self.plain.genres.add(self.romance)
+        out = StringIO()
+        call_command('build_similarity', workers=1, stdout=out)
+        self.assertIn('neighbours for 5 movies', out.getvalue())
+        self.assertEqual(similar_movies(self.notting.pk), [self.plain])
+        # Версия индекса входит в ETag страницы
+        stale = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(stale.status_code, 200)
+        self.assertContains(stale, 'More like this')
+        self.assertContains(stale, reverse('movies:detail', args=[self.plain.pk]))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plain.delete()
+        self.assertEqual(similar_movies(self.notting.pk), [])
+    
+    def test_worker_processes_match_single_process(self):
+        build_similarity_index(chunk_size=2)
+        expected = list(SimilarMovie.objects.values_list('movie', 'similar', 'rank'))
+        self.assertEqual(build_similarity_index(workers=2, chunk_size=2), (5, 6))
+        self.assertEqual(list(SimilarMovie.objects.values_list('movie', 'similar', 'rank')), expected)
+
+
+calls = []
+
+
+@task('tests.flaky')
+def flaky_task(fail=0):
+    calls.append(fail)
+    if len(calls) <= fail:
+        raise RuntimeError('flaky')
+
+
+class TaskQueueTest(TestCase):
+    
+    def setUp(self):
+        calls.clear()
+    
+    def test_idempotency_key_and_rollback(self):
+        enqueue('tests.flaky', key='flaky:1')
+        enqueue('tests.flaky', key='flaky:1')
+        enqueue('tests.flaky', key='flaky:2')
+        self.assertEqual(Task.objects.count(), 2)
+        # Задача ставится в транзакции вызывающего и откатывается вместе с ней
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue('tests.flaky', key='flaky:3')
+            raise RuntimeError
+        self.assertEqual(Task.objects.count(), 2)
+        with self.assertRaises(ValueError):
+            enqueue('tests.missing')
+    
+    def test_retries_with_backoff_then_fails(self):
+        enqueue('tests.flaky', fail=1)
+        with self.assertLogs('movies.tasks', 'WARNING') as logs:
+            Worker().run(burst=True)
+        self.assertEqual(len(logs.records), 1)
+        self.assertRegex(logs.output[0], r'^WARNING:movies\.tasks:Task tests\.flaky #\d+ failed \(attempt 1\), retrying in')
+        queued = Task.objects.get()
+        self.assertEqual((queued.status, queued.attempts), (Task.QUEUED, 1))
+        self.assertIn('RuntimeError', queued.last_error)
+        self.assertGreater(queued.run_after, timezone.now())
+        Task.objects.update(run_after=timezone.now())
+        Worker().run(burst=True)
+        self.assertEqual(Task.objects.get().status, Task.DONE)
+        
+        enqueue('tests.flaky', fail=10)
+        Task.objects.filter(status=Task.QUEUED).update(max_attempts=1)
+        worker = Worker()
+        with self.assertLogs('movies.tasks', 'ERROR') as logs:
+            worker.run(burst=True)
+        self.assertEqual(len(logs.records), 1)
+        self.assertRegex(logs.output[0], r'^ERROR:movies\.tasks:Task tests\.flaky #\d+ failed after 1 attempts:')
+        self.assertIn('RuntimeError: flaky', logs.output[0])
+        self.assertEqual(worker.failed, 1)
+        self.assertEqual(Task.objects.filter(status=Task.FAILED).count(), 1)
+    
+    def test_claims_are_exclusive_and_leases_expire(self):
+        enqueue('tests.flaky')
+        self.assertEqual(len(claim_tasks('a', 10)), 1)
+        self.assertEqual(claim_tasks('b', 10), [])
+        # Обработчик a пропал: по истечении аренды задачу забирает b
+        Task.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(Worker(concurrency=2).run(burst=True), 1)
+        self.assertEqual(Task.objects.get().attempts, 2)
+        self.assertEqual(calls, [0])
@@ -0,0 +1,91 @@
+"""
+Проверки числа SQL-запросов для тестов представлений.
+
+QueryCountAssertionsMixin подмешивается к django.test.TestCase:
+assertConstantQueries() проверяет, что число запросов не зависит от объёма
+данных, assertWithinQueryBudget() - что представление укладывается в бюджет
+из QUERY_BUDGETS. При провале в сообщение попадают сами запросы, а повторяющиеся
+(кандидаты в N+1) сгруппированы по шаблону.
+
+CacheResetTestCase - база для тестов кэшируемых представлений: откат транзакции
+теста не трогает кэши, поэтому они очищаются перед каждым тестом.
+"""
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .instrumentation import get_query_budgets
+
+
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def normalize_sql(sql):
+    """Шаблон запроса без литералов: одинаковые запросы с разными id совпадают"""
+    return LITERAL_RE.sub('?', sql)
+
+
+def format_queries(queries, title):
+    lines = [f'{title} ({len(queries)}):']
+    lines += [f'  {i}. {query["sql"]}' for i, query in enumerate(queries, start=1)]
+    repeated = [(sql, n) for sql, n in Counter(normalize_sql(q['sql']) for q in queries).most_common() if n > 1]
+    if repeated:
+        lines.append('Repeated queries:')
+        lines += [f'  {n} x {sql}' for sql, n in repeated]
+    return '\n'.join(lines)
+
+
+class CacheResetTestCase(TestCase):
+    """TestCase, который очищает все кэши из CACHES перед каждым тестом"""
+
+    def setUp(self):
+        super().setUp()
+        for alias in settings.CACHES:
+            caches[alias].clear()
+
+
+class QueryCountAssertionsMixin:
+    using = DEFAULT_DB_ALIAS
+
+    def capture_request(self, url, client=None, **extra):
+        """
+        Выполнить GET с холодным кэшем и вернуть (ответ, запросы).
+        Потоковый ответ читается целиком внутри замера
+        """
+        client = client or self.client
+        cache.clear()
+        with CaptureQueriesContext(connections[self.using]) as captured:
+            response = client.get(url, **extra)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response, captured.captured_queries
+
+    def assertConstantQueries(self, url, grow, client=None, **extra):
+        """
+        Число запросов к url не меняется после grow(), которая добавляет данные.
+        Первый запрос прогревает кэши уровня процесса (ContentType и т. п.)
+        """
+        self.capture_request(url, client, **extra)
+        before_response, before = self.capture_request(url, client, **extra)
+        grow()
+        after_response, after = self.capture_request(url, client, **extra)
+        self.assertEqual(before_response.status_code, after_response.status_code)
+        if len(before) != len(after):
+            self.fail(
+                f'{url} ran {len(before)} queries before and {len(after)} after adding data\n'
+                + format_queries(after, 'Queries after adding data')
+            )
+        return after_response
+
+    def assertWithinQueryBudget(self, url, view_name, client=None, **extra):
+        """Число запросов к url не больше бюджета view_name из QUERY_BUDGETS"""
+        budget = get_query_budgets()[view_name]
+        response, queries = self.capture_request(url, client, **extra)
+        if len(queries) > budget:
+            self.fail(f'{view_name} ran {len(queries)} queries, budget is {budget}\n' + format_queries(queries, 'Queries'))
+        return response
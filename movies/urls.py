@@ -1,17 +1,31 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 from django.contrib.auth import views as auth_views
 
 app_name = 'movies'
 
+
+def catalogue_view(name, view, async_view):
+    """
+    Представление маршрута name: асинхронное (для ASGI), если name указан
+    в настройке MOVIES_ASYNC_VIEWS, иначе синхронное
+    """
+    use_async = name in getattr(settings, 'MOVIES_ASYNC_VIEWS', [])
+    return (async_view if use_async else view).as_view()
+
+
 urlpatterns = [
     # Movie URLs
-    path('', views.MovieListView.as_view(), name='list'),
-    path('movie/<int:pk>/', views.MovieDetailView.as_view(), name='detail'),
+    path('', catalogue_view('list', views.MovieListView, async_views.AsyncMovieListView), name='list'),
+    path('movie/<int:pk>/', catalogue_view('detail', views.MovieDetailView, async_views.AsyncMovieDetailView), name='detail'),
     path('movie/<int:pk>/edit/', views.MovieEditView.as_view(), name='edit'),
     path('movie/<int:pk>/delete/', views.MovieDeleteView.as_view(), name='delete'),
+    path('movie/<int:pk>/rate/', views.RateMovieView.as_view(), name='rate'),
     path('create/', views.MovieCreateView.as_view(), name='create'),
-    path('ajax/filter/', views.AjaxFilterView.as_view(), name='ajax_filter'),
+    path('ajax/filter/', catalogue_view('ajax_filter', views.AjaxFilterView, async_views.AsyncAjaxFilterView), name='ajax_filter'),
+    path('export/', views.MovieExportView.as_view(), name='export'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
     
     # User & Auth URLs
     path('register/', views.RegisterView.as_view(), name='register'),
@@ -22,6 +36,7 @@ urlpatterns = [
     path('profile/edit/', views.ProfileEditView.as_view(), name='profile_edit'),
     path('profile/', views.ProfileView.as_view(), name='profile'),
     path('profile/<str:username>/', views.ProfileView.as_view(), name='user_profile'),
+    path('profile/<str:username>/movies/', views.ProfileMoviesView.as_view(), name='profile_movies'),
 ]
 
 
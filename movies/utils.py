@@ -1,43 +1,28 @@
-from django.db.models import Q
-from .models import Movie
+from .config import MAX_VOTE, MIN_VOTE
+from .filters import MovieFilter
 
 
-def filter_movies(queryset, search_query=None, category_id=None, genre_ids=None, sort_by=None):
+def filter_movies(queryset, search_query=None, category_id=None, genre_ids=None, sort_by=None, genre_mode='any'):
     """
-    Фильтрация фильмов по различным критериям
+    Фильтрация фильмов по различным критериям (через MovieFilter)
     """
-    if search_query:
-        search_query = search_query.strip()
-        if search_query:
-            tokens = [t for t in search_query.split() if t]
-            q_objects = Q()
-            for token in tokens:
-                q_objects &= Q(title__icontains=token) | Q(description__icontains=token)
-            queryset = queryset.filter(q_objects)
-    
-    if category_id:
-        try:
-            queryset = queryset.filter(category__id=int(category_id))
-        except (ValueError, TypeError):
-            pass
-    
-    if genre_ids:
-        queryset = queryset.filter(genres__id__in=genre_ids).distinct()
-    
-    if sort_by:
-        valid_sorts = ['-created_at', 'created_at', 'title', '-title', '-rating', 'rating']
-        if sort_by in valid_sorts:
-            queryset = queryset.order_by(sort_by)
-    
+    movie_filter = MovieFilter(
+        q=search_query or '', category=category_id, genre=genre_ids, genre_mode=genre_mode, sort=sort_by,
+    )
+    queryset = movie_filter.apply(queryset)
+    if movie_filter.sort:
+        queryset = movie_filter.order(queryset)
     return queryset
 
 
-def get_movie_context(movie, user):
+def get_movie_context(movie, user, user_score=None):
     """
-    Получить контекст для фильма
+    Получить контекст для фильма; user_score - голос посетителя (movies.ratings)
     """
     return {
         'movie': movie,
         'is_author': movie.author == user if user.is_authenticated else False,
         'is_staff': user.is_staff if user.is_authenticated else False,
+        'user_score': user_score,
+        'vote_scores': range(MIN_VOTE, MAX_VOTE + 1),
     }
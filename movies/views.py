@@ -1,3 +1,5 @@
+import json
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
@@ -5,117 +7,213 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.urls import reverse_lazy
-from django.db.models import Q
+from django.template.loader import render_to_string
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.core.cache import cache
+from django.conf import settings
+from django.db import router
+from django.utils.crypto import constant_time_compare
 
-from .models import Movie, Category, Genre, UserProfile
-from .forms import MovieForm, RegisterForm, UserProfileForm, MovieEditForm
-from .mixins import MovieOwnerTestMixin
+from .models import Movie, UserProfile
+from .forms import MovieForm, RatingForm, RegisterForm, UserProfileForm, MovieEditForm
+from .mixins import (
+    CardsFragmentMixin, ConditionalGetMixin, LeaderboardMixin, MovieOwnerTestMixin, MovieFilterMixin, ProfileMoviesMixin,
+    ReplicaReadMixin,
+)
+from .config import CACHE_TIMEOUT, MAX_VOTE, MIN_VOTE, MOVIES_PER_PAGE, MOVIES_PAGINATION_MODE, MOVIES_COUNT_MODE
+from .pagination import KeysetPaginator, InvalidCursor
+from .cache import get_categories, get_genres
+from .conditional import make_etag, movie_detail_validators, movie_detail_versions, taxonomy_version, viewer_version
+from .instrumentation import METRICS
+from .leaderboards import top_movies
+from .ratings import edited_fields, rate_movie, refresh_rating, user_score
+from .routers import replica_reads
+from .similarity import get_similarity_version, similar_movies
+from .utils import get_movie_context
+from .exporter import EXPORT_FORMATS, ExportError, export_queryset, stream_export
 
 
-class MovieListView(ListView):
+class MovieListView(ReplicaReadMixin, ConditionalGetMixin, LeaderboardMixin, MovieFilterMixin, ListView):
     model = Movie
     template_name = 'movies/movie_list.html'
     context_object_name = 'movies'
-    paginate_by = 12
+    paginate_by = MOVIES_PER_PAGE
+    pagination_mode = MOVIES_PAGINATION_MODE
+    count_mode = MOVIES_COUNT_MODE
+    
+    def get(self, request, *args, **kwargs):
+        try:
+            return super().get(request, *args, **kwargs)
+        except InvalidCursor:
+            # Курсор разбирается при сборке контекста, как и в AjaxFilterView - 400
+            return HttpResponseBadRequest('Invalid cursor')
     
     def get_queryset(self):
-        qs = Movie.objects.all().select_related('category', 'author').prefetch_related('genres')
-        
-        search = self.request.GET.get('q', '').strip()
-        category = self.request.GET.get('category')
-        genres = self.request.GET.getlist('genre')
-        sort = self.request.GET.get('sort', '-created_at')
-        
-        if search:
-            tokens = [t for t in search.split() if t]
-            q_obj = Q()
-            for token in tokens:
-                q_obj &= (Q(title__icontains=token) | Q(description__icontains=token))
-            qs = qs.filter(q_obj)
-        
-        if category:
-            try:
-                qs = qs.filter(category__id=int(category))
-            except (ValueError, TypeError):
-                pass
-        
-        if genres:
-            try:
-                genre_ids = [int(g) for g in genres]
-                qs = qs.filter(genres__id__in=genre_ids).distinct()
-            except (ValueError, TypeError):
-                pass
-        
-        valid_sorts = ['-created_at', 'created_at', 'title', '-title', '-rating', 'rating']
-        if sort in valid_sorts:
-            qs = qs.order_by(sort)
-        
-        return qs
+        return self.get_filtered_queryset()
+    
+    def get_validators(self):
+        # Поколение каталога и нормализованные фильтры (оба в ключе кэша) плюс посетитель
+        viewer_key = viewer_version(self.request.user, self.request)[0]
+        return make_etag('list', self.get_cache_key('page'), viewer_key), None
+    
+    def is_cursor_mode(self):
+        return self.pagination_mode == 'cursor' or 'after' in self.request.GET
+    
+    def paginate_queryset(self, queryset, page_size):
+        scope = self.get_leaderboard_scope()
+        top = top_movies(scope, page_size, queryset) if scope else None
+        if top is not None:
+            paginator, page = self.leaderboard_page(queryset, page_size, *top)
+            return (paginator, page, page.object_list, page.has_other_pages())
+        if not self.is_cursor_mode():
+            return super().paginate_queryset(queryset, page_size)
+        paginator = KeysetPaginator(queryset, page_size, count_mode=self.count_mode)
+        page = paginator.page(self.request.GET.get('after'))
+        return (paginator, page, page.object_list, page.has_other_pages())
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
-        context['genres'] = Genre.objects.all()
-        context['q'] = self.request.GET.get('q', '')
-        context['category'] = self.request.GET.get('category', '')
-        context['sort'] = self.request.GET.get('sort', '-created_at')
-        
-        genres_selected = self.request.GET.getlist('genre')
-        try:
-            context['selected_genres'] = [int(g) for g in genres_selected]
-        except (ValueError, TypeError):
-            context['selected_genres'] = []
-        
+        context['cursor_mode'] = self.is_cursor_mode()
+        context['cards_cache_key'] = self.get_cache_key('movie_cards')
+        context.update(self.get_facet_context())
+        context.update(self.get_filter_context())
         return context
 
 
-class AjaxFilterView(View):
+class AjaxFilterView(ReplicaReadMixin, ConditionalGetMixin, CardsFragmentMixin, MovieFilterMixin, View):
+    """
+    Фрагмент карточек для AJAX-фильтра. Отдаёт не больше одной страницы (keyset),
+    курсор следующей страницы передаётся в заголовках X-Next-Cursor / X-Next-Page-Url,
+    фасетные счётчики - в заголовке X-Facets (JSON)
+    """
+    paginate_by = MOVIES_PER_PAGE
+    
+    def get_validators(self):
+        # Фрагмент не зависит от посетителя
+        return make_etag('ajax', self.get_cache_key('ajax_filter')), None
+    
     def get(self, request):
-        qs = Movie.objects.all().select_related('category', 'author').prefetch_related('genres')
-        
-        search = request.GET.get('q', '').strip()
-        category = request.GET.get('category')
-        genres = request.GET.getlist('genre')
-        
-        if search:
-            tokens = [t for t in search.split() if t]
-            q_obj = Q()
-            for token in tokens:
-                q_obj &= (Q(title__icontains=token) | Q(description__icontains=token))
-            qs = qs.filter(q_obj)
-        
-        if category:
+        key = self.get_cache_key('ajax_filter')
+        cached = cache.get(key)
+        if cached is None:
+            paginator = KeysetPaginator(self.get_filtered_queryset(), self.paginate_by)
             try:
-                qs = qs.filter(category__id=int(category))
-            except (ValueError, TypeError):
-                pass
+                page = paginator.page(request.GET.get('after'))
+            except InvalidCursor:
+                return HttpResponseBadRequest('Invalid cursor')
+            
+            content = render_to_string('movies/_movie_cards.html', {'movies': page.object_list}, request)
+            cached = (content, *self.get_next_page(page), json.dumps(self.get_facets()))
+            cache.set(key, cached, CACHE_TIMEOUT)
+        return self.fragment_response(*cached)
+
+
+class MovieExportView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Потоковая выгрузка каталога для сотрудников: ?format=csv|jsonl|parquet
+    и те же фильтры q / category / genre / genre_mode, что у filter_movies
+    """
+    
+    def test_func(self):
+        return self.request.user.is_staff
+    
+    def get(self, request):
+        fmt = request.GET.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return HttpResponseBadRequest('Unknown export format')
         
-        if genres:
-            try:
-                genre_ids = [int(g) for g in genres]
-                qs = qs.filter(genres__id__in=genre_ids).distinct()
-            except (ValueError, TypeError):
-                pass
+        try:
+            genre_ids = [int(g) for g in request.GET.getlist('genre')]
+        except (ValueError, TypeError):
+            return HttpResponseBadRequest('Invalid genre')
+        
+        # Поток читается уже после выхода из view, поэтому БД реплики выбирается явно
+        with replica_reads():
+            using = router.db_for_read(Movie)
+        queryset = export_queryset(
+            search_query=request.GET.get('q', '').strip(),
+            category_id=request.GET.get('category'),
+            genre_ids=genre_ids,
+            genre_mode=request.GET.get('genre_mode', 'any'),
+            using=using,
+        )
+        try:
+            chunks = stream_export(queryset, fmt)
+        except ExportError as exc:
+            return HttpResponseBadRequest(str(exc))
         
-        return render(request, 'movies/_movie_cards.html', {'movies': qs})
+        response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[fmt]['content_type'])
+        response['Content-Disposition'] = f'attachment; filename="movies.{EXPORT_FORMATS[fmt]["extension"]}"'
+        return response
 
 
-class MovieDetailView(DetailView):
+class MetricsView(View):
+    """
+    Метрики InstrumentationMiddleware в текстовом формате Prometheus.
+    Доступны сотрудникам и по заголовку Authorization: Bearer <MOVIES_METRICS_TOKEN>
+    """
+    
+    def has_access(self, request):
+        token = getattr(settings, 'MOVIES_METRICS_TOKEN', None)
+        header = request.headers.get('Authorization', '')
+        if token and constant_time_compare(header, f'Bearer {token}'):
+            return True
+        return request.user.is_authenticated and request.user.is_staff
+    
+    def get(self, request):
+        if not self.has_access(request):
+            return HttpResponse('Forbidden', status=403, content_type='text/plain')
+        return HttpResponse(METRICS.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class MovieDetailView(ReplicaReadMixin, ConditionalGetMixin, DetailView):
     model = Movie
     template_name = 'movies/movie_detail.html'
     context_object_name = 'movie'
     queryset = Movie.objects.select_related('category', 'author').prefetch_related('genres')
     
+    def get_validators(self):
+        row = movie_detail_versions(self.kwargs['pk'])
+        if row is None:
+            return None, None
+        taxonomy = taxonomy_version(get_categories(), get_genres())
+        return movie_detail_validators(
+            self.kwargs['pk'], row, taxonomy, viewer_version(self.request.user, self.request), get_similarity_version(),
+        )
+    
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['is_author'] = (
-            self.object.author == self.request.user 
-            if self.request.user.is_authenticated else False
-        )
-        context['is_staff'] = self.request.user.is_staff if self.request.user.is_authenticated else False
+        user = self.request.user
+        context.update(get_movie_context(self.object, user, user_score(user, self.object.pk)))
+        context['similar_movies'] = similar_movies(self.object.pk)
         return context
 
 
+class RateMovieView(LoginRequiredMixin, View):
+    """
+    Голос за фильм (POST score). На AJAX-запрос отвечает JSON с новым
+    рейтингом, иначе возвращает на страницу фильма
+    """
+    
+    def post(self, request, pk):
+        form = RatingForm(request.POST)
+        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+        if not form.is_valid():
+            if is_ajax:
+                return JsonResponse({'errors': form.errors}, status=400)
+            messages.error(request, f'Rating must be a whole number from {MIN_VOTE} to {MAX_VOTE}')
+            return redirect('movies:detail', pk=pk)
+        score = form.cleaned_data['score']
+        try:
+            rating, count = rate_movie(request.user, pk, score)
+        except Movie.DoesNotExist:
+            raise Http404('No movie found matching the query')
+        if is_ajax:
+            return JsonResponse({'rating': str(rating), 'rating_count': count, 'score': score})
+        messages.success(request, 'Thanks for rating!')
+        return redirect('movies:detail', pk=pk)
+
+
 class MovieCreateView(LoginRequiredMixin, CreateView):
     model = Movie
     form_class = MovieForm
@@ -137,6 +235,14 @@ class MovieEditView(LoginRequiredMixin, MovieOwnerTestMixin, UpdateView):
     context_object_name = 'movie'
     queryset = Movie.objects.select_related('category', 'author').prefetch_related('genres')
     
+    def form_valid(self, form):
+        self.object = form.save(commit=False)
+        self.object.save(update_fields=edited_fields(form))
+        form.save_m2m()
+        if 'author_rating' in form.changed_data:
+            refresh_rating(self.object)
+        return redirect(self.get_success_url())
+    
     def get_success_url(self):
         messages.success(self.request, 'Movie updated successfully!')
         return reverse_lazy('movies:detail', kwargs={'pk': self.object.pk})
@@ -164,41 +270,68 @@ class RegisterView(CreateView):
         return super().form_valid(form)
 
 
-class ProfileView(DetailView):
+class ProfileView(ReplicaReadMixin, ProfileMoviesMixin, DetailView):
     model = User
     template_name = 'movies/profile.html'
     context_object_name = 'profile_user'
     slug_field = 'username'
     slug_url_kwarg = 'username'
     
-    def get_object(self, queryset=None):
-        username = self.kwargs.get('username')
-        if username:
-            return get_object_or_404(User, username=username)
-        if not self.request.user.is_authenticated:
-            messages.error(self.request, 'Please log in to view your profile')
+    def get(self, request, *args, **kwargs):
+        if not kwargs.get('username') and not request.user.is_authenticated:
+            messages.error(request, 'Please log in to view your profile')
             return redirect('movies:login')
-        return self.request.user
+        try:
+            return super().get(request, *args, **kwargs)
+        except InvalidCursor:
+            # Как и ProfileMoviesView: контекст (и курсор) разбирается здесь же, в get()
+            return HttpResponseBadRequest('Invalid cursor')
+    
+    def get_object(self, queryset=None):
+        username = self.kwargs.get('username', self.request.user.username)
+        return get_object_or_404(self.get_queryset(), username=username)
     
     def get_queryset(self):
-        return User.objects.prefetch_related('movies', 'profile')
+        # Фильмы выводятся постранично, поэтому целиком их не подгружаем
+        return User.objects.select_related('profile')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         user = context['profile_user']
         
-        try:
-            profile = user.profile
-        except UserProfile.DoesNotExist:
-            profile = UserProfile.objects.create(user=user)
+        paginator = self.get_movies_paginator(user, count_mode='estimate')
+        page, next_url = self.get_movies_page(paginator, user)
         
-        context['profile'] = profile
-        context['user_movies'] = user.movies.select_related('category').prefetch_related('genres')
+        # Профиля может не быть (см. backfill_profiles) - GET ничего не создаёт
+        context['profile'] = getattr(user, 'profile', None)
+        context['user_movies'] = page
+        context['user_movies_count'] = paginator.count_label
+        context['next_movies_url'] = next_url
         context['is_owner'] = user == self.request.user if self.request.user.is_authenticated else False
         
         return context
 
 
+class ProfileMoviesView(ReplicaReadMixin, ProfileMoviesMixin, View):
+    """
+    Следующие страницы фильмов профиля (фрагмент _movie_cards.html),
+    адрес следующей страницы - в заголовке X-Next-Page-Url
+    """
+    
+    def get(self, request, username):
+        user = get_object_or_404(User.objects.only('pk', 'username'), username=username)
+        try:
+            page, next_url = self.get_movies_page(self.get_movies_paginator(user), user)
+        except InvalidCursor:
+            return HttpResponseBadRequest('Invalid cursor')
+        
+        response = render(request, 'movies/_movie_cards.html', {'movies': page.object_list})
+        if next_url:
+            response['X-Next-Cursor'] = page.next_cursor
+            response['X-Next-Page-Url'] = next_url
+        return response
+
+
 class ProfileEditView(LoginRequiredMixin, UpdateView):
     model = UserProfile
     form_class = UserProfileForm
@@ -206,12 +339,9 @@ class ProfileEditView(LoginRequiredMixin, UpdateView):
     context_object_name = 'profile'
     
     def get_object(self, queryset=None):
-        try:
-            profile = self.request.user.profile
-        except UserProfile.DoesNotExist:
-            profile = UserProfile.objects.create(user=self.request.user)
-        return profile
+        # Недостающий профиль создаётся только при сохранении формы
+        return getattr(self.request.user, 'profile', None) or UserProfile(user=self.request.user)
     
     def get_success_url(self):
         messages.success(self.request, 'Profile updated successfully!')
-        return reverse_lazy('movies:profile', kwargs={'username': self.request.user.username})
+        return reverse_lazy('movies:user_profile', kwargs={'username': self.request.user.username})